@@ -12,19 +12,38 @@ from gutenberg2zim.constants import VERSION
 from gutenberg2zim.orchestrator import run_scrape
 
 help_info = (
-    """Usage: gutenberg2zim [--overwrite] [-l LANGS] [-f FORMATS] """
+    """Usage: gutenberg2zim [--overwrite] [--journal] [--resume] [-l LANGS] """
+    """[-f FORMATS] """
     """[-z ZIM_PATH] [-b BOOKS] """
     """[-t ZIM_TITLE] [-n ZIM_DESC] [-L ZIM_LONG_DESC] """
     """[--zim-languages LANGUAGES] [--zim-name ZIM_NAME] [-c CONCURRENCY] """
-    """[--no-index] [--title-search] [--lcc-shelves SHELVES] """
+    """[--metadata-concurrency NB] [--transform-concurrency NB] """
+    """[--transform-processes NB] [--transform-chunk-size NB] """
+    """[--async-downloads] [--host-connections NB] [--host-rps NB] """
+    """[--host-bandwidth KIBPS] """
+    """[--no-index] [--title-search] [--rdf-archive] [--lcc-shelves SHELVES] """
     """[--stats-filename STATS_FILENAME] [--publisher ZIM_PUBLISHER] """
     """[--mirror-url MIRROR_URL] [--output OUTPUT_FOLDER] """
+    """[--cache-dir CACHE_FOLDER] [--metadata-ttl HOURS] [--cache-max-size MIB] """
+    """[--image-cache-max-size MIB] [--epub-cache-max-size MIB] """
+    """[--max-image-dimension PX] """
+    """[--image-encoder-budget MS] """
+    """[--tmp-dir TMP_FOLDER] [--spill-threshold MIB] [--html-rewriter ENGINE] """
     """[--primary-color COLOR] [--secondary-color COLOR] """
     """[--ui-dist UI_DIST] [--debug] """
     """
 
 -h --help                       Display this help message
 --overwrite                     Overwrite ZIM file if target already exists
+--journal                       Keep a journal of the scrape next to the ZIM, """
+    """for --resume to resume it if interrupted. The journal keeps the ZIM """
+    """entries of books until the ZIM is finished: book files kept on disk are """
+    """hard-linked to it, others written uncompressed (up to the size of the ZIM """
+    """content)
+--resume                        Resume an interrupted scrape run with """
+    """--journal: books completed by the previous run are replayed from its """
+    """journal instead of being downloaded and processed again (the journal """
+    """being kept on)
 
 -l --languages=<list>           Comma-separated list of lang codes to filter"""
     """ export to (preferably ISO 639-1, else ISO 639-3)
@@ -41,16 +60,68 @@ help_info = (
 -b --books=<ids>                Execute the processes for specific books, """
     """separated by commas, or dashes for intervals
 -c --concurrency=<nb>           Number of concurrent process for processing """
-    """tasks
+    """tasks (book downloads)
+--metadata-concurrency=<nb>     Number of concurrent RDF metadata fetches. """
+    """Default: same as --concurrency
+--transform-concurrency=<nb>    Number of concurrent HTML rewriting/image """
+    """optimization workers. Default: number of CPUs
+--transform-processes=<nb>      Number of processes rewriting HTML and """
+    """optimizing images/EPUBs, transform workers handing them book files; the """
+    """members of an EPUB are only optimized in parallel by them. """
+    """Default: none (done by transform workers)
+--transform-chunk-size=<nb>     With --transform-processes, number of book """
+    """files handed at once to a process. Default: 8
+--async-downloads               Download books with an asyncio engine: up to """
+    """--concurrency books are downloaded at once without one thread each
+--host-connections=<nb>         With --async-downloads, maximum number of open """
+    """connections per host. Default: 8
+--host-rps=<nb>                 Maximum number of requests started per second """
+    """per mirror (catalog, RDFs, books, covers). Default: no limit
+--host-bandwidth=<kibps>        Maximum download rate per mirror, in KiB/s. """
+    """Default: no limit
 --no-index                      Do NOT create full-text index within ZIM file
 --title-search                  Add field to search a book by title and directly """
     """jump to it
+--rdf-archive                   Load book metadata from the bulk RDF archive """
+    """(rdf-files.tar.bz2) instead of one RDF download per book; faster for """
+    """large selections
 --lcc-shelves=<shelves>         Comma-separated list of LCC shelf codes to include """
     """(e.g., P,PR,Q). Use 'all' to generate all shelves. If omitted, no shelf generated
 --stats-filename=<filename>  Path to store the progress JSON file to
 --publisher=<zim_publisher>     Custom Publisher in ZIM Metadata (openZIM otherwise)
---mirror-url=<mirror_url>       Optional custom url of mirror hosting Gutenberg files
+--mirror-url=<mirror_url>       Optional custom url of mirror hosting Gutenberg """
+    """files, or comma-separated list of mirrors to spread requests across """
+    """(the fastest healthy ones being preferred, failing over to the others). """
+    """May also be a local copy of the mirror tree (file:// URL or folder), """
+    """read straight from disk
 --output=<output_folder>        Output folder for ZIMs. Default: ./output
+--cache-dir=<cache_folder>      Folder where data is cached across runs (parsed """
+    """RDF metadata, downloaded book files, formats missing on the mirror, """
+    """optimized images and EPUBs). Default: no cache
+--metadata-ttl=<hours>          Hours during which cached RDF metadata is """
+    """trusted without asking the mirror whether it changed. Default: 0
+--cache-max-size=<mib>          Maximum size in MiB of the downloaded book files """
+    """kept in the cache folder, least recently used ones being evicted first. """
+    """Default: no limit
+--image-cache-max-size=<mib>    Maximum size in MiB of the optimized images """
+    """kept in the cache folder, least recently used ones being evicted at the """
+    """start and end of a run. Default: no limit
+--epub-cache-max-size=<mib>     Maximum size in MiB of the optimized EPUBs """
+    """kept in the cache folder, least recently used ones being evicted at the """
+    """start and end of a run. Default: no limit
+--tmp-dir=<tmp_folder>          Folder for temporary files (downloads when no """
+    """cache folder is set, large book files). Default: system temporary folder
+--spill-threshold=<mib>         Size in MiB above which a book file is kept in """
+    """a temporary file instead of memory while being processed. Default: 8
+--html-rewriter=<engine>        Engine rewriting book HTML pages: soup """
+    """(BeautifulSoup) or lxml (single pass, faster, same output). Default: soup
+--max-image-dimension=<px>      Downscale book images converted to WebP whose """
+    """width or height is larger, JPEGs being decoded at a reduced scale; HTML """
+    """pages get their stored width/height. Default: images kept at their size
+--image-encoder-budget=<ms>     CPU time in milliseconds per book image for """
+    """trying other encodings than the default WebP one (lossless WebP, """
+    """original image kept, static GIFs in WebP), the smallest one being """
+    """stored. Default: default WebP encoding only
 --primary-color=<color>         Custom primary color. Hex/HTML syntax (#1976D2)
 --secondary-color=<color>       Custom secondary color. Hex/HTML syntax (#424242)
 --ui-dist=<ui_dist>              Directory containing Vue.js UI build output (ui/dist).
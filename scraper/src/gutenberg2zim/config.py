@@ -12,8 +12,10 @@ from pathlib import Path
 from zimscraperlib.image.probing import is_hex_color
 from zimscraperlib.inputs import compute_descriptions
 
+from gutenberg2zim.core.local_mirror import local_mirror_url, local_path
 from gutenberg2zim.core.utils import ALL_FORMATS, critical_error
 from gutenberg2zim.sources.gutenberg.adapters import GUTENBERG_SOURCE
+from gutenberg2zim.sources.gutenberg.rewriting import HTML_REWRITERS
 
 SUPPORTED_LCC_SHELVES = [
     "A",
@@ -61,15 +63,47 @@ SUPPORTED_LCC_SHELVES = [
 @dataclass(frozen=True, slots=True)
 class ScrapeConfig:
     source: str
+    # canonical mirror (URLs are built against it), first of mirror_urls
     mirror_url: str
     output_folder: Path
     concurrency: int = 16
+    metadata_concurrency: int | None = None
+    transform_concurrency: int | None = None
+    # processes rewriting/optimizing book files (none: transform threads do)
+    transform_processes: int | None = None
+    # book files handed at once to a transform process
+    transform_chunk_size: int = 8
+    async_downloads: bool = False
+    host_connections: int = 8
+    # requests started and KiB received per second per mirror (none: no limit)
+    host_requests_per_second: int | None = None
+    host_bandwidth: int | None = None
     formats: list[str] = field(default_factory=lambda: ["epub", "pdf", "html"])
     books: list[str] | None = None
     languages: list[str] | None = None
     collections: list[str] | None = None
     ui_dist: Path | None = None
+    # all mirrors requests are spread across (none: mirror_url only)
+    mirror_urls: list[str] | None = None
     temp_dir: Path | None = None
+    cache_dir: Path | None = None
+    # hours during which cached RDF metadata is trusted without revalidation
+    metadata_ttl: int = 0
+    # MiB of downloaded book files kept in cache_dir (None: no limit)
+    cache_max_size: int | None = None
+    # MiB of optimized images kept in cache_dir (None: no limit)
+    image_cache_max_size: int | None = None
+    # MiB of optimized EPUBs kept in cache_dir (None: no limit)
+    epub_cache_max_size: int | None = None
+    # largest width/height of book images converted to WebP (None: no limit)
+    max_image_dimension: int | None = None
+    # ms of CPU time per book image for selecting the smallest encoding
+    # (None: default WebP encoding only)
+    image_encoder_budget: int | None = None
+    # MiB above which a book file is kept in temp_dir rather than in memory
+    spill_threshold: int = 8
+    # engine rewriting book HTML pages, one of HTML_REWRITERS
+    html_rewriter: str = "soup"
     debug: bool = False
     zim_file: str | None = None
     zim_name: str | None = None
@@ -79,8 +113,12 @@ class ScrapeConfig:
     zim_languages: list[str] | None = None
     publisher: str = "openZIM"
     overwrite: bool = False
+    # keep a journal of the scrape, to resume it (always with `resume`)
+    journal: bool = False
+    resume: bool = False
     is_selection: bool = False
     title_search: bool = False
+    use_rdf_archive: bool = False
     add_lcc_shelves: bool = False
     with_fulltext_index: bool = True
     stats_filename: str | None = None
@@ -96,11 +134,32 @@ def _validate_colors(primary_color: str | None, secondary_color: str | None) ->
         critical_error(f"--secondary-color is not a valid hex color: {secondary_color}")
 
 
+def _optional_positive_int(arguments: dict, flag: str) -> int | None:
+    """Parse an optional CLI integer that must be positive when passed"""
+    raw_value = arguments.get(flag)
+    if raw_value is None:
+        return None
+    if not str(raw_value).strip().isdigit() or int(raw_value) <= 0:
+        critical_error(f"{flag} must be a positive integer, got {raw_value}")
+    return int(raw_value)
+
+
 def build_scrape_config(arguments: dict) -> ScrapeConfig:
     """Turn parsed CLI arguments (docopt result) into a `ScrapeConfig`"""
     zim_file = arguments.get("--zim-file")
     zim_name = arguments.get("--zim-name")
-    mirror_url = arguments.get("--mirror-url") or "https://gutenberg.mirror.driftle.ss"
+    mirror_urls = [
+        local_mirror_url(url.strip()).rstrip("/")
+        for url in (
+            arguments.get("--mirror-url") or "https://gutenberg.mirror.driftle.ss"
+        ).split(",")
+        if url.strip()
+    ]
+    if not mirror_urls:
+        critical_error("--mirror-url must contain at least one mirror URL")
+    if len(mirror_urls) > 1 and any(local_path(url) for url in mirror_urls):
+        critical_error("A local --mirror-url cannot be combined with other mirrors")
+    mirror_url = mirror_urls[0]
 
     books_csv = arguments.get("--books") or ""
     zim_title = arguments.get("--zim-title")
@@ -111,8 +170,51 @@ def build_scrape_config(arguments: dict) -> ScrapeConfig:
     concurrency = int(arguments.get("--concurrency") or 16)
     if concurrency <= 0:
         critical_error(f"--concurrency must be a positive integer, got {concurrency}")
+    metadata_concurrency = _optional_positive_int(arguments, "--metadata-concurrency")
+    transform_concurrency = _optional_positive_int(arguments, "--transform-concurrency")
+    transform_processes = _optional_positive_int(arguments, "--transform-processes")
+    transform_chunk_size = (
+        _optional_positive_int(arguments, "--transform-chunk-size") or 8
+    )
+    async_downloads = arguments.get("--async-downloads", False)
+    host_connections = _optional_positive_int(arguments, "--host-connections") or 8
+    host_requests_per_second = _optional_positive_int(arguments, "--host-rps")
+    host_bandwidth = _optional_positive_int(arguments, "--host-bandwidth")
     overwrite = arguments.get("--overwrite", False)
+    resume = arguments.get("--resume", False)
+    journal = arguments.get("--journal", False) or resume
     title_search = arguments.get("--title-search", False)
+    use_rdf_archive = arguments.get("--rdf-archive", False)
+    cache_dir = (
+        Path(cache_dir_raw) if (cache_dir_raw := arguments.get("--cache-dir")) else None
+    )
+    metadata_ttl_raw = arguments.get("--metadata-ttl") or "0"
+    if not str(metadata_ttl_raw).strip().isdigit():
+        critical_error(
+            f"--metadata-ttl must be a non-negative integer, got {metadata_ttl_raw}"
+        )
+    metadata_ttl = int(metadata_ttl_raw)
+    cache_max_size = _optional_positive_int(arguments, "--cache-max-size")
+    image_cache_max_size = _optional_positive_int(arguments, "--image-cache-max-size")
+    epub_cache_max_size = _optional_positive_int(arguments, "--epub-cache-max-size")
+    max_image_dimension = _optional_positive_int(arguments, "--max-image-dimension")
+    image_encoder_budget = _optional_positive_int(arguments, "--image-encoder-budget")
+    temp_dir = (
+        Path(temp_dir_raw) if (temp_dir_raw := arguments.get("--tmp-dir")) else None
+    )
+    spill_threshold_raw = arguments.get("--spill-threshold") or "8"
+    if not str(spill_threshold_raw).strip().isdigit():
+        critical_error(
+            "--spill-threshold must be a non-negative integer, "
+            f"got {spill_threshold_raw}"
+        )
+    spill_threshold = int(spill_threshold_raw)
+    html_rewriter = arguments.get("--html-rewriter") or "soup"
+    if html_rewriter not in HTML_REWRITERS:
+        critical_error(
+            f"--html-rewriter must be one of {', '.join(HTML_REWRITERS)}, "
+            f"got {html_rewriter}"
+        )
 
     with_fulltext_index = not arguments.get("--no-index", False)
 
@@ -203,13 +305,32 @@ def build_scrape_config(arguments: dict) -> ScrapeConfig:
     return ScrapeConfig(
         source=GUTENBERG_SOURCE,
         mirror_url=mirror_url,
+        mirror_urls=mirror_urls,
         output_folder=output_folder,
         concurrency=concurrency,
+        metadata_concurrency=metadata_concurrency,
+        transform_concurrency=transform_concurrency,
+        transform_processes=transform_processes,
+        transform_chunk_size=transform_chunk_size,
+        async_downloads=async_downloads,
+        host_connections=host_connections,
+        host_requests_per_second=host_requests_per_second,
+        host_bandwidth=host_bandwidth,
         formats=formats,
         books=[str(book_id) for book_id in only_books_ids] or None,
         languages=languages or None,
         collections=lcc_shelves,
         ui_dist=ui_dist,
+        temp_dir=temp_dir,
+        cache_dir=cache_dir,
+        metadata_ttl=metadata_ttl,
+        cache_max_size=cache_max_size,
+        image_cache_max_size=image_cache_max_size,
+        epub_cache_max_size=epub_cache_max_size,
+        max_image_dimension=max_image_dimension,
+        image_encoder_budget=image_encoder_budget,
+        spill_threshold=spill_threshold,
+        html_rewriter=html_rewriter,
         debug=debug,
         zim_file=zim_file,
         zim_name=zim_name,
@@ -223,8 +344,11 @@ def build_scrape_config(arguments: dict) -> ScrapeConfig:
         ),
         publisher=publisher,
         overwrite=overwrite,
+        journal=journal,
+        resume=resume,
         is_selection=len(only_books_ids) > 0 or len(lcc_shelves or []) > 0,
         title_search=title_search,
+        use_rdf_archive=use_rdf_archive,
         add_lcc_shelves=add_lcc_shelves,
         with_fulltext_index=with_fulltext_index,
         stats_filename=stats_filename,
@@ -0,0 +1,214 @@
+"""Asyncio variant of the generic HTTP download engine.
+
+`AsyncDownloadEngine` keeps the `DownloadEngine` contract (`DownloadRequest`
+in, `DownloadResult` out, same on-disk cache, same retry policy, same
+requests exceptions on failure) but transfers files with aiohttp on an event
+loop running in a single background thread. Hundreds of requests can then be
+in flight without one OS thread blocked per request, with at most
+`connections_per_host` open connections to any host (requests and bytes per
+second budgets of each mirror are enforced by the `MirrorPool`).
+
+Coroutine callers use `download_async()`/`fetch_async()` (from any event
+loop); the blocking `download()`/`fetch()` keep working for thread-based
+callers, running `download_async()` on the engine loop. File operations (cache lookups,
+partial downloads, reads) run in threads, off the event loops, so that disk
+I/O never stalls the downloads in flight: response bodies are buffered and
+written by `WRITE_BUFFER_SIZE` blocks.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from http import HTTPStatus
+from pathlib import Path
+from typing import IO
+
+import aiohttp
+import backoff
+import requests
+
+from gutenberg2zim.constants import DEFAULT_HTTP_TIMEOUT, DL_CHUNCK_SIZE, logger
+from gutenberg2zim.core.download_engine import (
+    CACHE_READ_ATTEMPTS,
+    DownloadEngine,
+    DownloadResult,
+    PartialDownload,
+    TargetLocks,
+)
+from gutenberg2zim.core.mirror_pool import MirrorPool, MirrorTransfer
+from gutenberg2zim.core.ports import DownloadRequest
+from gutenberg2zim.core.spill import Payload, PayloadSpiller
+
+# bytes of a response body received before being written to disk
+WRITE_BUFFER_SIZE = 2**19
+
+
+def _is_fatal_client_error(exc: Exception) -> bool:
+    """Give up on error codes 400-499 except 429"""
+    return (
+        isinstance(exc, aiohttp.ClientResponseError)
+        and HTTPStatus.BAD_REQUEST <= exc.status < HTTPStatus.INTERNAL_SERVER_ERROR
+        and exc.status != HTTPStatus.TOO_MANY_REQUESTS
+    )
+
+
+def _as_requests_error(url: str, exc: Exception) -> requests.RequestException:
+    """Translate aiohttp errors to the requests ones raised by `DownloadEngine`"""
+    if isinstance(exc, aiohttp.ClientResponseError):
+        response = requests.Response()
+        response.status_code = exc.status
+        response.url = url
+        return requests.HTTPError(
+            f"{exc.status} Error: {exc.message} for url: {url}", response=response
+        )
+    if isinstance(exc, TimeoutError):
+        return requests.Timeout(f"Timeout downloading {url}")
+    return requests.ConnectionError(f"Error downloading {url}: {exc}")
+
+
+def _write_and_close(fh: IO[bytes], data: bytes | bytearray) -> None:
+    with fh:
+        fh.write(data)
+
+
+class AsyncDownloadEngine(DownloadEngine):
+    def __init__(
+        self,
+        cache_dir: Path,
+        timeout: int = DEFAULT_HTTP_TIMEOUT,
+        max_retry_time: int = 30,
+        connections_per_host: int = 8,
+        *,
+        keep_cache: bool = True,
+        cache_max_size: int | None = None,
+        mirrors: MirrorPool | None = None,
+    ):
+        super().__init__(
+            cache_dir,
+            timeout=timeout,
+            max_retry_time=max_retry_time,
+            keep_cache=keep_cache,
+            cache_max_size=cache_max_size,
+            mirrors=mirrors,
+        )
+        self._connections_per_host = connections_per_host
+        # same role as `_target_locks`, for transfers running on the loop
+        self._transfer_locks = TargetLocks(asyncio.Lock)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="download-engine", daemon=True
+        )
+        self._thread.start()
+        self._client = self._submit(self._open_client()).result()
+
+    async def _open_client(self) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=0, limit_per_host=self._connections_per_host
+            ),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=self._timeout, sock_read=self._timeout
+            ),
+            raise_for_status=True,
+        )
+
+    def _submit(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    async def _transfer(self, url: str, target: Path) -> None:
+        @backoff.on_exception(
+            backoff.expo,
+            (aiohttp.ClientError, TimeoutError),
+            max_time=self._max_retry_time,
+            giveup=_is_fatal_client_error,
+            logger=logger,
+        )
+        async def _attempt():
+            if self._mirrors is None:
+                await _send(url, MirrorTransfer(started=time.monotonic()))
+            else:
+                await self._mirrors.call_async(url, _send)
+
+        async def _send(mirror_url: str, transfer: MirrorTransfer):
+            headers = await asyncio.to_thread(partial.resume_headers)
+            async with self._client.get(
+                mirror_url, headers=headers, raise_for_status=False
+            ) as response:
+                transfer.responded(response.status, response.headers.get("Retry-After"))
+                if not await asyncio.to_thread(
+                    partial.accepts, response.status, response.headers
+                ):
+                    raise aiohttp.ClientPayloadError(
+                        f"Stale partial download of {mirror_url}"
+                    )
+                response.raise_for_status()
+                fh = await asyncio.to_thread(
+                    partial.open, response.status, response.headers
+                )
+                buffer = bytearray()
+                try:
+                    async for chunk in response.content.iter_chunked(DL_CHUNCK_SIZE):
+                        buffer += chunk
+                        if len(buffer) >= WRITE_BUFFER_SIZE:
+                            await asyncio.to_thread(fh.write, buffer)
+                            buffer.clear()
+                        if delay := transfer.received(len(chunk)):
+                            await asyncio.sleep(delay)
+                finally:
+                    # what was received is kept, to resume from
+                    await asyncio.to_thread(_write_and_close, fh, buffer)
+            await asyncio.to_thread(partial.complete)
+
+        await asyncio.to_thread(target.parent.mkdir, parents=True, exist_ok=True)
+        partial = PartialDownload(target)
+        try:
+            await _attempt()
+        except (aiohttp.ClientError, TimeoutError) as exc:
+            raise _as_requests_error(url, exc) from exc
+
+    async def _download(self, url: str, target: Path) -> DownloadResult:
+        """Download `url` to `target`, on the engine loop"""
+        with self._transfer_locks.using(target) as lock:
+            async with lock:
+                if cached := await asyncio.to_thread(self._waited, url, target):
+                    return cached
+                await self._transfer(url, target)
+                return await asyncio.to_thread(self._result, url, target)
+
+    def download(
+        self, request: DownloadRequest, dest: Path | None = None
+    ) -> DownloadResult:
+        return self._submit(self.download_async(request, dest)).result()
+
+    async def download_async(
+        self, request: DownloadRequest, dest: Path | None = None
+    ) -> DownloadResult:
+        """Coroutine version of `download()`, usable from any event loop"""
+        target, cached = await asyncio.to_thread(self._lookup, request, dest)
+        if cached:
+            return cached
+        return await asyncio.wrap_future(
+            self._submit(self._download(request.url, target))
+        )
+
+    async def fetch_async(
+        self, request: DownloadRequest, spiller: PayloadSpiller | None = None
+    ) -> Payload:
+        """Coroutine version of `fetch()`, usable from any event loop"""
+        attempts = CACHE_READ_ATTEMPTS
+        while True:
+            result = await self.download_async(request)
+            try:
+                return await asyncio.to_thread(self._read, result, spiller)
+            except FileNotFoundError:
+                attempts -= 1
+                if not attempts or not self._evicted(request, result):
+                    raise
+
+    def close(self) -> None:
+        """Close connections and stop the engine loop"""
+        self._submit(self._client.close()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
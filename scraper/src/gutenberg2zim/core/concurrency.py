@@ -1,14 +1,179 @@
-"""Source-agnostic concurrency helper.
+"""Source-agnostic concurrency helpers.
 
-Just a thin wrapper around a thread pool so the pipeline (and later other
-callers) does not repeat the `Pool(...).map(...)` incantation.
+- `run_stages`: a staged engine where each `Stage` has its own worker
+  threads and is connected to the next one by a bounded queue, so that a
+  slow stage applies backpressure to the ones before it instead of letting
+  work pile up in memory. A stage whose function is a coroutine function
+  runs on an event loop in a single thread instead, with up to `workers`
+  items in flight (e.g. network-bound stages on an async download engine),
+- `process_pool`: worker processes to which CPU-bound work (HTML rewriting,
+  image optimization) is handed by stage threads, so that it runs in
+  parallel instead of contending for the GIL.
 """
 
+import asyncio
+import inspect
+import logging
+import queue
+import threading
 from collections.abc import Callable, Iterable
-from multiprocessing.dummy import Pool
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any
 
+from gutenberg2zim.constants import logger
 
-def parallel_map[T](func: Callable[[T], None], items: Iterable[T], concurrency: int):
-    """Map func over items using a thread pool with `concurrency` workers"""
-    with Pool(concurrency) as pool:
-        pool.map(func, items)
+# marks the end of a stage's input; one is queued per downstream worker
+_END = object()
+
+
+def _init_worker_process(debug: bool) -> None:  # noqa: FBT001
+    if debug:
+        for handler in logger.handlers:
+            handler.setLevel(logging.DEBUG)
+
+
+def process_pool(workers: int, *, debug: bool = False) -> ProcessPoolExecutor:
+    """Pool of `workers` processes, logging as the main one"""
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker_process,
+        initargs=(debug,),
+    )
+
+
+@dataclass(frozen=True, slots=True)
+class Stage:
+    """One step of a staged run.
+
+    `func` receives the output of the previous stage (or an input item for
+    the first stage) and returns the item to hand to the next stage; `None`
+    drops the item (nothing left to do for it). `func` may be a coroutine
+    function, `workers` then being the number of items processed concurrently
+    by a single thread.
+    """
+
+    name: str
+    func: Callable[[Any], Any]
+    workers: int = 1
+    # bounded input queue size; defaults to twice the number of workers
+    queue_size: int | None = None
+
+
+def run_stages(
+    stages: list[Stage],
+    items: Iterable[Any],
+    *,
+    on_done: Callable[[Any], None] | None = None,
+    on_error: Callable[[Stage, Any, Exception], None] | None = None,
+) -> None:
+    """Push items through `stages`, each stage running in its own workers.
+
+    `on_done(item)` is called exactly once per input item, when it leaves
+    the engine (dropped, failed or completed by the last stage); `item` is
+    the original input item. `on_error(stage, item, exc)` is called when a
+    stage function raises; the item is then dropped.
+    """
+    if not stages:
+        raise ValueError("At least one stage is required")
+
+    queues: list[queue.Queue] = [
+        queue.Queue(maxsize=stage.queue_size or 2 * stage.workers) for stage in stages
+    ]
+
+    def finish(origin: Any) -> None:
+        if on_done:
+            on_done(origin)
+
+    def work(index: int) -> None:
+        stage = stages[index]
+        inbox = queues[index]
+        outbox = queues[index + 1] if index + 1 < len(stages) else None
+        while True:
+            entry = inbox.get()
+            if entry is _END:
+                return
+            origin, payload = entry
+            try:
+                result = stage.func(payload)
+            except Exception as exc:
+                if on_error:
+                    on_error(stage, origin, exc)
+                finish(origin)
+                continue
+            if result is None or outbox is None:
+                finish(origin)
+            else:
+                outbox.put((origin, result))
+
+    async def work_async(index: int) -> None:
+        stage = stages[index]
+        inbox = queues[index]
+        outbox = queues[index + 1] if index + 1 < len(stages) else None
+        slots = asyncio.Semaphore(stage.workers)
+        tasks: set[asyncio.Task] = set()
+
+        async def handle(origin: Any, payload: Any) -> None:
+            try:
+                result = await stage.func(payload)
+            except Exception as exc:
+                if on_error:
+                    on_error(stage, origin, exc)
+                finish(origin)
+                return
+            if result is None or outbox is None:
+                finish(origin)
+            else:
+                # blocking put (backpressure) kept off the event loop
+                await asyncio.to_thread(outbox.put, (origin, result))
+
+        async def handle_in_slot(origin: Any, payload: Any) -> None:
+            try:
+                await handle(origin, payload)
+            finally:
+                slots.release()
+
+        while True:
+            await slots.acquire()
+            entry = await asyncio.to_thread(inbox.get)
+            if entry is _END:
+                break
+            task = asyncio.create_task(handle_in_slot(*entry))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+
+    def thread_for(index: int, nb: int) -> threading.Thread:
+        stage = stages[index]
+        if inspect.iscoroutinefunction(stage.func):
+            target, args = asyncio.run, (work_async(index),)
+        else:
+            target, args = work, (index,)
+        return threading.Thread(
+            target=target, args=args, name=f"{stage.name}-{nb}", daemon=True
+        )
+
+    threads_per_stage = [
+        [
+            thread_for(index, nb)
+            for nb in range(
+                1 if inspect.iscoroutinefunction(stage.func) else stage.workers
+            )
+        ]
+        for index, stage in enumerate(stages)
+    ]
+    for threads in threads_per_stage:
+        for thread in threads:
+            thread.start()
+
+    # feeding blocks as soon as the first stage is saturated (backpressure)
+    for item in items:
+        queues[0].put((item, item))
+
+    # shut stages down in order: once all workers of a stage are gone, no more
+    # items can reach the next stage, so it can be told to stop as well
+    for index, threads in enumerate(threads_per_stage):
+        for _ in threads:
+            queues[index].put(_END)
+        for thread in threads:
+            thread.join()
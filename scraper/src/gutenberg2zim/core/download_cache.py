@@ -0,0 +1,131 @@
+"""Size-bounded on-disk cache of downloaded files.
+
+`DownloadCache` indexes the files of the `DownloadEngine` cache folder and
+keeps their total size within `max_size` bytes, evicting the least recently
+used files first. The last access time of a file is its modification time,
+refreshed on every hit, so that the LRU order survives across runs (and does
+not depend on the filesystem being mounted with atime updates).
+
+The index is shared by all pipeline workers (guarded by a lock) and counts
+hits, misses and the bytes they saved, to be logged at the end of a run.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+
+@dataclass(slots=True)
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    # bytes served from the cache instead of being downloaded again
+    bytes_saved: int = 0
+    evictions: int = 0
+    evicted_bytes: int = 0
+
+    def __str__(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0
+        return (
+            f"{self.hits} hits, {self.misses} misses ({hit_rate:.0%} hit rate), "
+            f"{self.bytes_saved / 2**20:.1f} MiB saved, {self.evictions} "
+            f"evictions ({self.evicted_bytes / 2**20:.1f} MiB)"
+        )
+
+
+class DownloadCache:
+    """LRU index of the files in `folder`, bounded to `max_size` bytes (if set)"""
+
+    def __init__(self, folder: Path, max_size: int | None = None):
+        self.folder = folder
+        self.max_size = max_size
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self.folder.mkdir(parents=True, exist_ok=True)
+        # cached file -> size, least recently used first
+        self._entries: OrderedDict[Path, int] = OrderedDict()
+        files = [
+            (path, path.stat())
+            for path in self.folder.iterdir()
+            if path.is_file() and ".part" not in path.suffixes
+        ]
+        for path, stat in sorted(files, key=lambda item: item[1].st_mtime):
+            self._entries[path] = stat.st_size
+        self._size = sum(self._entries.values())
+        with self._lock:
+            self._evict(keep=None)
+
+    @property
+    def size(self) -> int:
+        """Total size of the cached files"""
+        return self._size
+
+    def lookup(self, path: Path) -> int | None:
+        """Size of the cached file at `path` (a hit), None if not cached (a miss)"""
+        with self._lock:
+            try:
+                size = path.stat().st_size
+            except FileNotFoundError:
+                # not downloaded yet, or removed (e.g. by another scraper)
+                self._size -= self._entries.pop(path, 0)
+                self.stats.misses += 1
+                return None
+            self._size += size - self._entries.pop(path, 0)
+            self._entries[path] = size
+            self.stats.hits += 1
+            self.stats.bytes_saved += size
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return size
+
+    def waited(self, path: Path) -> int | None:
+        """Size of the file at `path` when downloaded by another worker since
+        it was looked up (its miss then counted as a hit), None otherwise"""
+        with self._lock:
+            size = self._entries.get(path)
+            if size is None:
+                return None
+            self._entries.move_to_end(path)
+            self.stats.misses -= 1
+            self.stats.hits += 1
+            self.stats.bytes_saved += size
+        return size
+
+    def lost(self, size: int) -> None:
+        """Count a hit whose file was evicted before being read as a miss"""
+        with self._lock:
+            self.stats.hits -= 1
+            self.stats.misses += 1
+            self.stats.bytes_saved -= size
+
+    def add(self, path: Path) -> None:
+        """Index a newly downloaded file, evicting old files beyond the budget"""
+        size = path.stat().st_size
+        with self._lock:
+            self._size += size - self._entries.pop(path, 0)
+            self._entries[path] = size
+            self._evict(keep=path)
+
+    def discard(self, path: Path) -> None:
+        """Remove a file from the cache"""
+        with self._lock:
+            self._size -= self._entries.pop(path, 0)
+        path.unlink(missing_ok=True)
+
+    def _evict(self, keep: Path | None) -> None:
+        if self.max_size is None:
+            return
+        while self._size > self.max_size:
+            victim = next((path for path in self._entries if path != keep), None)
+            if victim is None:
+                break
+            size = self._entries.pop(victim)
+            self._size -= size
+            victim.unlink(missing_ok=True)
+            self.stats.evictions += 1
+            self.stats.evicted_bytes += size
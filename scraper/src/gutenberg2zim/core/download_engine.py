@@ -4,20 +4,55 @@ Source-agnostic downloader with a persistent session, retry with backoff,
 an on-disk cache keyed by URL hash, and streaming to file. Sources hand it
 `DownloadRequest`s (from their `FormatResolverPort`); it knows nothing
 about any specific source's URL scheme.
+
+One engine is shared by all pipeline workers: its session keeps a pool of
+`pool_size` connections per host (sized from the download concurrency), so
+that connections (and TLS sessions) to the mirror are reused across files
+and books instead of being set up for each file.
+
+The cache folder is managed by a `DownloadCache`: with `cache_max_size`, the
+least recently used files are evicted to keep it within that many bytes. A
+file evicted by another worker between its lookup and its read is a miss
+after all: it is downloaded again.
+
+Concurrent downloads of the same target are serialized by a lock of that
+target (`TargetLocks`), the ones waiting for it taking the file downloaded
+by the first one from the cache rather than downloading it again.
+
+Interrupted transfers are resumed rather than restarted: the partial content
+is kept under a stable `.part` name next to the target (with the ETag of the
+file), and the next attempt (or run) asks for the remaining bytes with
+`Range`/`If-Range`, so that the server sends the whole file again if it
+changed in the meantime.
+
+With a `MirrorPool`, files are requested from the best mirror of the pool
+(failing over to the next ones), the cache being keyed by canonical URL.
+Files of a local mirror (`file://` URLs) are read in place, not cached.
 """
 
 import hashlib
-import uuid
+import re
+import shutil
+import threading
+import time
+from collections.abc import Callable, Iterator, Mapping
+from contextlib import contextmanager
 from dataclasses import dataclass
 from http import HTTPStatus
 from pathlib import Path
+from typing import IO
 from urllib.parse import urlparse
 
 import backoff
 import requests
+from requests.adapters import HTTPAdapter
 
 from gutenberg2zim.constants import DEFAULT_HTTP_TIMEOUT, DL_CHUNCK_SIZE, logger
+from gutenberg2zim.core.download_cache import DownloadCache
+from gutenberg2zim.core.local_mirror import local_file, local_path
+from gutenberg2zim.core.mirror_pool import MirrorPool, MirrorTransfer, call_mirrors
 from gutenberg2zim.core.ports import DownloadRequest
+from gutenberg2zim.core.spill import Payload, PayloadSpiller
 
 
 @dataclass(frozen=True, slots=True)
@@ -26,6 +61,8 @@ class DownloadResult:
     path: Path
     size: int
     from_cache: bool
+    # file of a local mirror, read in place (never to be removed)
+    local: bool = False
 
 
 def _is_fatal_http_error(exc: Exception) -> bool:
@@ -40,6 +77,112 @@ def _is_fatal_http_error(exc: Exception) -> bool:
     )
 
 
+CONTENT_RANGE_START = re.compile(r"bytes (\d+)-")
+
+# downloads of a file evicted from the cache before being read, each time
+CACHE_READ_ATTEMPTS = 3
+
+
+class PartialDownload:
+    """Content of an interrupted download of `target`, resumable with a
+    `Range`/`If-Range` request when its (strong) ETag is known"""
+
+    def __init__(self, target: Path):
+        self.target = target
+        self.path = target.with_name(f"{target.name}.part")
+        self._etag_path = target.with_name(f"{target.name}.part.etag")
+
+    def _size(self) -> int:
+        try:
+            return self.path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def resume_headers(self) -> dict[str, str]:
+        """Request headers to download the remaining bytes only, if possible"""
+        size = self._size()
+        if not size or not self._etag_path.exists():
+            return {}
+        return {"Range": f"bytes={size}-", "If-Range": self._etag_path.read_text()}
+
+    def accepts(self, status: int, headers: Mapping[str, str]) -> bool:
+        """Whether a response can be written; when the server rejected the
+        range or sent another one, the partial content is discarded instead
+        (and the file is to be requested again from scratch)"""
+        if status == HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE:
+            self.discard()
+            return False
+        if status != HTTPStatus.PARTIAL_CONTENT:
+            return True
+        matched = CONTENT_RANGE_START.match(headers.get("Content-Range", ""))
+        etag = headers.get("ETag")
+        if (
+            matched
+            and int(matched.group(1)) == self._size()
+            and (not etag or etag == self._etag_path.read_text())
+        ):
+            return True
+        self.discard()
+        return False
+
+    def open(self, status: int, headers: Mapping[str, str]) -> IO[bytes]:
+        """File to write an accepted response body to: appended to the partial
+        content when the server resumes it (206), replacing it otherwise"""
+        if status == HTTPStatus.PARTIAL_CONTENT:
+            logger.debug(f"Resuming {self.target.name} from byte {self._size()}")
+            return open(self.path, "ab")
+        etag = headers.get("ETag")
+        # weak ETags cannot be used in If-Range
+        if etag and not etag.startswith("W/"):
+            self._etag_path.write_text(etag)
+        else:
+            self._etag_path.unlink(missing_ok=True)
+        return open(self.path, "wb")
+
+    def complete(self) -> None:
+        self.path.replace(self.target)
+        self._etag_path.unlink(missing_ok=True)
+
+    def discard(self) -> None:
+        self.path.unlink(missing_ok=True)
+        self._etag_path.unlink(missing_ok=True)
+
+
+class TargetLocks[L]:
+    """Lock of each download target in use (made by `factory`), dropped once
+    no caller holds or waits for it"""
+
+    def __init__(self, factory: Callable[[], L]):
+        self._factory = factory
+        self._guard = threading.Lock()
+        # target -> its lock, and the number of callers using it
+        self._locks: dict[Path, tuple[L, int]] = {}
+
+    @contextmanager
+    def using(self, target: Path) -> Iterator[L]:
+        """Lock of `target`, kept while in the context (to acquire in it)"""
+        with self._guard:
+            lock, users = self._locks.get(target) or (self._factory(), 0)
+            self._locks[target] = (lock, users + 1)
+        try:
+            yield lock
+        finally:
+            with self._guard:
+                lock, users = self._locks.pop(target)
+                if users > 1:
+                    self._locks[target] = (lock, users - 1)
+
+
+def pooled_session(pool_size: int) -> requests.Session:
+    """Session keeping up to `pool_size` connections per host for reuse"""
+    session = requests.Session()
+    # retries are handled by the engine (backoff), not by urllib3
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 class DownloadEngine:
     def __init__(
         self,
@@ -47,12 +190,24 @@ class DownloadEngine:
         session: requests.Session | None = None,
         timeout: int = DEFAULT_HTTP_TIMEOUT,
         max_retry_time: int = 30,
+        pool_size: int = 10,
+        *,
+        keep_cache: bool = True,
+        cache_max_size: int | None = None,
+        mirrors: MirrorPool | None = None,
     ):
+        """`keep_cache=False` makes `fetch()` remove files once read, so that a
+        scrape does not keep a copy of all downloaded content on disk"""
         self._cache_dir = cache_dir
-        self._cache_dir.mkdir(parents=True, exist_ok=True)
-        self._session = session or requests.Session()
+        self.cache = DownloadCache(cache_dir, max_size=cache_max_size)
+        self._session = session or pooled_session(pool_size)
         self._timeout = timeout
         self._max_retry_time = max_retry_time
+        self._keep_cache = keep_cache
+        self._mirrors = mirrors
+        # concurrent downloads of the same target share its `.part` file:
+        # they are serialized
+        self._target_locks = TargetLocks(threading.Lock)
 
     def cache_path_for(self, url: str) -> Path:
         """Deterministic cache path for a URL (hash + original suffix)"""
@@ -68,27 +223,103 @@ class DownloadEngine:
         Returns the cached file directly when the URL was downloaded before
         and no explicit destination is requested.
         """
+        target, cached = self._lookup(request, dest)
+        if cached:
+            return cached
+        with self._target_locks.using(target) as lock, lock:
+            if cached := self._waited(request.url, target):
+                return cached
+            self._download_with_retry(request.url, target)
+            return self._result(request.url, target)
+
+    def fetch(
+        self, request: DownloadRequest, spiller: PayloadSpiller | None = None
+    ) -> Payload:
+        """Download `request.url` (or read it from the cache) into memory
+
+        With a `spiller`, files above its threshold are not read but handed
+        over as spilled files instead.
+        """
+        attempts = CACHE_READ_ATTEMPTS
+        while True:
+            result = self.download(request)
+            try:
+                return self._read(result, spiller)
+            except FileNotFoundError:
+                attempts -= 1
+                if not attempts or not self._evicted(request, result):
+                    raise
+
+    def _evicted(self, request: DownloadRequest, result: DownloadResult) -> bool:
+        """Whether the file of `result`, found missing when read, is a cached
+        one (evicted since by another worker), then to download again"""
+        if result.local or result.path != self.cache_path_for(request.url):
+            return False
+        if result.from_cache:
+            self.cache.lost(result.size)
+        logger.debug(f"\t\t{request.url} evicted before being read, downloading again")
+        return True
+
+    def _lookup(
+        self, request: DownloadRequest, dest: Path | None
+    ) -> tuple[Path, DownloadResult | None]:
+        """Where to download `request`, and its cached (or local) result if any"""
         target = dest or request.target
+        if local_path(request.url) is not None:
+            path = local_file(request.url)
+            if target is None:
+                return path, DownloadResult(
+                    url=request.url,
+                    path=path,
+                    size=path.stat().st_size,
+                    from_cache=False,
+                    local=True,
+                )
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(path, target)
+            return target, self._result(request.url, target)
         cache_path = self.cache_path_for(request.url)
 
-        if target is None and cache_path.exists():
+        if target is None and (size := self.cache.lookup(cache_path)) is not None:
             logger.debug(f"\t\tCache hit for {request.url}")
-            return DownloadResult(
-                url=request.url,
-                path=cache_path,
-                size=cache_path.stat().st_size,
-                from_cache=True,
+            return cache_path, DownloadResult(
+                url=request.url, path=cache_path, size=size, from_cache=True
             )
+        return target or cache_path, None
 
-        target = target or cache_path
-        self._download_with_retry(request.url, target)
+    def _waited(self, url: str, target: Path) -> DownloadResult | None:
+        """Cached result of `url` when downloaded to `target` by another worker
+        while waiting for its lock"""
+        if target != self.cache_path_for(url):
+            return None
+        size = self.cache.waited(target)
+        if size is None:
+            return None
+        logger.debug(f"\t\t{url} downloaded by another worker meanwhile")
+        return DownloadResult(url=url, path=target, size=size, from_cache=True)
+
+    def _result(self, url: str, target: Path) -> DownloadResult:
+        if target == self.cache_path_for(url):
+            self.cache.add(target)
         return DownloadResult(
-            url=request.url,
-            path=target,
-            size=target.stat().st_size,
-            from_cache=False,
+            url=url, path=target, size=target.stat().st_size, from_cache=False
         )
 
+    def _read(
+        self, result: DownloadResult, spiller: PayloadSpiller | None = None
+    ) -> Payload:
+        keep = self._keep_cache or result.local
+        if spiller and spiller.should_spill(result.size):
+            spilled = spiller.adopt(result.path, keep_original=keep)
+            if not keep:
+                self.cache.discard(result.path)
+            return spilled
+        try:
+            return result.path.read_bytes()
+        finally:
+            if not keep:
+                self.cache.discard(result.path)
+
     def _download_with_retry(self, url: str, target: Path) -> None:
         @backoff.on_exception(
             backoff.expo,
@@ -98,16 +329,29 @@ class DownloadEngine:
             logger=logger,
         )
         def _attempt():
-            with self._session.get(url, stream=True, timeout=self._timeout) as response:
+            call_mirrors(self._mirrors, url, _send)
+
+        def _send(mirror_url: str, transfer: MirrorTransfer):
+            headers = partial.resume_headers()
+            with self._session.get(
+                mirror_url, stream=True, timeout=self._timeout, headers=headers
+            ) as response:
+                transfer.responded(
+                    response.status_code, response.headers.get("Retry-After")
+                )
+                if not partial.accepts(response.status_code, response.headers):
+                    raise requests.ConnectionError(
+                        f"Stale partial download of {mirror_url}"
+                    )
                 response.raise_for_status()
-                target.parent.mkdir(parents=True, exist_ok=True)
-                # Unique tmp name: concurrent downloads of the same URL must not collide
-                unique_suffix = f"{target.suffix}.{uuid.uuid4().hex}.part"
-                tmp_path = target.with_suffix(unique_suffix)
-                with open(tmp_path, "wb") as fh:
+                with partial.open(response.status_code, response.headers) as fh:
                     for chunk in response.iter_content(chunk_size=DL_CHUNCK_SIZE):
                         if chunk:
                             fh.write(chunk)
-                tmp_path.replace(target)
+                            if delay := transfer.received(len(chunk)):
+                                time.sleep(delay)
+            partial.complete()
 
+        target.parent.mkdir(parents=True, exist_ok=True)
+        partial = PartialDownload(target)
         _attempt()
@@ -0,0 +1,118 @@
+"""Persistent cache of optimized EPUBs, across runs.
+
+EPUB optimization rewrites every page and image of the book while the EPUB on
+the mirror rarely changes from one run to the next. `EpubCache` keeps the
+optimized EPUB of each book in a folder of the `--cache-dir`, keyed by the
+digest of its source, the book id (pages are rewritten for it), the version
+of the optimizer and the versions of the libraries it relies on, so that
+changing any of them misses the cache rather than serving a stale EPUB.
+
+As `ImageCache`, the cache is plain files written atomically (temporary
+`.part` file then rename), hits refreshing their modification time, and is
+kept within `max_size` at the start and end of each run, evicting the least
+recently used EPUBs first (see `DownloadCache`). Hits are handed to the ZIM
+as is, from the cache folder.
+
+The original and optimized sizes of the EPUBs of a run (hits included) are
+summed by language, to be logged at the end of a run.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+from collections import defaultdict
+from collections.abc import Iterable
+from dataclasses import dataclass
+from importlib.metadata import version
+from pathlib import Path
+
+from gutenberg2zim.core.download_cache import DownloadCache
+from gutenberg2zim.core.spill import Payload, payload_digest
+
+# libraries the optimized EPUBs depend on, part of the keys
+LIBRARY_VERSIONS = ";".join(
+    f"{library}={version(library)}"
+    for library in ("pillow", "zimscraperlib", "beautifulsoup4", "lxml")
+)
+
+
+@dataclass(slots=True)
+class EpubSizes:
+    books: int = 0
+    # books whose optimized EPUB came from the cache
+    cached: int = 0
+    original_size: int = 0
+    optimized_size: int = 0
+
+    def __str__(self) -> str:
+        saved = self.original_size - self.optimized_size
+        ratio = saved / self.original_size if self.original_size else 0
+        return (
+            f"{self.books} EPUBs ({self.cached} cached), "
+            f"{self.original_size / 2**20:.1f} MiB optimized to "
+            f"{self.optimized_size / 2**20:.1f} MiB ({ratio:.0%} saved)"
+        )
+
+
+class EpubCache:
+    """Optimized EPUBs in `folder`, by source content, book and optimizer"""
+
+    def __init__(self, folder: Path, max_size: int | None = None):
+        self.folder = folder
+        self.max_size = max_size
+        self.folder.mkdir(parents=True, exist_ok=True)
+        # language -> sizes of the EPUBs of the books in that language
+        self.sizes: dict[str, EpubSizes] = defaultdict(EpubSizes)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(source: Payload, book_id: int | str, optimizer: str) -> str:
+        """Key of EPUB `source` of book `book_id` optimized by `optimizer` (a
+        name and version)"""
+        digest = hashlib.blake2b(payload_digest(source), digest_size=20)
+        digest.update(f"\0{book_id}\0{optimizer}\0{LIBRARY_VERSIONS}".encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Path | None:
+        """Path of the optimized EPUB at `key`, if cached"""
+        path = self.folder / key
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except OSError:
+            pass
+        return path
+
+    def put(self, key: str, optimized: Payload) -> Path:
+        """Store `optimized` at `key` (a spilled one being moved), its path"""
+        part = self.folder / f"{key}.{uuid.uuid4().hex}.part"
+        if isinstance(optimized, Path):
+            shutil.move(optimized, part)
+        else:
+            part.write_bytes(optimized)
+        return part.replace(self.folder / key)
+
+    def record(
+        self,
+        languages: Iterable[str],
+        original_size: int,
+        optimized_size: int,
+        *,
+        cached: bool = False,
+    ) -> None:
+        """Count the EPUB of a book in `languages`"""
+        with self._lock:
+            for language in languages:
+                sizes = self.sizes[language]
+                sizes.books += 1
+                sizes.cached += cached
+                sizes.original_size += original_size
+                sizes.optimized_size += optimized_size
+
+    def trim(self) -> None:
+        """Evict the least recently used EPUBs beyond `max_size`"""
+        if self.max_size is not None:
+            DownloadCache(self.folder, max_size=self.max_size)
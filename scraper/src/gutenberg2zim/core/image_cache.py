@@ -0,0 +1,79 @@
+"""Persistent cache of optimized images, across runs.
+
+Converting images to WebP (book pages) and optimizing EPUB images are the
+biggest CPU cost of a scrape, while few images change from one run to the
+next. `ImageCache` keeps the optimized version of each image in a folder of
+the `--cache-dir`, keyed by the digest of its source bytes, the encoder (and
+its settings) and the versions of the imaging libraries, so that changing
+any of them misses the cache rather than serving stale images.
+
+The cache is plain files, written atomically (temporary `.part` file then
+rename): worker processes read and fill it concurrently without any shared
+state. Hits refresh the modification time of their file and the cache is
+kept within `max_size` at the start and end of each run, evicting the least
+recently used images first (see `DownloadCache`).
+"""
+
+import hashlib
+import os
+import uuid
+from collections.abc import Callable
+from importlib.metadata import version
+from pathlib import Path
+
+from gutenberg2zim.core.download_cache import DownloadCache
+
+# libraries the optimized images depend on, part of the keys
+LIBRARY_VERSIONS = ";".join(
+    f"{library}={version(library)}" for library in ("pillow", "zimscraperlib")
+)
+
+
+class ImageCache:
+    """Optimized images in `folder`, by source content and encoder"""
+
+    def __init__(self, folder: Path, max_size: int | None = None):
+        self.folder = folder
+        self.max_size = max_size
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(data: bytes, encoder: str) -> str:
+        """Key of the version of image `data` optimized by `encoder` (a name
+        and the settings it encodes with)"""
+        digest = hashlib.blake2b(data, digest_size=20)
+        digest.update(f"\0{encoder}\0{LIBRARY_VERSIONS}".encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> bytes | None:
+        path = self.folder / key
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        part = self.folder / f"{key}.{uuid.uuid4().hex}.part"
+        part.write_bytes(data)
+        part.replace(self.folder / key)
+
+    def optimize(
+        self, data: bytes, encoder: str, optimize: Callable[[bytes], bytes]
+    ) -> bytes:
+        """`optimize(data)`, from the cache when already optimized by `encoder`"""
+        key = self.key(data, encoder)
+        if (optimized := self.get(key)) is not None:
+            return optimized
+        optimized = optimize(data)
+        self.put(key, optimized)
+        return optimized
+
+    def trim(self) -> None:
+        """Evict the least recently used images beyond `max_size`"""
+        if self.max_size is not None:
+            DownloadCache(self.folder, max_size=self.max_size)
@@ -0,0 +1,145 @@
+"""Run-wide deduplication of book images by content.
+
+The same images appear in many books: PG logos, decorative rules, publisher
+ornaments, plates reused across the volumes of a work. `ImageRegistry` maps
+the digest of the source bytes of an image (and its output type) to the ZIM
+path of the first book image found with them: the following ones are added
+as ZIM aliases of that path, neither converted nor stored again.
+
+Images are looked up before being handed to transform workers, so that
+duplicates skip the conversion too. The first image may then be written
+after the aliases of other books: the registry is told when it is written,
+and aliases written before are held back by `ZimAssembler` until their
+target is added. When that image is not stored after all (its book
+failed, or it did not optimize) while other books already alias it, its
+path is orphaned: the next book storing the same image adds an alias there
+as well, so that the aliases of the other books still resolve.
+
+Keys are 128-bit digests, to keep the registry small over a full run; it
+counts duplicates and the bytes they saved, to be logged at the end of a
+run.
+"""
+
+import threading
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+
+from gutenberg2zim.core.spill import Payload, payload_digest
+
+# book files looked up in the registry
+IMAGE_EXTENSIONS = ("jpg", "jpeg", "png", "gif", "webp")
+
+
+@dataclass(slots=True)
+class DedupStats:
+    images: int = 0
+    duplicates: int = 0
+    # source bytes of duplicates, not converted again
+    source_bytes: int = 0
+    # bytes of the stored images duplicates are aliases of
+    bytes_saved: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.images} distinct images, {self.duplicates} duplicates added as "
+            f"aliases ({self.source_bytes / 2**20:.1f} MiB not converted, "
+            f"{self.bytes_saved / 2**20:.1f} MiB saved)"
+        )
+
+
+@dataclass(slots=True)
+class _Image:
+    # ZIM path of the stored image
+    path: str
+    # size once stored
+    size: int | None = None
+    # aliases of other books to `path`
+    aliases: int = 0
+    # added to the ZIM
+    written: bool = False
+
+
+class ImageRegistry:
+    """Stored images by content, shared by all pipeline workers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._images: dict[bytes, _Image] = {}
+        # key -> paths of images not stored after all, that other books alias
+        self._orphans: defaultdict[bytes, list[str]] = defaultdict(list)
+        self._duplicates: Counter[bytes] = Counter()
+        self._source_bytes = 0
+
+    @staticmethod
+    def key(payload: Payload, output_filename: str) -> bytes:
+        """Key of an image: digest of its source bytes, and its output type"""
+        return payload_digest(payload) + Path(output_filename).suffix.encode()
+
+    def claim(self, key: bytes, path: str, source_size: int) -> str | None:
+        """Path of the image stored with `key` or, when there is none yet,
+        None: the image is then to store at `path` (see `stored`)"""
+        with self._lock:
+            image = self._images.get(key)
+            if image is None:
+                self._images[key] = _Image(path)
+                return None
+            image.aliases += 1
+            self._duplicates[key] += 1
+            self._source_bytes += source_size
+            return image.path
+
+    def stored(self, key: bytes, size: int) -> list[str]:
+        """Record that the image claimed with `key` is stored (`size` bytes)
+
+        Returns the orphaned paths of the image, to add as aliases of it.
+        """
+        with self._lock:
+            self._images[key].size = size
+            return self._orphans.pop(key, [])
+
+    def written(self, key: bytes) -> None:
+        """Record that the image stored with `key` is added to the ZIM"""
+        with self._lock:
+            if image := self._images.get(key):
+                image.written = True
+
+    def is_written(self, key: bytes) -> bool:
+        """Whether the image of `key` is added to the ZIM, that aliases of
+        other books can target"""
+        with self._lock:
+            image = self._images.get(key)
+            return image is not None and image.written
+
+    def add(self, key: bytes, path: str, size: int) -> None:
+        """Record an image stored at `path` by a previous run (resumed)"""
+        with self._lock:
+            self._images.setdefault(key, _Image(path, size))
+
+    def release(self, key: bytes, orphans: list[str] | None = None) -> None:
+        """Forget an image claimed with `key` but not stored after all
+
+        Its path is orphaned when other books alias it already, as are
+        `orphans` (those returned by `stored`, when the image is released
+        after all once stored).
+        """
+        with self._lock:
+            image = self._images.pop(key, None)
+            if image is not None and image.aliases:
+                self._orphans[key].append(image.path)
+            if orphans:
+                self._orphans[key].extend(orphans)
+
+    @property
+    def stats(self) -> DedupStats:
+        with self._lock:
+            return DedupStats(
+                images=len(self._images),
+                duplicates=self._duplicates.total(),
+                source_bytes=self._source_bytes,
+                bytes_saved=sum(
+                    count * (image.size or 0)
+                    for key, count in self._duplicates.items()
+                    if (image := self._images.get(key))
+                ),
+            )
@@ -0,0 +1,181 @@
+"""Checkpoint journal, so that an interrupted scrape can be resumed.
+
+The journal is only kept when asked for (`--journal`, or `--resume`). It
+lives in its own folder next to the ZIM (in the output folder) and records,
+per work, how far processing went:
+
+- `metadata`: metadata fetched (the work itself is stored),
+- `downloaded`: content downloaded,
+- `written`: ZIM entries prepared and handed to the assembler; the entries
+  are persisted as artifact files (by the transform workers, before they
+  reach the writer) so they can be replayed later,
+- `skipped`: nothing to write for this work (unusable metadata, no format
+  available), which is a final state as well.
+
+With `resume=True`, works in a final state are replayed from the journal
+into a fresh `ZimAssembler` instead of being fetched again from the mirror.
+Works interrupted at `metadata`/`downloaded` reuse their stored metadata.
+Without resuming, any previous journal is discarded.
+
+Artifacts are stored uncompressed. Entries already in files (spilled book
+files, cached EPUBs) are hard-linked rather than copied when the journal is
+on the same filesystem, which those files are never modified in place on;
+the others (and all of them across filesystems) are written out, so the
+journal needs up to as much disk space as the content of the ZIM being
+built. It is removed once the ZIM is successfully finished.
+"""
+
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+import apsw
+
+from gutenberg2zim.constants import logger
+from gutenberg2zim.core.models import Work, work_from_dict, work_to_dict
+from gutenberg2zim.core.ports import WorkRef
+from gutenberg2zim.core.zim_assembler import ZimEntry
+
+STATE_METADATA = "metadata"
+STATE_DOWNLOADED = "downloaded"
+STATE_WRITTEN = "written"
+STATE_SKIPPED = "skipped"
+FINAL_STATES = (STATE_WRITTEN, STATE_SKIPPED)
+
+
+class ScrapeJournal:
+    """Persistent per-work checkpoint journal (SQLite + artifact files)"""
+
+    def __init__(self, folder: Path, *, resume: bool):
+        self.folder = folder
+        if not resume and folder.exists():
+            logger.info(f"Discarding previous scrape journal at {folder}")
+            shutil.rmtree(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._artifacts_dir = self.folder / "artifacts"
+        self._lock = threading.Lock()
+        self._conn = apsw.Connection(str(self.folder / "journal.db"))
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS works ("
+            " source TEXT NOT NULL, id TEXT NOT NULL, state TEXT NOT NULL,"
+            " work TEXT, PRIMARY KEY (source, id))"
+        )
+
+    def _artifacts_dir_for(self, ref: WorkRef) -> Path:
+        return self._artifacts_dir / ref.source / ref.id
+
+    def _record(self, ref: WorkRef, state: str, work: Work | None = None) -> None:
+        with self._lock:
+            if work is None:
+                # keep the metadata recorded at an earlier state
+                self._conn.execute(
+                    "INSERT INTO works (source, id, state) VALUES (?, ?, ?) "
+                    "ON CONFLICT (source, id) DO UPDATE SET state = excluded.state",
+                    (ref.source, ref.id, state),
+                )
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO works (source, id, state, work) "
+                    "VALUES (?, ?, ?, ?)",
+                    (ref.source, ref.id, state, json.dumps(work_to_dict(work))),
+                )
+
+    def state(self, ref: WorkRef) -> str | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM works WHERE source = ? AND id = ?",
+                (ref.source, ref.id),
+            ).fetchone()
+        return row[0] if row else None
+
+    def work(self, ref: WorkRef) -> Work | None:
+        """Metadata recorded for a work, if any"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT work FROM works WHERE source = ? AND id = ?",
+                (ref.source, ref.id),
+            ).fetchone()
+        return work_from_dict(json.loads(row[0])) if row and row[0] else None
+
+    def record_metadata(self, ref: WorkRef, work: Work) -> None:
+        self._record(ref, STATE_METADATA, work)
+
+    def record_downloaded(self, ref: WorkRef) -> None:
+        self._record(ref, STATE_DOWNLOADED)
+
+    def record_skipped(self, ref: WorkRef) -> None:
+        self._record(ref, STATE_SKIPPED)
+
+    def record_written(self, ref: WorkRef) -> None:
+        """Mark a work written (its entries saved with `save_entries`)"""
+        self._record(ref, STATE_WRITTEN)
+
+    def save_entries(self, ref: WorkRef, entries: list[ZimEntry]) -> None:
+        """Persist the entries of a work as artifacts, to replay once written"""
+        folder = self._artifacts_dir_for(ref)
+        if folder.exists():
+            shutil.rmtree(folder)
+        folder.mkdir(parents=True)
+        manifest = []
+        for index, entry in enumerate(entries):
+            record = {
+                "path": entry.path,
+                "title": entry.title,
+                "mimetype": entry.mimetype,
+                "is_front": entry.is_front,
+                "auto_index": entry.auto_index,
+                "alias_target": entry.alias_target,
+                "dedup_key": entry.dedup_key.hex() if entry.dedup_key else None,
+            }
+            if entry.alias_target is None:
+                artifact = folder / str(index)
+                if entry.fpath is not None:
+                    _link_or_copy(entry.fpath, artifact)
+                elif isinstance(entry.content, str):
+                    artifact.write_text(entry.content, encoding="utf-8")
+                else:
+                    artifact.write_bytes(entry.content or b"")
+                record["artifact"] = artifact.name
+            manifest.append(record)
+        (folder / "entries.json").write_text(json.dumps(manifest))
+
+    def replay(self, ref: WorkRef) -> tuple[Work | None, list[ZimEntry]]:
+        """Stored metadata (None if skipped) and entries of a completed work"""
+        if self.state(ref) == STATE_SKIPPED:
+            return None, []
+        folder = self._artifacts_dir_for(ref)
+        manifest = json.loads((folder / "entries.json").read_text())
+        entries = [
+            ZimEntry(
+                path=record["path"],
+                title=record["title"],
+                fpath=folder / record["artifact"] if "artifact" in record else None,
+                mimetype=record["mimetype"],
+                is_front=record["is_front"],
+                auto_index=record["auto_index"],
+                alias_target=record["alias_target"],
+                dedup_key=(
+                    bytes.fromhex(record["dedup_key"])
+                    if record.get("dedup_key")
+                    else None
+                ),
+            )
+            for record in manifest
+        ]
+        return self.work(ref), entries
+
+    def discard(self) -> None:
+        """Remove the journal (once the ZIM has been successfully finished)"""
+        self._conn.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    """Hard-link `src` at `dst`, copying it when not possible (other
+    filesystem, no hard link support)"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
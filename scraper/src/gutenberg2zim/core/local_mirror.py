@@ -0,0 +1,61 @@
+"""Local mirror: a Gutenberg tree on disk (e.g. an rsync copy of `cache/epub`).
+
+`--mirror-url` may be a `file://` URL (or a folder, turned into one): files
+are then read straight from disk by the download engines, the RDF metadata
+and the catalog downloads, without any HTTP request nor copy into the
+download cache. A missing file raises the same `requests.HTTPError` (404)
+as a file missing on an HTTP mirror, so that callers handle both alike.
+
+Large files handed over by path (spilled, see `core.spill`) are hard links
+to the mirror files when possible, read through `mmap` (`open_payload()`).
+"""
+
+from email.utils import formatdate
+from http import HTTPStatus
+from pathlib import Path
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import requests
+
+
+def local_path(url: str) -> Path | None:
+    """Path of a `file://` URL, None for other URLs"""
+    parsed = urlparse(url)
+    if parsed.scheme != "file":
+        return None
+    return Path(url2pathname(parsed.path))
+
+
+def local_mirror_url(value: str) -> str:
+    """Mirror URL for a `--mirror-url` value: folders become `file://` URLs"""
+    if urlparse(value).scheme in ("http", "https", "file"):
+        return value
+    path = Path(value).expanduser()
+    if path.is_dir():
+        return path.resolve().as_uri()
+    return value
+
+
+def not_found(url: str) -> requests.HTTPError:
+    """Error raised for a file missing on a local mirror (as for HTTP ones)"""
+    response = requests.Response()
+    response.status_code = HTTPStatus.NOT_FOUND
+    response.url = url
+    return requests.HTTPError(
+        f"{HTTPStatus.NOT_FOUND} Client Error: Not Found for url: {url}",
+        response=response,
+    )
+
+
+def local_file(url: str) -> Path:
+    """Existing file of a `file://` URL, or `not_found()` raised"""
+    path = local_path(url)
+    if path is None or not path.is_file():
+        raise not_found(url)
+    return path
+
+
+def last_modified(path: Path) -> str:
+    """HTTP-date of the modification time of a local file (its validator)"""
+    return formatdate(path.stat().st_mtime, usegmt=True)
@@ -0,0 +1,361 @@
+"""Pool of mirrors serving the same file tree.
+
+URLs are built against the first mirror of the pool (the canonical one, also
+used as cache key); `MirrorPool.call()` sends each request to the mirror
+which is expected to serve it first, and fails over to the next ones when a
+mirror times out, cannot be reached or answers with a server error (5xx,
+429). Other client errors (e.g. 404) are the file's, not the mirror's, and
+are raised as is: mirrors are copies of the same tree.
+
+Mirrors are ranked on what is observed of them (moving averages of latency,
+throughput and error rate), weighted by the number of requests they are
+already serving so that concurrent requests are spread across mirrors
+rather than all sent to the fastest one. A mirror failing several times in
+a row is left aside for a cooldown period (growing while it keeps failing),
+and only tried when no healthy mirror is left.
+
+The pool is also the scheduler of all requests to mirrors (catalog, RDFs,
+book files, covers): token buckets keep each mirror within the configured
+requests per second and bytes per second, and a `Retry-After` answer (429,
+503) pauses the mirror for that long. Time spent waiting is reported with
+the other mirror stats.
+"""
+
+import asyncio
+import threading
+import time
+from collections.abc import Awaitable, Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+from http import HTTPStatus
+
+from gutenberg2zim.constants import logger
+
+# weight of a new sample in the moving averages
+EWMA_WEIGHT = 0.2
+# size of the typical file a mirror is ranked on (latency + transfer time)
+TYPICAL_SIZE = 2**20
+# consecutive failures after which a mirror is left aside
+MAX_CONSECUTIVE_FAILURES = 3
+MIN_COOLDOWN = 30
+MAX_COOLDOWN = 600
+
+
+def _ewma(average: float | None, sample: float) -> float:
+    if average is None:
+        return sample
+    return average + EWMA_WEIGHT * (sample - average)
+
+
+def retry_after_seconds(value: str | None) -> float | None:
+    """Delay of a `Retry-After` header (seconds or HTTP-date), if any"""
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(UTC)).total_seconds(), 0)
+
+
+class TokenBucket:
+    """`rate` units per second, with bursts of up to one second worth of units
+
+    Units are reserved rather than waited for: a reservation beyond the
+    available units returns the delay after which they are available, so
+    that concurrent callers are served in turn (and may wait the way they
+    can, sleeping or awaiting).
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._capacity = max(rate, 1)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1) -> float:
+        """Reserve `amount` units, returning the delay before using them"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self._capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= amount
+            return max(-self._tokens / self.rate, 0)
+
+
+@dataclass(slots=True)
+class MirrorTransfer:
+    """Measures of one request to a mirror, filled by the caller"""
+
+    started: float
+    status: int | None = None
+    latency: float | None = None
+    size: int = 0
+    failed: bool = False
+    # seconds the mirror asked to wait before the next request
+    retry_after: float | None = None
+    # seconds spent waiting for the rate and bandwidth budgets
+    waited: float = 0
+    bandwidth: TokenBucket | None = None
+
+    def responded(self, status: int, retry_after: str | None = None) -> None:
+        """Record that the mirror answered (response headers received)"""
+        self.status = status
+        self.latency = time.monotonic() - self.started
+        self.retry_after = retry_after_seconds(retry_after)
+
+    def received(self, size: int) -> float:
+        """Record received bytes; returns how long to wait before reading more
+        to stay within the mirror bandwidth (0 without limit)"""
+        self.size += size
+        if self.bandwidth is None:
+            return 0
+        delay = self.bandwidth.reserve(size)
+        self.waited += delay
+        return delay
+
+    def is_mirror_failure(self) -> bool:
+        """Whether the request failed because of the mirror (no answer, server
+        error or rate limit) rather than because of the requested file"""
+        return (
+            self.status is None
+            or self.status >= HTTPStatus.INTERNAL_SERVER_ERROR
+            or self.status == HTTPStatus.TOO_MANY_REQUESTS
+        )
+
+
+@dataclass(slots=True)
+class MirrorState:
+    url: str
+    latency: float | None = None
+    # bytes per second
+    throughput: float | None = None
+    error_rate: float = 0
+    in_flight: int = 0
+    requests: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    down_until: float = 0
+    cooldown: float = MIN_COOLDOWN
+    # no request before this time (Retry-After)
+    paused_until: float = 0
+    requests_budget: TokenBucket | None = field(default=None, repr=False)
+    bandwidth: TokenBucket | None = field(default=None, repr=False)
+    waits: int = 0
+    wait_time: float = 0
+    max_wait: float = 0
+
+    def cost(self) -> float:
+        """Expected time to serve a typical file, given current load"""
+        if self.latency is None:
+            # never answered: unknown (tried first) unless it only failed
+            expected = float("inf") if self.failures else 0
+        else:
+            expected = self.latency + TYPICAL_SIZE / (self.throughput or TYPICAL_SIZE)
+        return expected / max(1 - self.error_rate, 0.1) * (self.in_flight + 1)
+
+    def __str__(self) -> str:
+        latency = f"{self.latency * 1000:.0f} ms" if self.latency is not None else "-"
+        throughput = (
+            f"{self.throughput / 2**20:.1f} MiB/s"
+            if self.throughput is not None
+            else "-"
+        )
+        return (
+            f"{self.url}: {self.requests} requests, {self.failures} failures, "
+            f"latency {latency}, throughput {throughput}, {self.waits} requests "
+            f"waited {self.wait_time:.1f}s (max {self.max_wait:.1f}s)"
+        )
+
+
+class MirrorPool:
+    """Mirrors of the same tree; the first one is the canonical URL base
+
+    Each mirror is allowed up to `requests_per_second` requests started and
+    `bytes_per_second` bytes received per second (no limit when None).
+    """
+
+    def __init__(
+        self,
+        mirror_urls: list[str],
+        requests_per_second: float | None = None,
+        bytes_per_second: float | None = None,
+    ):
+        if not mirror_urls:
+            raise ValueError("At least one mirror is required")
+        self._lock = threading.Lock()
+        self._mirrors = [
+            MirrorState(
+                url=url.rstrip("/"),
+                requests_budget=(
+                    TokenBucket(requests_per_second) if requests_per_second else None
+                ),
+                bandwidth=TokenBucket(bytes_per_second) if bytes_per_second else None,
+            )
+            for url in mirror_urls
+        ]
+        self.primary = self._mirrors[0].url
+
+    def __len__(self) -> int:
+        return len(self._mirrors)
+
+    def candidates(self, url: str) -> list[tuple[MirrorState | None, str]]:
+        """Mirrors to request `url` from, with the URL on each, best first
+
+        URLs which are not on the canonical mirror are requested as is.
+        """
+        if not url.startswith(self.primary):
+            return [(None, url)]
+        path = url[len(self.primary) :]
+        now = time.monotonic()
+        with self._lock:
+            ranked = sorted(
+                self._mirrors,
+                key=lambda mirror: (
+                    max(mirror.down_until, mirror.paused_until) > now,
+                    mirror.cost(),
+                ),
+            )
+        return [(mirror, f"{mirror.url}{path}") for mirror in ranked]
+
+    def admission_delay(self, mirror: MirrorState | None) -> float:
+        """Reserve a request to `mirror`, returning how long to wait before
+        starting it (Retry-After pause, requests per second budget)"""
+        if mirror is None:
+            return 0
+        with self._lock:
+            delay = max(mirror.paused_until - time.monotonic(), 0)
+        if mirror.requests_budget:
+            delay = max(delay, mirror.requests_budget.reserve())
+        return delay
+
+    @contextmanager
+    def transfer(
+        self, mirror: MirrorState | None, waited: float = 0
+    ) -> Iterator[MirrorTransfer]:
+        """Track one request to `mirror` (None: not a pool mirror), started
+        after waiting `waited` seconds for admission"""
+        transfer = MirrorTransfer(started=time.monotonic(), waited=waited)
+        if mirror is None:
+            yield transfer
+            return
+        transfer.bandwidth = mirror.bandwidth
+        with self._lock:
+            mirror.in_flight += 1
+        try:
+            yield transfer
+        except Exception:
+            transfer.failed = transfer.is_mirror_failure()
+            with self._lock:
+                if transfer.failed:
+                    self._record_failure(mirror, transfer)
+            raise
+        else:
+            with self._lock:
+                self._record_success(mirror, transfer)
+        finally:
+            with self._lock:
+                mirror.in_flight -= 1
+                if transfer.waited:
+                    mirror.waits += 1
+                    mirror.wait_time += transfer.waited
+                    mirror.max_wait = max(mirror.max_wait, transfer.waited)
+
+    def _record_success(self, mirror: MirrorState, transfer: MirrorTransfer) -> None:
+        duration = time.monotonic() - transfer.started
+        mirror.requests += 1
+        mirror.latency = _ewma(mirror.latency, transfer.latency or duration)
+        # throughput is only meaningful for transfers of some size
+        if transfer.size >= TYPICAL_SIZE // 16:
+            body_time = max(duration - (transfer.latency or 0), 1e-3)
+            mirror.throughput = _ewma(mirror.throughput, transfer.size / body_time)
+        mirror.error_rate = _ewma(mirror.error_rate, 0)
+        mirror.consecutive_failures = 0
+        mirror.down_until = 0
+        mirror.cooldown = MIN_COOLDOWN
+
+    def _record_failure(self, mirror: MirrorState, transfer: MirrorTransfer) -> None:
+        if transfer.retry_after is not None:
+            logger.warning(
+                f"Mirror {mirror.url} asked to retry after {transfer.retry_after:.0f}s"
+            )
+            mirror.paused_until = max(
+                mirror.paused_until, time.monotonic() + transfer.retry_after
+            )
+        mirror.requests += 1
+        mirror.failures += 1
+        mirror.error_rate = _ewma(mirror.error_rate, 1)
+        mirror.consecutive_failures += 1
+        if mirror.consecutive_failures >= MAX_CONSECUTIVE_FAILURES and len(self) > 1:
+            mirror.down_until = time.monotonic() + mirror.cooldown
+            logger.warning(
+                f"Mirror {mirror.url} failed {mirror.consecutive_failures} times in "
+                f"a row, leaving it aside for {mirror.cooldown:.0f}s"
+            )
+            mirror.cooldown = min(mirror.cooldown * 2, MAX_COOLDOWN)
+
+    def call[T](self, url: str, send: Callable[[str, MirrorTransfer], T]) -> T:
+        """Return `send(mirror_url, transfer)` for the best mirror, failing over
+        to the next ones when it fails because of the mirror"""
+        candidates = self.candidates(url)
+        for mirror, mirror_url in candidates[:-1]:
+            try:
+                with self.transfer(mirror, self._wait(mirror)) as transfer:
+                    return send(mirror_url, transfer)
+            except Exception as exc:
+                if not transfer.failed:
+                    raise
+                logger.warning(f"Failing over from {mirror_url}: {exc}")
+        mirror, mirror_url = candidates[-1]
+        with self.transfer(mirror, self._wait(mirror)) as transfer:
+            return send(mirror_url, transfer)
+
+    def _wait(self, mirror: MirrorState | None) -> float:
+        if delay := self.admission_delay(mirror):
+            time.sleep(delay)
+        return delay
+
+    async def _wait_async(self, mirror: MirrorState | None) -> float:
+        if delay := self.admission_delay(mirror):
+            await asyncio.sleep(delay)
+        return delay
+
+    async def call_async[T](
+        self, url: str, send: Callable[[str, MirrorTransfer], Awaitable[T]]
+    ) -> T:
+        """Coroutine version of `call()`"""
+        candidates = self.candidates(url)
+        for mirror, mirror_url in candidates[:-1]:
+            try:
+                waited = await self._wait_async(mirror)
+                with self.transfer(mirror, waited) as transfer:
+                    return await send(mirror_url, transfer)
+            except Exception as exc:
+                if not transfer.failed:
+                    raise
+                logger.warning(f"Failing over from {mirror_url}: {exc}")
+        mirror, mirror_url = candidates[-1]
+        waited = await self._wait_async(mirror)
+        with self.transfer(mirror, waited) as transfer:
+            return await send(mirror_url, transfer)
+
+    def log_stats(self) -> None:
+        with self._lock:
+            for mirror in self._mirrors:
+                logger.info(f"Mirror {mirror}")
+
+
+def call_mirrors[T](
+    mirrors: MirrorPool | None, url: str, send: Callable[[str, MirrorTransfer], T]
+) -> T:
+    """`mirrors.call()`, or `send` on `url` itself without any pool"""
+    if mirrors is None:
+        return send(url, MirrorTransfer(started=time.monotonic()))
+    return mirrors.call(url, send)
@@ -4,9 +4,12 @@ These dataclasses describe any book-like "work" independently of the source
 it came from (Project Gutenberg, Standard Ebooks, ...). Source-specific code
 converts its own metadata into these models; everything downstream (storage,
 export, ZIM assembly) only ever sees these types.
+
+`work_to_dict`/`work_from_dict` give works a JSON-friendly form, for the
+on-disk state that outlives a run (checkpoint journal, caches).
 """
 
-from dataclasses import dataclass, field
+from dataclasses import asdict, dataclass, field
 from datetime import date
 from typing import Any
 
@@ -28,6 +31,8 @@ class Format:
     url: str | None = None
     local_path: str | None = None
     size: int | None = None
+    # last modification of the file at its source (validator)
+    modified: str | None = None
 
 
 @dataclass(frozen=True, slots=True)
@@ -62,3 +67,26 @@ class Work:
     published: date | None = None
     source_url: str | None = None
     extra: dict[str, Any] = field(default_factory=dict)
+
+
+def work_to_dict(work: Work) -> dict[str, Any]:
+    """JSON-friendly representation of a work (see `work_from_dict`)"""
+    data = asdict(work)
+    data["published"] = work.published.isoformat() if work.published else None
+    return data
+
+
+def work_from_dict(data: dict[str, Any]) -> Work:
+    """Rebuild a work from its `work_to_dict` representation"""
+    return Work(
+        **{
+            **data,
+            "creators": [Creator(**creator) for creator in data["creators"]],
+            "formats": [Format(**fmt) for fmt in data["formats"]],
+            "cover": Cover(**data["cover"]) if data["cover"] else None,
+            "collections": [CollectionRef(**coll) for coll in data["collections"]],
+            "published": (
+                date.fromisoformat(data["published"]) if data["published"] else None
+            ),
+        }
+    )
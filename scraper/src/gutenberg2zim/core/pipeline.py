@@ -4,8 +4,16 @@
 
 1. `setup()` hook (source-specific pre-processing, e.g. exporting static
    assets before any book is processed),
-2. per-work processing in parallel with retry/backoff, via the
-   source-specific `process_ref()` hook,
+2. per-work processing through a staged engine (`core.concurrency.run_stages`)
+   whose stages map to source-specific hooks:
+   - metadata (`fetch_metadata()`, network-bound, with retry/backoff),
+   - download (`download()`, network-bound, with retry/backoff),
+   - transform (`transform()`, CPU-bound: rewriting, image optimization),
+   - write (`write()`, a single writer feeding the ZIM assembler),
+   each stage having its own worker count and a bounded input queue, so the
+   network and the CPU are kept busy independently; with a `ScrapeJournal`,
+   progress is checkpointed after each stage and works completed by an
+   interrupted run are replayed from the journal instead,
 3. popularity computation (star bucketing over download counts),
 4. final exports: JSON files and No-JS fallback pages (core exporters).
 
@@ -19,31 +27,110 @@ Notes:
   `run()` an already-discovered list of `WorkRef`s. For Gutenberg the
   entrypoint needs the filtered catalog entries anyway (language metadata,
   empty-result error, progress total), so discovery stays there.
-- Downloads are not migrated to `DownloadEngine` yet: the Gutenberg
-  per-book flow keeps using `download_book` (in-memory) inside its
-  `process_ref` implementation, so no download engine is accepted here.
+- The `DownloadEngine` handed to the pipeline is shared by all workers
+  (one pooled session); sources use it in their `download()` hook. With an
+  `AsyncDownloadEngine`, the download stage awaits `download_async()` on an
+  event loop instead, so `concurrency` books can be downloading at once
+  without as many threads.
 """
 
+import asyncio
+import inspect
+import os
 from abc import ABC, abstractmethod
 from functools import partial
 from http import HTTPStatus
+from typing import Any
 
 import apsw
 import backoff
 import requests
 
 from gutenberg2zim.constants import logger
-from gutenberg2zim.core.concurrency import parallel_map
+from gutenberg2zim.core.async_download_engine import AsyncDownloadEngine
+from gutenberg2zim.core.concurrency import Stage, run_stages
+from gutenberg2zim.core.download_engine import DownloadEngine
 from gutenberg2zim.core.exporters.json_exporter import generate_json_files
 from gutenberg2zim.core.exporters.nojs_exporter import generate_noscript_pages
+from gutenberg2zim.core.journal import FINAL_STATES, ScrapeJournal
+from gutenberg2zim.core.models import Work
 from gutenberg2zim.core.ports import MetadataPort, WorkRef
 from gutenberg2zim.core.progress import ScraperProgress
 from gutenberg2zim.core.work_store import WorkStore
-from gutenberg2zim.core.zim_assembler import ZimAssembler
+from gutenberg2zim.core.zim_assembler import ZimAssembler, ZimEntry
 
 NB_POPULARITY_STARS = 3
 
 
+def _backoff_busy_error_hdlr(details):
+    logger.warning(
+        "Backing off {wait:0.1f} seconds after {tries} tries "
+        "calling function {target} with args {args} and kwargs "
+        "{kwargs} due to apsw.BusyError".format(**details)
+    )
+
+
+def _backoff_request_error_hdlr(details):
+    logger.warning(
+        "Backing off {wait:0.1f} seconds after {tries} tries "
+        "calling function {target} with args {args} and kwargs "
+        "{kwargs} due to requests error".format(**details)
+    )
+
+
+def _fatal_code(e):
+    """Give up on errors codes 400-499 except 429"""
+    if (
+        isinstance(e, requests.HTTPError)
+        and e.response is not None
+        and (
+            HTTPStatus.BAD_REQUEST
+            <= e.response.status_code
+            < HTTPStatus.INTERNAL_SERVER_ERROR
+            and e.response.status_code != HTTPStatus.TOO_MANY_REQUESTS
+        )
+    ):
+        logger.warning(
+            f"{getattr(e.request, 'url', 'unknown url')} returned a "
+            f"non-retryable HTTP error code "
+            f"{e.response.status_code}"
+        )
+        return True
+    return False
+
+
+def with_retry(func):
+    """Wrap a network-bound stage function (or coroutine) with retry/backoff"""
+
+    def retrying(wrapper):
+        return backoff.on_exception(
+            partial(backoff.expo, base=3, factor=2),
+            requests.exceptions.RequestException,
+            max_time=30,  # secs
+            on_backoff=_backoff_request_error_hdlr,
+            giveup=_fatal_code,
+        )(
+            backoff.on_exception(
+                backoff.constant,
+                apsw.BusyError,
+                max_time=3,
+                on_backoff=_backoff_busy_error_hdlr,
+            )(wrapper)
+        )
+
+    if inspect.iscoroutinefunction(func):
+
+        async def async_wrapper(item):
+            return await func(item)
+
+        return retrying(async_wrapper)
+
+    def wrapper(item):
+        return func(item)
+
+    return retrying(wrapper)
+
+
 def compute_popularity(store: WorkStore) -> None:
     """Compute popularity stars for all works based on download counts"""
     # Compute popularity (a bit too late for rendering on books pages,
@@ -108,6 +195,10 @@ class Pipeline(ABC):
         add_lcc_shelves: bool,
         primary_color: str | None = None,
         secondary_color: str | None = None,
+        metadata_concurrency: int | None = None,
+        transform_concurrency: int | None = None,
+        journal: ScrapeJournal | None = None,
+        download_engine: DownloadEngine | None = None,
     ):
         self.metadata = metadata
         self.store = store
@@ -121,86 +212,183 @@ class Pipeline(ABC):
         self.add_lcc_shelves = add_lcc_shelves
         self.primary_color = primary_color
         self.secondary_color = secondary_color
+        self.metadata_concurrency = metadata_concurrency or concurrency
+        self.transform_concurrency = transform_concurrency or os.cpu_count() or 1
+        self.journal = journal
+        self.download_engine = download_engine
 
     def setup(self) -> None:
         """Hook run once before any work is processed (default: no-op)"""
 
     @abstractmethod
-    def process_ref(self, ref: WorkRef) -> None:
-        """Fetch metadata, download and export one work (source-specific)"""
+    def fetch_metadata(self, ref: WorkRef) -> Work | None:
+        """Fetch (and store) the full metadata of one work; None to skip it"""
+        ...
+
+    @abstractmethod
+    def download(self, work: Work) -> Any | None:
+        """Download the content of one work; None when nothing is available"""
         ...
 
+    async def download_async(self, work: Work) -> Any | None:
+        """Coroutine version of `download()`, used with an async download
+        engine (default: run `download()` in a thread)"""
+        return await asyncio.to_thread(self.download, work)
+
+    @abstractmethod
+    def transform(self, content: Any) -> list[ZimEntry] | None:
+        """Rewrite/optimize downloaded content into ZIM entries"""
+        ...
+
+    def write(self, entries: list[ZimEntry]) -> None:
+        """Add the entries of one work to the ZIM"""
+        for entry in entries:
+            self.assembler.add_entry(entry)
+
+    def replayed(self, entries: list[ZimEntry]) -> None:
+        """Hook run on the entries of a work replayed from the journal, before
+        they are written (default: no-op)"""
+
+    def _metadata_step(self, ref: WorkRef) -> tuple[WorkRef, Work] | None:
+        work = self.journal.work(ref) if self.journal else None
+        if work is not None:
+            # interrupted after metadata was fetched: no need to fetch it again
+            self.store.add(work)
+        else:
+            work = self.fetch_metadata(ref)
+        if self.journal:
+            if work is None:
+                self.journal.record_skipped(ref)
+            else:
+                self.journal.record_metadata(ref, work)
+        return None if work is None else (ref, work)
+
+    def _download_step(self, item: tuple[WorkRef, Work]) -> tuple[WorkRef, Any] | None:
+        ref, work = item
+        content = self.download(work)
+        if self.journal:
+            if content is None:
+                self.journal.record_skipped(ref)
+            else:
+                self.journal.record_downloaded(ref)
+        return None if content is None else (ref, content)
+
+    async def _download_step_async(
+        self, item: tuple[WorkRef, Work]
+    ) -> tuple[WorkRef, Any] | None:
+        ref, work = item
+        content = await self.download_async(work)
+        if self.journal:
+            if content is None:
+                self.journal.record_skipped(ref)
+            else:
+                self.journal.record_downloaded(ref)
+        return None if content is None else (ref, content)
+
+    def _transform_step(
+        self, item: tuple[WorkRef, Any]
+    ) -> tuple[WorkRef, list[ZimEntry]] | None:
+        ref, content = item
+        entries = self.transform(content)
+        if entries is None:
+            return None
+        if self.journal:
+            # persisted by the transform workers rather than the single
+            # writer, and before writing: the assembler may consume (delete)
+            # files
+            self.journal.save_entries(ref, entries)
+        return ref, entries
+
+    def _write_step(self, item: tuple[WorkRef, list[ZimEntry]]) -> None:
+        ref, entries = item
+        if self.journal:
+            self.journal.record_written(ref)
+        self.write(entries)
+
+    def process_ref(self, ref: WorkRef) -> None:
+        """Run all stages for one work, sequentially in the caller thread"""
+        item = self._metadata_step(ref)
+        if item is not None:
+            item = self._download_step(item)
+        if item is not None:
+            item = self._transform_step(item)
+        if item is not None:
+            self._write_step(item)
+
+    def stages(self) -> list[Stage]:
+        """Stages of the per-work processing, in order"""
+        return [
+            Stage(
+                name="metadata",
+                func=with_retry(self._metadata_step),
+                workers=self.metadata_concurrency,
+            ),
+            Stage(
+                name="download",
+                # with an async engine, downloads are in flight on an event loop
+                # instead of each blocking a thread
+                func=with_retry(
+                    self._download_step_async
+                    if isinstance(self.download_engine, AsyncDownloadEngine)
+                    else self._download_step
+                ),
+                workers=self.concurrency,
+            ),
+            Stage(
+                name="transform",
+                func=self._transform_step,
+                workers=self.transform_concurrency,
+            ),
+            # a single writer: the assembler serializes writes anyway
+            Stage(name="write", func=self._write_step, workers=1),
+        ]
+
+    def replay_completed(self, refs: list[WorkRef]) -> list[WorkRef]:
+        """Replay works completed by a previous run; return the remaining ones"""
+        if not self.journal:
+            return refs
+        remaining = []
+        for ref in refs:
+            if self.journal.state(ref) not in FINAL_STATES:
+                remaining.append(ref)
+                continue
+            work, entries = self.journal.replay(ref)
+            if work is not None:
+                self.store.add(work)
+            self.replayed(entries)
+            self.write(entries)
+            self.progress.increase_progress()
+        if len(remaining) < len(refs):
+            logger.info(
+                f"Resumed {len(refs) - len(remaining)} books from the scrape journal"
+            )
+        return remaining
+
     def run(self, refs: list[WorkRef]) -> None:
         """Orchestrate processing of discovered works and final exports"""
         self.setup()
 
+        refs = self.replay_completed(refs)
+        stages = self.stages()
         logger.info(
             f"Processing {len(refs)} books with "
-            f"{self.concurrency} (parallel) worker(s)"
+            + ", ".join(f"{stage.workers} {stage.name}" for stage in stages)
+            + " worker(s)"
         )
 
-        def backoff_busy_error_hdlr(details):
-            logger.warning(
-                "Backing off {wait:0.1f} seconds after {tries} tries "
-                "calling function {target} with args {args} and kwargs "
-                "{kwargs} due to apsw.BusyError".format(**details)
-            )
-
-        def backoff_request_error_hdlr(details):
-            logger.warning(
-                "Backing off {wait:0.1f} seconds after {tries} tries "
-                "calling function {target} with args {args} and kwargs "
-                "{kwargs} due to requests error".format(**details)
+        def on_error(stage: Stage, ref: WorkRef, _exc: Exception):
+            logger.error(
+                f"Fatal error received with processing book {ref.id} "
+                f"at {stage.name} stage",
+                exc_info=True,
             )
 
-        def fatal_code(e):
-            """Give up on errors codes 400-499 except 429"""
-            if (
-                isinstance(e, requests.HTTPError)
-                and e.response is not None
-                and (
-                    HTTPStatus.BAD_REQUEST
-                    <= e.response.status_code
-                    < HTTPStatus.INTERNAL_SERVER_ERROR
-                    and e.response.status_code != HTTPStatus.TOO_MANY_REQUESTS
-                )
-            ):
-                logger.warning(
-                    f"{getattr(e.request, 'url', 'unknown url')} returned a "
-                    f"non-retryable HTTP error code "
-                    f"{e.response.status_code}"
-                )
-                return True
-            return False
-
-        @backoff.on_exception(
-            partial(backoff.expo, base=3, factor=2),
-            requests.exceptions.RequestException,
-            max_time=30,  # secs
-            on_backoff=backoff_request_error_hdlr,
-            giveup=fatal_code,
+        run_stages(
+            stages,
+            refs,
+            on_done=lambda _ref: self.progress.increase_progress(),
+            on_error=on_error,
         )
-        @backoff.on_exception(
-            backoff.constant,
-            apsw.BusyError,
-            max_time=3,
-            on_backoff=backoff_busy_error_hdlr,
-        )
-        def process_ref_with_retry(ref: WorkRef):
-            """Process one work with retry logic"""
-            self.process_ref(ref)
-
-        def process_one(ref: WorkRef):
-            try:
-                process_ref_with_retry(ref)
-            except Exception:
-                logger.error(
-                    f"Fatal error received with processing book {ref.id}",
-                    exc_info=True,
-                )
-            self.progress.increase_progress()
-
-        parallel_map(process_one, refs, self.concurrency)
 
         compute_popularity(self.store)
 
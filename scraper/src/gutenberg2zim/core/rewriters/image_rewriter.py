@@ -5,33 +5,127 @@ Source-agnostic: nothing here knows about Gutenberg specifics.
 """
 
 import io
-from dataclasses import asdict
+import json
+import time
+from collections.abc import Mapping
+from dataclasses import asdict, dataclass
 from pathlib import Path
+from typing import Any, NamedTuple
 
 from bs4 import BeautifulSoup
+from PIL.Image import Image, Resampling
 from PIL.Image import open as pilopen
 from zimscraperlib.image.optimization import OptimizeWebpOptions
 
 from gutenberg2zim.constants import logger
 
 default_webp_options = asdict(OptimizeWebpOptions())
+# encoder of `ImageProcessor.optimize_image_content`, with its settings
+WEBP_ENCODER = f"webp {json.dumps(default_webp_options, sort_keys=True)}"
 
 
-def rewrite_html_image_references(soup: BeautifulSoup, label: str) -> None:
-    """Rewrite HTML image references to use .webp extension for converted images."""
+class WebpPreset(NamedTuple):
+    """WebP settings tried by the adaptive encoder selection"""
+
+    options: dict[str, Any]
+    # CPU time relative to the default settings, to tell whether it fits
+    # in the budget left
+    cost: float
+
+
+DEFAULT_PRESET = WebpPreset(default_webp_options, cost=1)
+# tried on lossless sources (PNG, GIF), by increasing cost
+LOSSLESS_PRESETS = (
+    WebpPreset({"lossless": True, "quality": 75, "method": 4}, cost=2),
+    WebpPreset({"lossless": True, "quality": 100, "method": 6}, cost=30),
+)
+ADAPTIVE_ENCODER = "adaptive " + json.dumps(
+    [preset.options for preset in (DEFAULT_PRESET, *LOSSLESS_PRESETS)],
+    sort_keys=True,
+)
+
+
+@dataclass(frozen=True, slots=True)
+class ImageOptions:
+    """How images converted to WebP are optimized"""
+
+    # largest width/height of converted images, in pixels (None: kept as is)
+    max_dimension: int | None = None
+    # CPU time in ms per image for trying other encodings than the default
+    # WebP one, the smallest being kept (None: default WebP encoding only)
+    encoder_budget: int | None = None
+
+    @property
+    def encoder(self) -> str:
+        """Encoder and settings images are optimized with (see `ImageCache`)"""
+        encoder = WEBP_ENCODER
+        if self.encoder_budget is not None:
+            encoder = f"{ADAPTIVE_ENCODER} budget={self.encoder_budget}"
+        if self.max_dimension is None:
+            return encoder
+        return f"{encoder} max_dimension={self.max_dimension}"
+
+
+DEFAULT_IMAGE_OPTIONS = ImageOptions()
+
+
+def scaled_size(width: int, height: int, max_dimension: int) -> tuple[int, int]:
+    """Size of a `width`x`height` image downscaled to fit `max_dimension`"""
+    ratio = max_dimension / max(width, height)
+    return max(1, round(width * ratio)), max(1, round(height * ratio))
+
+
+class StoredImage(NamedTuple):
+    """Book image stored at `path` rather than its output filename, or
+    downscaled (see `ImageProcessor.get_output_filename`)"""
+
+    path: str
+    # width/height of the source image and of the stored one, when downscaled
+    source_size: tuple[int, int] | None = None
+    size: tuple[int, int] | None = None
+
+
+def stored_dimensions(
+    width: str | None, height: str | None, stored: StoredImage | None
+) -> tuple[str, str] | None:
+    """`width`/`height` attributes of an image stored downscaled: its stored
+    size when they are unset or the size of its source, None when they are
+    to keep (another display size, the stored image is scaled to anyway)"""
+    if stored is None or stored.size is None or stored.source_size is None:
+        return None
+    for attribute, dimension in zip((width, height), stored.source_size, strict=True):
+        if attribute is not None and attribute != str(dimension):
+            return None
+    return str(stored.size[0]), str(stored.size[1])
+
+
+def rewrite_html_image_references(
+    soup: BeautifulSoup,
+    label: str,
+    image_paths: Mapping[str, StoredImage] | None = None,
+) -> None:
+    """Rewrite HTML image references to use .webp extension for converted images.
+
+    References to images stored at another path are rewritten to it, and
+    the width/height of downscaled ones set to their stored size (see
+    `StoredImage`, `ImageProcessor.get_output_filename`).
+    """
 
     def rewrite_reference(element, attr, ref_type):
         """Helper to rewrite a single reference attribute."""
         if attr in element.attrs:
             old_ref = element[attr]
-            new_ref = ImageProcessor.get_output_filename(old_ref)
+            new_ref = ImageProcessor.get_output_filename(old_ref, image_paths)
             if old_ref != new_ref:
                 element[attr] = new_ref
                 logger.debug(f"{label}: Rewrote {ref_type} {old_ref} -> {new_ref}")
 
     # Rewrite <img> tags
     for img in soup.find_all("img"):
+        stored = ImageProcessor.get_stored_image(img.get("src", ""), image_paths)
         rewrite_reference(img, "src", "image")
+        if dimensions := stored_dimensions(img.get("width"), img.get("height"), stored):
+            img["width"], img["height"] = dimensions
 
     # Rewrite <link rel="icon"> tags (for cover images in HTML head)
     for link in soup.find_all("link", rel="icon"):
@@ -52,16 +146,115 @@ class ImageProcessor:
         return ImageProcessor.get_extension(filename) in ("jpg", "jpeg", "png")
 
     @staticmethod
-    def get_output_filename(filename: str) -> str:
-        """Get output filename with .webp extension if file will be converted."""
+    def get_output_filename(
+        filename: str, image_paths: Mapping[str, StoredImage] | None = None
+    ) -> str:
+        """Get output filename with .webp extension if file will be converted.
+
+        `image_paths` maps the output filenames of images stored at another
+        path (encoding selected by `ImageProcessor.select_encoding`) to it.
+        """
+        output_filename = filename
         if ImageProcessor.should_convert_to_webp(filename):
+            output_filename = str(Path(filename).with_suffix(".webp"))
+        if image_paths and (stored := image_paths.get(output_filename)):
+            return stored.path
+        return output_filename
+
+    @staticmethod
+    def get_stored_image(
+        filename: str, image_paths: Mapping[str, StoredImage] | None
+    ) -> StoredImage | None:
+        """How the image at `filename` is stored, when recorded in `image_paths`"""
+        if not image_paths:
+            return None
+        return image_paths.get(ImageProcessor.get_output_filename(filename))
+
+    @staticmethod
+    def image_size(payload: bytes | Path) -> tuple[int, int] | None:
+        """Width/height of an image (only its header being read), None for
+        other files"""
+        try:
+            with pilopen(
+                payload if isinstance(payload, Path) else io.BytesIO(payload)
+            ) as image:
+                return image.size
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def get_stored_filename(filename: str, content: bytes) -> str:
+        """Filename an optimized image is stored at: with .webp extension
+        when converted to WebP, as is when the original was kept"""
+        if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
             return str(Path(filename).with_suffix(".webp"))
         return filename
 
     @staticmethod
-    def optimize_image_content(file_content: bytes) -> bytes:
-        """Convert and optimize image content to WebP format."""
-        dst = io.BytesIO()
+    def optimize_image_content(
+        file_content: bytes, options: ImageOptions = DEFAULT_IMAGE_OPTIONS
+    ) -> bytes:
+        """Convert and optimize image content to WebP format.
+
+        Images larger than `options.max_dimension` are downscaled, JPEGs
+        being decoded at a reduced scale (no less than twice the target size)
+        rather than at full resolution. With an `options.encoder_budget`, the
+        encoding is selected by `ImageProcessor.select_encoding`.
+        """
         with pilopen(io.BytesIO(file_content)) as image:
-            image.save(dst, format="WEBP", **default_webp_options)
+            if options.encoder_budget is not None:
+                return ImageProcessor.select_encoding(image, file_content, options)
+            return ImageProcessor.encode_webp(
+                ImageProcessor.downscale(image, options.max_dimension),
+                default_webp_options,
+            )
+
+    @staticmethod
+    def downscale(image: Image, max_dimension: int | None) -> Image:
+        """`image` downscaled to fit `max_dimension` (itself when it does)"""
+        if max_dimension is None or max(image.size) <= max_dimension:
+            return image
+        width, height = scaled_size(*image.size, max_dimension)
+        image.draft(None, (width * 2, height * 2))
+        return image.resize((width, height), Resampling.LANCZOS)
+
+    @staticmethod
+    def encode_webp(image: Image, webp_options: dict[str, Any]) -> bytes:
+        dst = io.BytesIO()
+        image.save(dst, format="WEBP", **webp_options)
         return dst.getvalue()
+
+    @staticmethod
+    def select_encoding(image: Image, original: bytes, options: ImageOptions) -> bytes:
+        """Smallest of the encodings of `image` tried within the CPU time of
+        `options.encoder_budget`: the default WebP one (always tried), the
+        lossless ones for lossless sources and the `original` itself, unless
+        downscaled
+
+        GIFs, not converted by default, are only tried with lossless presets
+        when not animated, and never downscaled.
+        """
+        if image.format == "GIF":
+            if getattr(image, "is_animated", False):
+                return original
+            source, presets = image, LOSSLESS_PRESETS
+        else:
+            source = ImageProcessor.downscale(image, options.max_dimension)
+            presets = (DEFAULT_PRESET,)
+            if image.format != "JPEG":
+                presets += LOSSLESS_PRESETS
+        budget = (options.encoder_budget or 0) / 1000
+        start = time.thread_time()
+        first, *others = presets
+        best = ImageProcessor.encode_webp(source, first.options)
+        # CPU time of a cost unit, measured with the first preset
+        unit = (time.thread_time() - start) / first.cost
+        if source is image and len(original) <= len(best):
+            best = original
+        for preset in others:
+            if time.thread_time() - start + preset.cost * unit > budget:
+                break
+            encoded = ImageProcessor.encode_webp(source, preset.options)
+            if len(encoded) < len(best):
+                best = encoded
+        return best
@@ -0,0 +1,120 @@
+"""Disk spill for large payloads.
+
+Book files are passed around as payloads: `bytes` when small, or a `Path` to
+a file owned by the payload holder when larger than the spill threshold, so
+that memory stays bounded whatever the size of a book. Spilled files are
+handed to the ZIM with `delete_fpath=True` (or removed once consumed); the
+spill folder itself lives in the scrape temporary folder.
+"""
+
+import hashlib
+import io
+import mmap
+import os
+import shutil
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO
+
+# a book file: in memory, or spilled to a file owned by the holder
+type Payload = bytes | Path
+
+
+def payload_size(payload: Payload) -> int:
+    return payload.stat().st_size if isinstance(payload, Path) else len(payload)
+
+
+def payload_digest(payload: Payload) -> bytes:
+    """128-bit digest of the content of a payload"""
+
+    def digest():
+        return hashlib.blake2b(digest_size=16)
+
+    if isinstance(payload, Path):
+        with open(payload, "rb") as fh:
+            return hashlib.file_digest(fh, digest).digest()
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+
+def consume_payload(payload: Payload) -> bytes:
+    """Content of a payload, removing its file if it was spilled"""
+    if isinstance(payload, Path):
+        data = payload.read_bytes()
+        payload.unlink(missing_ok=True)
+        return data
+    return payload
+
+
+def discard_payload(payload: Payload) -> None:
+    if isinstance(payload, Path):
+        payload.unlink(missing_ok=True)
+
+
+@contextmanager
+def open_payload(payload: Payload) -> Iterator[IO[bytes] | mmap.mmap]:
+    """Payload as a seekable file object; spilled files are memory-mapped
+    rather than read, so that e.g. a large zip can be extracted in place"""
+    if not isinstance(payload, Path) or not payload.stat().st_size:
+        # empty files cannot be mapped
+        yield io.BytesIO(payload if isinstance(payload, bytes) else b"")
+        return
+    with (
+        open(payload, "rb") as fh,
+        mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped,
+    ):
+        yield mapped
+
+
+class PayloadSpiller:
+    """Keeps payloads above `threshold` bytes out of memory, in `folder`"""
+
+    def __init__(self, folder: Path, threshold: int):
+        self.folder = folder
+        self.threshold = threshold
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+    def should_spill(self, size: int) -> bool:
+        return size > self.threshold
+
+    def new_path(self, suffix: str = "") -> Path:
+        """Unique path for a new spilled file"""
+        return self.folder / f"{uuid.uuid4().hex}{suffix}"
+
+    def spill(self, payload: Payload, suffix: str = "") -> Payload:
+        """`payload`, written to a new spilled file if above the threshold"""
+        if isinstance(payload, Path) or not self.should_spill(len(payload)):
+            return payload
+        path = self.new_path(suffix)
+        path.write_bytes(payload)
+        return path
+
+    def spill_stream(self, fh: IO[bytes], suffix: str = "") -> Path:
+        """Copy a file object to a new spilled file, by chunks"""
+        path = self.new_path(suffix)
+        with open(path, "wb") as dst:
+            shutil.copyfileobj(fh, dst)
+        return path
+
+    def adopt(self, path: Path, *, keep_original: bool) -> Path:
+        """Spilled file with the content of `path` (moved, or linked/copied
+        when the original must be kept, e.g. a cached download)"""
+        spilled = self.new_path(path.suffix)
+        if not keep_original:
+            try:
+                path.replace(spilled)
+                return spilled
+            except OSError:  # not on the same filesystem
+                pass
+        else:
+            try:
+                # removing the link later leaves the original untouched
+                os.link(path, spilled)
+                return spilled
+            except OSError:
+                pass
+        shutil.copyfile(path, spilled)
+        if not keep_original:
+            path.unlink(missing_ok=True)
+        return spilled
@@ -1,5 +1,7 @@
 import hashlib
+import shutil
 import subprocess
+import time
 import unicodedata
 import zipfile
 from pathlib import Path
@@ -10,6 +12,8 @@ import requests
 
 from gutenberg2zim.constants import DEFAULT_HTTP_TIMEOUT, DL_CHUNCK_SIZE, logger
 from gutenberg2zim.core.language import language_name
+from gutenberg2zim.core.local_mirror import local_file, local_path
+from gutenberg2zim.core.mirror_pool import MirrorPool, MirrorTransfer, call_mirrors
 from gutenberg2zim.core.work_store import WorkStore
 
 UTF8 = "utf-8"
@@ -74,17 +78,31 @@ def exec_cmd(cmd):
     return subprocess.run(args, check=False).returncode
 
 
-def download_file(url: str, fpath: Path) -> bool:
+def download_file(url: str, fpath: Path, mirrors: MirrorPool | None = None) -> bool:
     fpath.parent.mkdir(parents=True, exist_ok=True)
-    try:
+    if local_path(url) is not None:
+        try:
+            shutil.copyfile(local_file(url), fpath)
+            return True
+        except Exception as exc:
+            logger.error(f"Error while copying from {url}: {exc}")
+            return False
+
+    def _get(mirror_url: str, transfer: MirrorTransfer):
         resp = requests.get(
-            url, stream=True, timeout=DEFAULT_HTTP_TIMEOUT
+            mirror_url, stream=True, timeout=DEFAULT_HTTP_TIMEOUT
         )  # in seconds
+        transfer.responded(resp.status_code, resp.headers.get("Retry-After"))
         resp.raise_for_status()
         with open(fpath, "wb") as fh:
             for chunk in resp.iter_content(chunk_size=DL_CHUNCK_SIZE):
                 if chunk:
                     fh.write(chunk)
+                    if delay := transfer.received(len(chunk)):
+                        time.sleep(delay)
+
+    try:
+        call_mirrors(mirrors, url, _get)
         return True
     except Exception as exc:
         logger.error(f"Error while downloading from {url}: {exc}")
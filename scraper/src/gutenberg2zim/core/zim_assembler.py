@@ -4,10 +4,19 @@ Replaces the `Global` static holder in `shared.py`: callers receive a
 `ZimAssembler` instance instead of reaching for shared mutable state. All
 write operations are serialized through an internal lock, so worker threads
 may add items concurrently.
+
+`ZimEntry` describes one item (or alias) prepared ahead of writing, so that
+the CPU-heavy preparation of a book can happen away from the writer. An
+alias may be added before its target (an image stored by another book being
+written later, see `core.image_dedup`): the caller then has it held back
+until the target is added, as are the aliases to held aliases. Only the
+paths of held aliases are kept, not those of all the entries added.
 """
 
 import pathlib
 import threading
+from collections import defaultdict
+from dataclasses import dataclass
 from datetime import date
 
 from zimscraperlib.zim.creator import Creator
@@ -30,6 +39,33 @@ from zimscraperlib.zim.metadata import (
 from gutenberg2zim.constants import FAVICON_BYTES, VERSION, logger
 
 
+@dataclass(frozen=True, slots=True)
+class ZimEntry:
+    """One ZIM item (content or file) or alias (when `alias_target` is set)"""
+
+    path: str
+    title: str | None = None
+    content: str | bytes | None = None
+    fpath: pathlib.Path | None = None
+    mimetype: str | None = None
+    is_front: bool | None = None
+    auto_index: bool = False
+    delete_fpath: bool = False
+    alias_target: str | None = None
+    # key of the image stored by this item in an `ImageRegistry`, recorded
+    # by the journal so that the registry knows it again on resume
+    dedup_key: bytes | None = None
+
+    @property
+    def size(self) -> int:
+        """Size of the content of the item, in bytes"""
+        if self.fpath:
+            return self.fpath.stat().st_size
+        if isinstance(self.content, str):
+            return len(self.content.encode("utf-8"))
+        return len(self.content or b"")
+
+
 class ZimAssembler:
     """Thread-safe wrapper around `zimscraperlib.Creator`."""
 
@@ -50,6 +86,12 @@ class ZimAssembler:
         debug: bool = False,
     ):
         self._lock = threading.Lock()
+        # aliases (path, title) waiting for their target to be added, by target
+        self._pending_aliases: defaultdict[str, list[tuple[str, str]]] = defaultdict(
+            list
+        )
+        # paths of the aliases waiting, that other aliases may target
+        self._held: set[str] = set()
         self._creator = (
             Creator(
                 filename=filename,
@@ -122,24 +164,70 @@ class ZimAssembler:
                 auto_index=auto_index,
                 index_data=index_data,
             )
+            aliases = self._pending_aliases.pop(path, None)
+        self._add_pending_aliases(path, aliases)
 
     def add_illustration(self, illus_fpath: pathlib.Path, illus_size: int):
         with open(illus_fpath, "rb") as fh:
             with self._lock:
                 self._creator.add_illustration(illus_size, fh.read())
 
-    def add_alias(self, path: str, title: str, target: str):
-        """Add a ZIM alias from path to target (for images/data, not HTML)"""
+    def add_alias(self, path: str, title: str, target: str, *, held: bool = False):
+        """Add a ZIM alias from path to target (for images/data, not HTML)
+
+        With `held` (target possibly not added yet), or when target is a held
+        alias, the alias is held until its target is added.
+        """
         logger.debug(f"\t\tAdding ZIM alias from {path} to {target}")
         with self._lock:
+            if held or target in self._held:
+                logger.debug(f"\t\tHolding ZIM alias {path} until {target} is added")
+                self._pending_aliases[target].append((path, title))
+                self._held.add(path)
+                return
             self._creator.add_alias(
                 path=path,
                 title=title,
                 targetPath=target,
                 hints={},
             )
+            self._held.discard(path)
+            aliases = self._pending_aliases.pop(path, None)
+        self._add_pending_aliases(path, aliases)
+
+    def _add_pending_aliases(
+        self, target: str, aliases: list[tuple[str, str]] | None
+    ) -> None:
+        for path, title in aliases or ():
+            self.add_alias(path=path, title=title, target=target)
+
+    def add_entry(self, entry: ZimEntry, *, held: bool = False):
+        """Add a prepared `ZimEntry` (item or alias, `held` as by `add_alias`)"""
+        if entry.alias_target is not None:
+            self.add_alias(
+                path=entry.path,
+                title=entry.title or "",
+                target=entry.alias_target,
+                held=held,
+            )
+            return
+        self.add_item_for(
+            path=entry.path,
+            title=entry.title,
+            fpath=entry.fpath,
+            content=entry.content,
+            mimetype=entry.mimetype,
+            is_front=entry.is_front,
+            delete_fpath=entry.delete_fpath,
+            auto_index=entry.auto_index,
+        )
 
     def finish(self):
+        if self._pending_aliases:
+            logger.warning(
+                f"Skipping {sum(map(len, self._pending_aliases.values()))} ZIM "
+                f"aliases to missing entries: {', '.join(self._pending_aliases)}"
+            )
         if self._creator.can_finish:
             logger.info("Finishing ZIM file")
             with self._lock:
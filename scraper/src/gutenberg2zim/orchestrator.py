@@ -3,26 +3,40 @@
 `run_scrape(config)` is everything between "CLI arguments parsed into a
 `ScrapeConfig`" and "ZIM written": logging setup, i18n, CSV catalog
 download/load/filter, language derivation, and `build_zimfile` (moved here
-from the deleted `zim.py`), which creates the `ZimAssembler` and drives the
-`GutenbergPipeline`.
+from the deleted `zim.py`), which creates the `ZimAssembler` and the
+checkpoint `ScrapeJournal` (next to the ZIM) and the shared
+`DownloadEngine`, and drives the `GutenbergPipeline`. All mirror requests
+(catalog, RDFs, book files) go through one `MirrorPool`.
 """
 
 import datetime
 import logging
+import shutil
+import tempfile
 from dataclasses import replace
 from pathlib import Path
 
 from gutenberg2zim.config import ScrapeConfig
 from gutenberg2zim.constants import logger
 from gutenberg2zim.core import i18n
+from gutenberg2zim.core.async_download_engine import AsyncDownloadEngine
+from gutenberg2zim.core.concurrency import process_pool
+from gutenberg2zim.core.download_engine import DownloadEngine
+from gutenberg2zim.core.epub_cache import EpubCache
 from gutenberg2zim.core.exporters.ui_dist_exporter import export_ui_dist
+from gutenberg2zim.core.image_cache import ImageCache
+from gutenberg2zim.core.image_dedup import ImageRegistry
+from gutenberg2zim.core.journal import ScrapeJournal
 from gutenberg2zim.core.language import (
     ISO_MATRIX,
     ISO_MATRIX_REV,
     get_zim_language_metadata,
 )
+from gutenberg2zim.core.mirror_pool import MirrorPool
 from gutenberg2zim.core.ports import WorkRef
 from gutenberg2zim.core.progress import ScraperProgress
+from gutenberg2zim.core.rewriters.image_rewriter import ImageOptions
+from gutenberg2zim.core.spill import PayloadSpiller
 from gutenberg2zim.core.utils import critical_error, get_zim_name
 from gutenberg2zim.core.work_store import WorkStore
 from gutenberg2zim.core.zim_assembler import ZimAssembler
@@ -34,8 +48,15 @@ from gutenberg2zim.sources.gutenberg.catalog import (
     get_csv_fpath,
     load_catalog,
 )
-from gutenberg2zim.sources.gutenberg.metadata import GutenbergRdfMetadata
+from gutenberg2zim.sources.gutenberg.metadata import (
+    GutenbergRdfArchiveMetadata,
+    GutenbergRdfMetadata,
+    RdfMetadataCache,
+    download_rdf_archive,
+    get_rdf_archive_fpath,
+)
 from gutenberg2zim.sources.gutenberg.pipeline import GutenbergPipeline
+from gutenberg2zim.sources.gutenberg.resolver import FormatAvailabilityIndex
 
 
 def run_scrape(config: ScrapeConfig) -> None:
@@ -51,10 +72,18 @@ def run_scrape(config: ScrapeConfig) -> None:
     progress = ScraperProgress(config.stats_filename)
     progress.increase_total(1)
 
+    mirrors = MirrorPool(
+        config.mirror_urls or [config.mirror_url],
+        requests_per_second=config.host_requests_per_second,
+        bytes_per_second=(
+            config.host_bandwidth * 2**10 if config.host_bandwidth else None
+        ),
+    )
+
     # Download CSV catalog
     csv_url = f"{config.mirror_url}/cache/epub/feeds/pg_catalog.csv.gz"
     logger.info(f"PREPARING CSV catalog from {csv_url}")
-    download_csv_file(csv_path=csv_path, csv_url=csv_url)
+    download_csv_file(csv_path=csv_path, csv_url=csv_url, mirrors=mirrors)
 
     # Load catalog and filter books
     logger.info(f"LOADING catalog from {csv_path}")
@@ -87,6 +116,15 @@ def run_scrape(config: ScrapeConfig) -> None:
         )
     progress.increase_progress()
 
+    if config.use_rdf_archive:
+        rdf_archive_url = f"{config.mirror_url}/cache/epub/feeds/rdf-files.tar.bz2"
+        logger.info(f"PREPARING RDF archive from {rdf_archive_url}")
+        download_rdf_archive(
+            archive_path=get_rdf_archive_fpath(),
+            archive_url=rdf_archive_url,
+            mirrors=mirrors,
+        )
+
     # Build ZIM file
     logger.info("BUILDING ZIM")
 
@@ -97,7 +135,9 @@ def run_scrape(config: ScrapeConfig) -> None:
         config=replace(config, languages=book_languages),
         work_store=work_store,
         progress=progress,
+        mirrors=mirrors,
     )
+    mirrors.log_stats()
 
     # Final increase to indicate we are done
     progress.increase_progress()
@@ -111,6 +151,7 @@ def build_zimfile(
     config: ScrapeConfig,
     work_store: WorkStore,
     progress: ScraperProgress,
+    mirrors: MirrorPool | None = None,
 ) -> None:
     """Build ZIM file from the works collected in the work store"""
     progress.increase_total(len(books))
@@ -133,6 +174,7 @@ def build_zimfile(
     primary_color = config.primary_color
     secondary_color = config.secondary_color
     overwrite = config.overwrite
+    resume = config.resume
     is_selection = config.is_selection
     title_search = config.title_search
     add_lcc_shelves = config.add_lcc_shelves
@@ -174,13 +216,84 @@ def build_zimfile(
     # Ensure the output folder exists before creating the ZIM
     zim_path.parent.mkdir(parents=True, exist_ok=True)
 
-    if zim_path.exists() and not overwrite:
+    if zim_path.exists() and not (overwrite or resume):
         logger.info(f"ZIM file `{zim_file}` already exist.")
         return
     elif zim_path.exists():
         logger.info(f"Removing existing ZIM file {zim_file}")
         zim_path.unlink(missing_ok=True)
 
+    journal = (
+        ScrapeJournal(zim_path.parent / f"{zim_path.stem}.journal", resume=resume)
+        if config.journal
+        else None
+    )
+
+    # downloaded files are kept across runs only with a cache folder
+    cache_max_size = None
+    if config.cache_dir:
+        downloads_dir = config.cache_dir / "downloads"
+        if config.cache_max_size:
+            cache_max_size = config.cache_max_size * 2**20
+    else:
+        downloads_dir = Path(
+            tempfile.mkdtemp(prefix="gutenberg-downloads-", dir=config.temp_dir)
+        )
+    # large book files are kept on disk rather than in memory until added
+    spiller = PayloadSpiller(
+        Path(tempfile.mkdtemp(prefix="gutenberg-spill-", dir=config.temp_dir)),
+        threshold=config.spill_threshold * 2**20,
+    )
+    # book files are rather rewritten/optimized by processes (the ZIM still
+    # being written by this one)
+    transform_pool = (
+        process_pool(config.transform_processes, debug=config.debug)
+        if config.transform_processes
+        else None
+    )
+    # images shared by books are stored once
+    image_registry = ImageRegistry()
+    # optimized images are kept across runs only with a cache folder
+    image_cache = None
+    if config.cache_dir:
+        image_cache = ImageCache(
+            config.cache_dir / "images",
+            max_size=(
+                config.image_cache_max_size * 2**20
+                if config.image_cache_max_size
+                else None
+            ),
+        )
+        image_cache.trim()
+    # as are optimized EPUBs
+    epub_cache = None
+    if config.cache_dir:
+        epub_cache = EpubCache(
+            config.cache_dir / "epubs",
+            max_size=(
+                config.epub_cache_max_size * 2**20
+                if config.epub_cache_max_size
+                else None
+            ),
+        )
+        epub_cache.trim()
+    if config.async_downloads:
+        download_engine = AsyncDownloadEngine(
+            downloads_dir,
+            connections_per_host=config.host_connections,
+            keep_cache=bool(config.cache_dir),
+            cache_max_size=cache_max_size,
+            mirrors=mirrors,
+        )
+    else:
+        download_engine = DownloadEngine(
+            downloads_dir,
+            pool_size=concurrency,
+            keep_cache=bool(config.cache_dir),
+            cache_max_size=cache_max_size,
+            mirrors=mirrors,
+        )
+
     assembler = ZimAssembler(
         filename=zim_path,
         language=zim_languages or get_zim_language_metadata(languages, books),
@@ -209,12 +322,33 @@ def build_zimfile(
             )
             for book in books
         ]
+        rdf_cache = (
+            RdfMetadataCache(
+                config.cache_dir / "rdf.db", ttl=config.metadata_ttl * 3600
+            )
+            if config.cache_dir
+            else None
+        )
+        if config.use_rdf_archive:
+            metadata = GutenbergRdfArchiveMetadata(
+                mirror_url,
+                archive_path=get_rdf_archive_fpath(),
+                book_ids=[ref.id for ref in refs],
+                cache=rdf_cache,
+                mirrors=mirrors,
+            )
+        else:
+            metadata = GutenbergRdfMetadata(
+                mirror_url, cache=rdf_cache, mirrors=mirrors
+            )
         pipeline = GutenbergPipeline(
-            metadata=GutenbergRdfMetadata(mirror_url),
+            metadata=metadata,
             store=work_store,
             assembler=assembler,
             progress=progress,
             concurrency=concurrency,
+            metadata_concurrency=config.metadata_concurrency,
+            transform_concurrency=config.transform_concurrency,
             formats=formats,
             zim_name=zim_name,
             title=title,
@@ -224,6 +358,24 @@ def build_zimfile(
             secondary_color=secondary_color,
             mirror_url=mirror_url,
             title_search=title_search,
+            journal=journal,
+            download_engine=download_engine,
+            availability=(
+                FormatAvailabilityIndex(config.cache_dir / "formats.db")
+                if config.cache_dir
+                else None
+            ),
+            spiller=spiller,
+            html_rewriter=config.html_rewriter,
+            transform_pool=transform_pool,
+            transform_chunk_size=config.transform_chunk_size,
+            image_registry=image_registry,
+            image_cache=image_cache,
+            image_options=ImageOptions(
+                max_dimension=config.max_image_dimension,
+                encoder_budget=config.image_encoder_budget,
+            ),
+            epub_cache=epub_cache,
         )
         pipeline.run(refs)
 
@@ -240,3 +392,22 @@ def build_zimfile(
         raise
     else:
         assembler.finish()
+        if journal:
+            journal.discard()
+    finally:
+        if transform_pool:
+            transform_pool.shutdown(cancel_futures=True)
+        if isinstance(download_engine, AsyncDownloadEngine):
+            download_engine.close()
+        if config.cache_dir:
+            logger.info(f"Download cache: {download_engine.cache.stats}")
+        else:
+            shutil.rmtree(downloads_dir, ignore_errors=True)
+        logger.info(f"Image deduplication: {image_registry.stats}")
+        if image_cache:
+            image_cache.trim()
+        if epub_cache:
+            for language, sizes in sorted(epub_cache.sizes.items()):
+                logger.info(f"EPUB optimization ({language}): {sizes}")
+            epub_cache.trim()
+        shutil.rmtree(spiller.folder, ignore_errors=True)
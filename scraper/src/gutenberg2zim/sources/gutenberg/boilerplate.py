@@ -0,0 +1,210 @@
+"""PG boilerplate (license, header/footer) removal, for both rewriting engines.
+
+The boilerplate is located by (start, end) marker pairs: `BOILERPLATE_PATTERNS`
+is plain data, compiled once at import into `BOILERPLATE`, which finds all
+occurrences of all markers in one scan of the text of the body. That text is
+extracted once, each child of the body knowing the range of its own text in
+it (`ChildText`): telling which children hold a marker takes no more text
+building per child nor per pattern.
+
+Children are removed as `update_html_for_static` always did, decomposing
+them while iterating over the children of the body: the item following a
+removed child is skipped (a string most of the time, but not always).
+"""
+
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from collections.abc import Sequence
+from typing import NamedTuple
+
+from bs4 import Tag
+
+
+class BoilerplatePattern(NamedTuple):
+    """Markers of the start and end of the PG boilerplate"""
+
+    start: str
+    end: str
+
+
+# in order of precedence: only the first pattern found in the text is used
+BOILERPLATE_PATTERNS = (
+    BoilerplatePattern(
+        "*** START OF THE PROJECT GUTENBERG EBOOK",
+        "*** END OF THE PROJECT GUTENBERG EBOOK",
+    ),
+    BoilerplatePattern(
+        "***START OF THE PROJECT GUTENBERG EBOOK",
+        "***END OF THE PROJECT GUTENBERG EBOOK",
+    ),
+    BoilerplatePattern(
+        "<><><><><><><><><><><><><><><><><><><><><><><><><><><><><><><><><><>",
+        "<><><><><><><><><><><><><><><><><><><><><><><><><><><><><><><><><><>",
+    ),
+    # ePub only
+    BoilerplatePattern(
+        "*** START OF THIS PROJECT GUTENBERG EBOOK", "*** START: FULL LICENSE ***"
+    ),
+    BoilerplatePattern(
+        "*END THE SMALL PRINT! FOR PUBLIC DOMAIN ETEXT",
+        "——————————————————————————-",
+    ),
+    BoilerplatePattern(
+        "*** START OF THIS PROJECT GUTENBERG EBOOK",
+        "*** END OF THIS PROJECT GUTENBERG EBOOK",
+    ),
+    BoilerplatePattern(
+        "***START OF THE PROJECT GUTENBERG", "***END OF THE PROJECT GUTENBERG EBOOK"
+    ),
+    BoilerplatePattern(
+        "COPYRIGHT PROTECTED ETEXTS*END*",
+        "===========================================================",
+    ),
+    BoilerplatePattern(
+        "Nous remercions la Bibliothèque Nationale de France qui a mis à",
+        "The Project Gutenberg Etext of",
+    ),
+    BoilerplatePattern(
+        "Nous remercions la Bibliothèque Nationale de France qui a mis à",
+        "End of The Project Gutenberg EBook",
+    ),
+    BoilerplatePattern(
+        "=========================================================================",
+        "——————————————————————————-",
+    ),
+    BoilerplatePattern("Project Gutenberg Etext", "End of Project Gutenberg Etext"),
+    BoilerplatePattern("Text encoding is iso-8859-1", "Fin de Project Gutenberg Etext"),
+    BoilerplatePattern(
+        "—————————————————-", "Encode an ISO 8859/1 Etext into LaTeX or HTML"
+    ),
+)
+
+
+class ChildText(NamedTuple):
+    """Text of a child of the body: its `start`-`end` range in the text of
+    the body or, for children whose strings are not part of it (string
+    containers such as `<script>`), their own `text`"""
+
+    start: int = 0
+    end: int = 0
+    text: str | None = None
+
+
+class BoilerplateMatcher:
+    """Boilerplate patterns compiled into a single multi-marker scan"""
+
+    def __init__(self, patterns: Sequence[BoilerplatePattern]):
+        self.patterns = tuple(patterns)
+        # longest first: the regex matches the longest marker found at a
+        # position, all markers found there being prefixes of it
+        markers = sorted(
+            {marker for pattern in self.patterns for marker in pattern},
+            key=len,
+            reverse=True,
+        )
+        self._regex = re.compile("|".join(re.escape(marker) for marker in markers))
+        self._prefixes = {
+            marker: [other for other in markers if marker.startswith(other)]
+            for marker in markers
+        }
+
+    def scan(self, text: str) -> dict[str, list[int]]:
+        """Offsets of all occurrences of each marker in `text` (overlapping
+        ones included), in increasing order"""
+        found: dict[str, list[int]] = defaultdict(list)
+        position = 0
+        while match := self._regex.search(text, position):
+            start = match.start()
+            for marker in self._prefixes[match.group()]:
+                found[marker].append(start)
+            position = start + 1
+        return found
+
+    def boilerplate(self, text: str, contents: Sequence[ChildText | None]) -> list[int]:
+        """Indexes of the children to remove from a body
+
+        `text` is the text of the body, `contents` its children: `ChildText`
+        for elements, None for other nodes (strings, comments).
+        """
+        found = self.scan(text)
+
+        def holds(child: ChildText, marker: str) -> bool:
+            if child.text is not None:
+                return marker in child.text
+            starts = found.get(marker)
+            if not starts:
+                return False
+            # the first occurrence within the child, if any, ends within it
+            index = bisect_left(starts, child.start)
+            return index < len(starts) and starts[index] + len(marker) <= child.end
+
+        for start_of_text, end_of_text in self.patterns:
+            has_start = start_of_text in found
+            has_end = end_of_text in found
+            if not has_start and not has_end:
+                continue
+
+            removed: list[int] = []
+            remaining = list(enumerate(contents))
+            remove = has_start
+            index = 0
+            while index < len(remaining):
+                position, child = remaining[index]
+                index += 1
+                if child is None:
+                    continue
+                decompose = False
+                if has_end and holds(child, end_of_text):
+                    remove = True
+                if has_start and holds(child, start_of_text):
+                    decompose = True
+                    remove = False
+                if decompose or remove:
+                    removed.append(position)
+                    # the next item is skipped, as when decomposing while
+                    # iterating over the children
+                    del remaining[index - 1]
+            return removed
+        return []
+
+
+BOILERPLATE = BoilerplateMatcher(BOILERPLATE_PATTERNS)
+
+
+def soup_body_text(body: Tag) -> tuple[str, list[ChildText | None]]:
+    """Text of a BeautifulSoup body (`body.text`) and of its children, in
+    a single walk over its descendants"""
+    types = body.interesting_string_types
+    pieces: list[str] = []
+    offset = 0
+    contents: list[ChildText | None] = []
+    for child in body.contents:
+        if not isinstance(child, Tag):
+            if type(child) in types:
+                pieces.append(child)
+                offset += len(child)
+            contents.append(None)
+            continue
+        start = offset
+        for descendant in child.descendants:
+            if type(descendant) in types:
+                pieces.append(descendant)
+                offset += len(descendant)
+        if child.interesting_string_types == types:
+            contents.append(ChildText(start, offset))
+        else:
+            contents.append(ChildText(text=child.get_text()))
+    return "".join(pieces), contents
+
+
+def remove_soup_boilerplate(body: Tag) -> None:
+    """Remove the PG boilerplate from the children of a BeautifulSoup body"""
+    text, contents = soup_body_text(body)
+    children = list(body.contents)
+    # last ones first, so that the indexes of the others stay valid and
+    # children are not looked up in the contents (quadratic with many ones)
+    for index in reversed(BOILERPLATE.boilerplate(text, contents)):
+        child = children[index]
+        child.extract(_self_index=index)
+        child.decompose()
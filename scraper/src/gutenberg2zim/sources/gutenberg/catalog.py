@@ -12,6 +12,7 @@ from dataclasses import dataclass
 from pathlib import Path
 
 from gutenberg2zim.constants import logger
+from gutenberg2zim.core.mirror_pool import MirrorPool
 from gutenberg2zim.core.ports import CatalogFilters, CatalogPort, WorkRef
 from gutenberg2zim.core.utils import download_file
 
@@ -74,14 +75,16 @@ def get_csv_fpath() -> Path:
     return fpath
 
 
-def download_csv_file(csv_path: Path, csv_url: str) -> None:
+def download_csv_file(
+    csv_path: Path, csv_url: str, mirrors: MirrorPool | None = None
+) -> None:
     """Download pg_catalog.csv.gz archive"""
     if csv_path.exists():
         logger.info(f"\tCSV catalog already exists in {csv_path}")
         return
 
     logger.info(f"\tDownloading {csv_url} into {csv_path}")
-    download_file(csv_url, csv_path)
+    download_file(csv_url, csv_path, mirrors)
 
 
 def load_catalog(csv_path: Path) -> list[CatalogEntry]:
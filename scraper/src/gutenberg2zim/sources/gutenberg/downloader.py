@@ -1,23 +1,39 @@
 """In-memory download of Gutenberg book content (moved from `download.py`).
 
 Per-book download orchestration on top of `GutenbergFormatResolver`: tries
-the candidate mirror URLs for each requested format, extracts zipped HTML
-in memory and records formats that turn out to be unsupported. Not yet
-migrated to the file-based `core.download_engine.DownloadEngine`.
+the candidate mirror URLs for each requested format, checks zipped HTML and
+records formats that turn out to be unsupported, then downloads the cover of
+the mirror (whether the HTML has one of its own is only known once rewritten,
+so that the transform stage does not wait on the network). Files are fetched
+through the shared `core.download_engine.DownloadEngine` (pooled connections,
+retries, on-disk cache).
+
+Zipped HTML is kept as downloaded: its members are only extracted one at a
+time when the book is transformed (`iter_book_files()`), so that a single
+member is held in memory at once rather than the whole extracted book.
 """
 
-import io
 import zipfile
 import zlib
+from collections.abc import Generator, Iterator
 from dataclasses import dataclass, field
+from http import HTTPStatus
 from pathlib import Path
 
 import requests
 
-from gutenberg2zim.constants import (
-    DEFAULT_HTTP_TIMEOUT,
-    DL_CHUNCK_SIZE,
-    logger,
+from gutenberg2zim.constants import logger
+from gutenberg2zim.core.async_download_engine import AsyncDownloadEngine
+from gutenberg2zim.core.download_engine import DownloadEngine
+from gutenberg2zim.core.models import Work
+from gutenberg2zim.core.ports import DownloadRequest
+from gutenberg2zim.core.spill import (
+    Payload,
+    PayloadSpiller,
+    consume_payload,
+    discard_payload,
+    open_payload,
+    payload_size,
 )
 from gutenberg2zim.core.utils import (
     ALL_FORMATS,
@@ -27,22 +43,38 @@ from gutenberg2zim.core.utils import (
 from gutenberg2zim.core.work_store import WorkStore
 from gutenberg2zim.sources.gutenberg.adapters import GUTENBERG_SOURCE, book_to_work
 from gutenberg2zim.sources.gutenberg.models import Book
-from gutenberg2zim.sources.gutenberg.resolver import GutenbergFormatResolver
+from gutenberg2zim.sources.gutenberg.resolver import (
+    PG_PREFERRED_TYPES,
+    FormatAvailabilityIndex,
+    GutenbergFormatResolver,
+)
 
 
 @dataclass
 class BookContent:
-    """In-memory storage for downloaded book content"""
+    """Storage for downloaded book content (in memory, large files spilled)"""
 
     book: Book
     # Main content files keyed by filename
-    files: dict[str, bytes] = field(default_factory=dict)
-    # Cover image (if available)
+    files: dict[str, Payload] = field(default_factory=dict)
+    # HTML zip (already checked), its files being extracted when transformed
+    html_zip: Payload | None = None
+    # Cover image of the mirror (if available), unused when the HTML has one
     cover_image: bytes | None = None
 
 
-def handle_zipped_html(zip_content: bytes, book: Book) -> dict[str, bytes]:
-    """Extract HTML zip and return files as dict of filename -> bytes"""
+# raised reading an archive which should be a valid zip (not a zip,
+# encrypted, truncated, or corrupt deflate stream)
+ZIP_ERRORS = (zipfile.BadZipFile, RuntimeError, EOFError, OSError, zlib.error)
+
+
+def _zipped_html_members(
+    zf: zipfile.ZipFile, book: Book
+) -> dict[str, zipfile.ZipInfo] | None:
+    """Member of an HTML zip for each book filename, main HTML first
+
+    None when the archive has insecure (absolute) names.
+    """
 
     def clfn(fn):
         return Path(fn).name
@@ -53,64 +85,127 @@ def handle_zipped_html(zip_content: bytes, book: Book) -> dict[str, bytes]:
             return True
         return fname == f"images/{name}"
 
-    result_files = {}
+    # check that there is no insecure data (absolute names)
+    if sum([1 for n in zf.namelist() if not is_safe(ensure_unicode(n))]):
+        return None
 
-    try:
-        with zipfile.ZipFile(io.BytesIO(zip_content), "r") as zf:
-            # check that there is no insecure data (absolute names)
-            if sum([1 for n in zf.namelist() if not is_safe(ensure_unicode(n))]):
-                return {}
-
-            zipped_files = zf.namelist()
-
-            # is there multiple HTML files in ZIP ? (rare)
-            mhtml = (
-                sum(
-                    [
-                        1
-                        for f in zipped_files
-                        if f.endswith("html") or f.endswith(".htm")
-                    ]
-                )
-                > 1
-            )
+    zipped_files = zf.infolist()
 
-            # Process all files from zip
-            for zipped_file in zipped_files:
-                # skip folders
-                if zipped_file.endswith("/"):
-                    continue
+    # is there multiple HTML files in ZIP ? (rare)
+    mhtml = (
+        sum(
+            [
+                1
+                for f in zipped_files
+                if f.filename.endswith("html") or f.filename.endswith(".htm")
+            ]
+        )
+        > 1
+    )
+
+    main_html = f"{book.book_id}.html"
+    members: dict[str, zipfile.ZipInfo] = {}
+    for zipped_file in zipped_files:
+        # skip folders
+        if zipped_file.is_dir():
+            continue
 
-                fname = Path(zipped_file).name
-                file_content = zf.read(zipped_file)
-
-                if fname.endswith(".html") or fname.endswith(".htm"):
-                    if mhtml:
-                        if fname.startswith(f"{book.book_id}-h."):
-                            result_files[f"{book.book_id}.html"] = file_content
-                        else:
-                            result_files[f"{book.book_id}_{fname}"] = file_content
-                    else:
-                        result_files[f"{book.book_id}.html"] = file_content
-                else:
-                    result_files[f"{book.book_id}_{fname}"] = file_content
-
-    except (zipfile.BadZipFile, RuntimeError, EOFError, OSError, zlib.error) as exc:
-        # archive is unreadable when it should be a valid zip
-        # (not a zip, encrypted, truncated, or corrupt deflate stream)
+        # a later member with the same name replaces the former one
+        fname = Path(zipped_file.filename).name
+        if fname.endswith(".html") or fname.endswith(".htm"):
+            if mhtml and not fname.startswith(f"{book.book_id}-h."):
+                members[f"{book.book_id}_{fname}"] = zipped_file
+            else:
+                members[main_html] = zipped_file
+        else:
+            members[f"{book.book_id}_{fname}"] = zipped_file
+
+    # the main HTML comes first: cover detection relies on it being rewritten
+    # before the images
+    if main_html in members:
+        members = {main_html: members.pop(main_html), **members}
+    return members
+
+
+def iter_zipped_html(
+    zip_content: Payload, book: Book, spiller: PayloadSpiller | None = None
+) -> Iterator[tuple[str, Payload]]:
+    """Yield the files of an HTML zip (filename, payload), main HTML first
+
+    Members are extracted one at a time, as they are reached; with a
+    `spiller`, those above its threshold are extracted to files instead of
+    memory. Yields nothing for an archive with insecure names; raises one
+    of `ZIP_ERRORS` for an unreadable one.
+    """
+    with open_payload(zip_content) as zip_fh, zipfile.ZipFile(zip_fh, "r") as zf:
+        for fname, zipped_file in (_zipped_html_members(zf, book) or {}).items():
+            if spiller and spiller.should_spill(zipped_file.file_size):
+                with zf.open(zipped_file) as member:
+                    yield fname, spiller.spill_stream(member, Path(fname).suffix)
+            else:
+                yield fname, zf.read(zipped_file)
+
+
+def check_zipped_html(zip_content: Payload, book: Book) -> bool:
+    """Whether an HTML zip can be extracted, without extracting it
+
+    Only its central directory and names are checked, so that an archive
+    which is not a zip (or a truncated one) is rejected while other types of
+    the format can still be tried. Members are not decompressed: a corrupt
+    one is only found when extracted (see `iter_book_files()`).
+    """
+    try:
+        with open_payload(zip_content) as zip_fh, zipfile.ZipFile(zip_fh) as zf:
+            if not _zipped_html_members(zf, book):
+                return False
+    except ZIP_ERRORS as exc:
         logger.warning(f"Unreadable zip file for book #{book.book_id}: {exc}")
-        return {}
+        return False
+    return True
 
-    return result_files
 
-
-def download_book(
+def iter_book_files(
+    book: Book,
+    files: dict[str, Payload],
+    html_zip: Payload | None = None,
+    spiller: PayloadSpiller | None = None,
+) -> Iterator[tuple[str, Payload]]:
+    """Yield the files of a downloaded book one at a time, main HTML first
+
+    `files` is consumed (each file removed from it once yielded) and the
+    members of `html_zip` extracted as they are reached, so that only the
+    file being processed is held by the caller. An archive turning out to be
+    unreadable ends its members with a warning; it is removed once done.
+    """
+    main_html = f"{book.book_id}.html"
+    if main_html in files:
+        yield main_html, files.pop(main_html)
+    if html_zip is not None:
+        try:
+            yield from iter_zipped_html(html_zip, book, spiller)
+        except ZIP_ERRORS as exc:
+            logger.warning(f"Unreadable zip file for book #{book.book_id}: {exc}")
+        finally:
+            discard_payload(html_zip)
+    for fname in list(files):
+        yield fname, files.pop(fname)
+
+
+def _book_downloads(
     mirror_url: str,
     book: Book,
     formats: list[str],
     work_store: WorkStore,
-) -> BookContent | None:
-    """Download a book in all requested formats and return in-memory content"""
+    work: Work | None,
+    availability: FormatAvailabilityIndex | None,
+) -> Generator[
+    DownloadRequest, Payload | requests.RequestException, BookContent | None
+]:
+    """Per-book download logic, independent of how files are fetched.
+
+    Yields the request of each candidate URL to try and is sent back its
+    content (or the error raised downloading it); returns the book content.
+    """
     logger.debug(f"\tDownloading content files for Book #{book.book_id}")
 
     # apply filters (copy to avoid mutating caller's list or the global ALL_FORMATS)
@@ -121,56 +216,63 @@ def download_book(
         requested_formats.append("html")
 
     book_content = BookContent(book=book)
-    work = book_to_work(book)
-    resolver = GutenbergFormatResolver(mirror_url)
+    work = work or book_to_work(book)
+    resolver = GutenbergFormatResolver(mirror_url, availability)
 
     for book_format in requested_formats:
         logger.debug(f"Processing {book_format}")
 
-        request = resolver.resolve(work, book_format)
-        if request is None:
+        if book_format not in PG_PREFERRED_TYPES:
             # not supposed to happen, this is a bug
             raise RuntimeError(f"Unsupported {book_format} format for #{book.book_id}")
+        request = resolver.resolve(work, book_format)
+        if request is None:
+            logger.debug(f"\t\tNo {book_format} known to exist for #{book.book_id}")
+            book.unsupported_formats.append(book_format)
+            continue
 
         pg_type_to_use = None
         url = None
-        for url in request.extra["candidate_urls"]:
-            try:
-                with requests.get(
-                    url, stream=True, timeout=DEFAULT_HTTP_TIMEOUT
-                ) as pg_resp:  # in seconds
-                    if pg_resp.status_code == requests.codes.ok:
-                        # Download content to memory
-                        content_buffer = io.BytesIO()
-                        for chunk in pg_resp.iter_content(chunk_size=DL_CHUNCK_SIZE):
-                            if chunk:
-                                content_buffer.write(chunk)
-                        content_bytes = content_buffer.getvalue()
-
-                        if url.endswith(".zip"):
-                            # extract zipfile in memory
-                            extracted_files = handle_zipped_html(
-                                zip_content=content_bytes, book=book
-                            )
-                            if not extracted_files:
-                                # ZIP was corrupt or rejected; try next preferred type
-                                logger.warning(
-                                    f"ZIP extraction failed for {book_format} "
-                                    f"of #{book.book_id}, trying next type"
-                                )
-                                continue
-                            book_content.files.update(extracted_files)
-                        else:
-                            # Store the file directly
-                            filename = fname_for(book, book_format)
-                            book_content.files[filename] = content_bytes
-
-                        pg_type_to_use = True
-                        break
-            except requests.RequestException as exc:
-                # transport error: treat like a non-ok status, try next candidate
-                logger.warning(f"Request failed for {url} of #{book.book_id}: {exc}")
+        for pg_type, url in zip(
+            request.extra["candidate_pg_types"],
+            request.extra["candidate_urls"],
+            strict=True,
+        ):
+            content_bytes = yield DownloadRequest(url=url, format_name=book_format)
+            if isinstance(content_bytes, requests.RequestException):
+                _log_failed_candidate(url, book, content_bytes)
+                if availability and _is_not_found(content_bytes):
+                    availability.record_missing(work.id, pg_type)
                 continue
+            if url.endswith(".zip"):
+                # kept zipped: members are extracted one at a time when the
+                # book is transformed (see `iter_book_files()`)
+                if not check_zipped_html(zip_content=content_bytes, book=book):
+                    discard_payload(content_bytes)
+                    # ZIP was corrupt or rejected; try next preferred type
+                    logger.warning(
+                        f"ZIP extraction failed for {book_format} "
+                        f"of #{book.book_id}, trying next type"
+                    )
+                    continue
+                book_content.html_zip = content_bytes
+            else:
+                # Store the file directly
+                filename = fname_for(book, book_format)
+                book_content.files[filename] = content_bytes
+
+            if availability:
+                availability.record_available(
+                    work.id,
+                    pg_type,
+                    payload_size(content_bytes),
+                    modified=next(
+                        (fmt.modified for fmt in work.formats if fmt.name == pg_type),
+                        None,
+                    ),
+                )
+            pg_type_to_use = True
+            break
 
         if not url or not pg_type_to_use:
             logger.debug(f"\t\tNo file available for {book_format} of #{book.book_id}")
@@ -185,28 +287,92 @@ def download_book(
         work_store.remove(GUTENBERG_SOURCE, str(book.book_id))
         return None
 
-    # Note: Cover image download moved to export_book to avoid downloading
-    # when HTML already has a cover (see export.py)
+    if book.has_cover:
+        cover = yield DownloadRequest(
+            url=f"{mirror_url}/cache/epub/{book.book_id}/"
+            f"pg{book.book_id}.cover.medium.jpg",
+            format_name="cover",
+        )
+        if not isinstance(cover, requests.RequestException):
+            book_content.cover_image = consume_payload(cover)
+        elif _is_not_found(cover):
+            logger.debug(f"No cover on the mirror for book #{book.book_id}")
+        else:
+            logger.warning(
+                f"Failed to download cover for book #{book.book_id}: {cover}"
+            )
+    else:
+        logger.debug(f"No Book Cover found for Book #{book.book_id}")
 
     return book_content
 
 
-def download_book_cover(mirror_url: str, book: Book) -> bytes | None:
-    """Download cover image from mirror for a book.
+def _is_not_found(exc: requests.RequestException) -> bool:
+    return (
+        isinstance(exc, requests.HTTPError)
+        and exc.response is not None
+        and exc.response.status_code == HTTPStatus.NOT_FOUND
+    )
 
-    Returns cover image bytes if successful, None otherwise.
-    """
-    if not book.has_cover:
-        logger.debug(f"No Book Cover found for Book #{book.book_id}")
-        return None
 
-    url = f"{mirror_url}/cache/epub/{book.book_id}/pg{book.book_id}.cover.medium.jpg"
-    logger.debug(f"Downloading cover image from {url}")
+def _log_failed_candidate(url: str, book: Book, exc: requests.RequestException) -> None:
+    if isinstance(exc, requests.HTTPError):
+        # file not available on the mirror, try next candidate
+        logger.debug(f"Request failed for {url} of #{book.book_id}: {exc}")
+    else:
+        # transport error: treat like a non-ok status, try next candidate
+        logger.warning(f"Request failed for {url} of #{book.book_id}: {exc}")
+
+
+def download_book(
+    mirror_url: str,
+    book: Book,
+    formats: list[str],
+    work_store: WorkStore,
+    download_engine: DownloadEngine,
+    work: Work | None = None,
+    availability: FormatAvailabilityIndex | None = None,
+    spiller: PayloadSpiller | None = None,
+) -> BookContent | None:
+    """Download a book in all requested formats and return in-memory content
+
+    `work` is the book's metadata as fetched (with the files listed in its
+    RDF), `availability` the index of PG types known to be missing; both
+    narrow down the candidate URLs to probe. With a `spiller`, files above
+    its threshold are kept on disk instead of in memory.
+    """
+    steps = _book_downloads(mirror_url, book, formats, work_store, work, availability)
+    result = None
     try:
-        with requests.get(url, timeout=DEFAULT_HTTP_TIMEOUT) as resp:
-            if resp.status_code == requests.codes.ok:
-                return resp.content
-    except Exception as exc:
-        logger.warning(f"Failed to download cover for book #{book.book_id}: {exc}")
+        while True:
+            request = steps.send(result)
+            try:
+                result = download_engine.fetch(request, spiller)
+            except requests.RequestException as exc:
+                result = exc
+    except StopIteration as done:
+        return done.value
+
 
-    return None
+async def download_book_async(
+    mirror_url: str,
+    book: Book,
+    formats: list[str],
+    work_store: WorkStore,
+    download_engine: AsyncDownloadEngine,
+    work: Work | None = None,
+    availability: FormatAvailabilityIndex | None = None,
+    spiller: PayloadSpiller | None = None,
+) -> BookContent | None:
+    """Coroutine version of `download_book`, for the async download engine"""
+    steps = _book_downloads(mirror_url, book, formats, work_store, work, availability)
+    result = None
+    try:
+        while True:
+            request = steps.send(result)
+            try:
+                result = await download_engine.fetch_async(request, spiller)
+            except requests.RequestException as exc:
+                result = exc
+    except StopIteration as done:
+        return done.value
@@ -0,0 +1,524 @@
+"""Single-pass lxml engine for the static rewriting of Gutenberg HTML pages.
+
+`rewrite_html_lxml()` produces the same markup as `update_html_for_static()`
+for a book page, byte for byte, but instead of building a BeautifulSoup tree
+and walking it once per transform (meta tags, images, icon links, links,
+boilerplate text, ...), it parses with lxml and applies all transforms in
+one traversal of the tree, which also collects the text used to locate the
+PG boilerplate. The infobox is copied from a fragment parsed once per set of
+formats.
+
+The output follows the conventions of BeautifulSoup (`lxml` builder,
+`minimal` formatter) rather than lxml's serializer: whitespace-only strings
+collapsed to a newline or space (but in `<pre>`/`<textarea>`), attributes
+sorted by name, multi-valued attributes (`class`, `rel`...) normalized, void
+elements closed with `/>`, only `&`, `<` and `>` escaped (not at all in
+`<script>`/`<style>`), and the charset of `<meta http-equiv="Content-Type">`
+set to utf-8.
+
+Documents depending on parser behaviors not reproduced here (no `<body>`,
+`<title>` within `<body>`, boolean attributes without a value, processing
+instructions) raise `UnsupportedDocument`: callers then fall back to
+`update_html_for_static()`.
+"""
+
+import copy
+import re
+from collections.abc import Mapping
+from functools import lru_cache
+
+from lxml import etree
+
+from gutenberg2zim.constants import logger
+from gutenberg2zim.core.rewriters.image_rewriter import (
+    ImageProcessor,
+    StoredImage,
+    stored_dimensions,
+)
+from gutenberg2zim.core.rewriters.link_rewriter import replacement_link
+from gutenberg2zim.sources.gutenberg.boilerplate import BOILERPLATE, ChildText
+from gutenberg2zim.sources.gutenberg.rewriting import (
+    INFOBOX_CSS_HREF,
+    INFOBOX_JS_SRC,
+    HtmlRewriteError,
+    infobox_href,
+    infobox_markup,
+    transform_image_path,
+)
+
+# elements written as `<name/>` when empty
+VOID_ELEMENTS = frozenset(
+    [
+        "area",
+        "base",
+        "basefont",
+        "bgsound",
+        "br",
+        "col",
+        "command",
+        "embed",
+        "frame",
+        "hr",
+        "image",
+        "img",
+        "input",
+        "isindex",
+        "keygen",
+        "link",
+        "menuitem",
+        "meta",
+        "nextid",
+        "param",
+        "source",
+        "spacer",
+        "track",
+        "wbr",
+    ]
+)
+# elements whose strings are written unescaped
+RAW_TEXT_ELEMENTS = frozenset(["script", "style"])
+# elements whose whitespace-only strings are kept as is
+PRESERVE_WHITESPACE_ELEMENTS = frozenset(["pre", "textarea"])
+# elements whose strings are not part of the text of other elements
+STRING_CONTAINERS = frozenset(["rt", "rp", "style", "script", "template"])
+# space-separated list attributes, normalized to single spaces
+MULTI_VALUED_ATTRIBUTES = {
+    "*": frozenset(["class", "accesskey", "dropzone"]),
+    "a": frozenset(["rel", "rev"]),
+    "link": frozenset(["rel", "rev"]),
+    "td": frozenset(["headers"]),
+    "th": frozenset(["headers"]),
+    "form": frozenset(["accept-charset"]),
+    "object": frozenset(["archive"]),
+    "area": frozenset(["rel"]),
+    "icon": frozenset(["sizes"]),
+    "iframe": frozenset(["sandbox"]),
+    "output": frozenset(["for"]),
+}
+# attributes given their name as value by libxml2 when written without one,
+# which BeautifulSoup sees as empty: both cannot be told apart from the tree
+BOOLEAN_ATTRIBUTES = frozenset(
+    [
+        "checked",
+        "compact",
+        "declare",
+        "defer",
+        "disabled",
+        "ismap",
+        "multiple",
+        "nohref",
+        "noresize",
+        "noshade",
+        "nowrap",
+        "readonly",
+        "selected",
+    ]
+)
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+META_CHARSET_RE = re.compile(r"((^|;)\s*charset=)([^;]*)", re.M)
+
+
+class UnsupportedDocument(Exception):  # noqa: N818
+    """The document relies on parser behaviors this engine does not reproduce"""
+
+
+def _parse(markup: str) -> etree._Element:
+    parser = etree.HTMLParser(recover=True)
+    try:
+        parser.feed(markup)
+        root = parser.close()
+    except etree.LxmlError as exc:
+        raise UnsupportedDocument(f"Unparsable document: {exc}") from exc
+    if root is None or root.tag != "html":
+        raise UnsupportedDocument("No <html> root")
+    return root
+
+
+def _collapse(text: str | None, *, preserve: bool) -> str | None:
+    """A string as kept by BeautifulSoup (whitespace-only ones collapsed)"""
+    if not text or preserve or text.strip(ASCII_SPACES):
+        return text
+    return "\n" if "\n" in text else " "
+
+
+def _collapse_text(element: etree._Element, *, preserve: bool) -> str | None:
+    """Collapse the text of `element` (only set when changed: strings from
+    the parser may hold characters lxml refuses to set)"""
+    text = element.text
+    collapsed = _collapse(text, preserve=preserve)
+    if collapsed is not text:
+        element.text = collapsed
+    return collapsed
+
+
+def _collapse_tail(element: etree._Element, *, preserve: bool) -> str | None:
+    """Collapse the tail of `element`, as `_collapse_text()`"""
+    tail = element.tail
+    collapsed = _collapse(tail, preserve=preserve)
+    if collapsed is not tail:
+        element.tail = collapsed
+    return collapsed
+
+
+def _collapse_all(element: etree._Element, *, preserve: bool = False) -> None:
+    """Collapse the whitespace-only strings within `element` (not its tail)"""
+    preserve = preserve or element.tag in PRESERVE_WHITESPACE_ELEMENTS
+    _collapse_text(element, preserve=preserve)
+    for child in element:
+        if isinstance(child.tag, str):
+            _collapse_all(child, preserve=preserve)
+        _collapse_tail(child, preserve=preserve)
+
+
+def _insert_first(parent: etree._Element, element: etree._Element) -> None:
+    """Insert `element` before all the content of `parent`, strings included"""
+    element.tail = parent.text
+    parent.text = None
+    parent.insert(0, element)
+
+
+def _remove(element: etree._Element) -> None:
+    """Remove `element` from the tree, keeping the string following it"""
+    parent = element.getparent()
+    if element.tail:
+        previous = element.getprevious()
+        if previous is not None:
+            previous.tail = (previous.tail or "") + element.tail
+        else:
+            parent.text = (parent.text or "") + element.tail
+    parent.remove(element)
+
+
+def _escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _attribute(tag: str, key: str, value: str) -> str:
+    if key in MULTI_VALUED_ATTRIBUTES["*"] or key in MULTI_VALUED_ATTRIBUTES.get(
+        tag, ()
+    ):
+        value = " ".join(value.split())
+    elif key in BOOLEAN_ATTRIBUTES and value == key:
+        raise UnsupportedDocument(f"Ambiguous boolean attribute {key}")
+    value = _escape(value)
+    if '"' not in value:
+        return f'{key}="{value}"'
+    if "'" not in value:
+        return f"{key}='{value}'"
+    value = value.replace('"', "&quot;")
+    return f'{key}="{value}"'
+
+
+def _start_tag(element: etree._Element, closing: str = "") -> str:
+    tag = element.tag
+    if not element.attrib:
+        return f"<{tag}{closing}>"
+    attributes = " ".join(
+        _attribute(tag, key, value) for key, value in sorted(element.attrib.items())
+    )
+    return f"<{tag} {attributes}{closing}>"
+
+
+def serialize(root: etree._Element) -> str:
+    """`root` written as BeautifulSoup writes it (see module docstring)"""
+    pieces: list[str] = []
+    append = pieces.append
+
+    def string(text: str | None, parent: str) -> None:
+        if text:
+            append(text if parent in RAW_TEXT_ELEMENTS else _escape(text))
+
+    # children left to write, for each open element
+    stack = [(root, iter(root))]
+    append(_start_tag(root))
+    string(root.text, root.tag)
+    while stack:
+        parent, children = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            append(f"</{parent.tag}>")
+            if stack:
+                string(parent.tail, stack[-1][0].tag)
+            continue
+        tag = child.tag
+        if not isinstance(tag, str):
+            if not isinstance(child, etree._Comment):
+                raise UnsupportedDocument(f"Unexpected node {child!r}")
+            append(f"<!--{child.text or ''}-->")
+        elif tag in VOID_ELEMENTS and not child.text and not len(child):
+            append(_start_tag(child, "/"))
+        else:
+            append(_start_tag(child))
+            string(child.text, tag)
+            stack.append((child, iter(child)))
+            continue
+        string(child.tail, parent.tag)
+    return "".join(pieces)
+
+
+class _Page:
+    """State of the rewriting of one page, gathered by `traverse()`"""
+
+    def __init__(
+        self,
+        book,
+        image_paths: Mapping[str, StoredImage] | None = None,
+    ):
+        self.book = book
+        self.image_paths = image_paths
+        self.head: etree._Element | None = None
+        self.title: etree._Element | None = None
+        self.body: etree._Element | None = None
+        self.title_in_body = False
+        self.icon_found = False
+        # strings within <body> making its text, and the text of each element
+        # child of <body> (see `boilerplate.ChildText`)
+        self.body_strings: list[str] = []
+        self.body_length = 0
+        self.child_texts: dict[etree._Element, ChildText] = {}
+        # strings of the string containers children of <body> (`<script>`...)
+        self.container_strings: dict[etree._Element, list[str]] = {}
+
+    def traverse(self, root: etree._Element) -> None:
+        """Apply the per-element transforms and gather the page structure"""
+        # open elements: (element, children left, whitespace preserved,
+        # innermost string container, <body> child it is within)
+        stack = [(root, iter(root), False, None, None)]
+        self.visit(root)
+        _collapse_text(root, preserve=False)
+        while stack:
+            parent, children, preserve, container, body_child = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                if parent is body_child and parent is not self.body:
+                    self.close_body_child(parent)
+                if stack:
+                    tail = _collapse_tail(parent, preserve=stack[-1][2])
+                    self.record(tail, *stack[-1][3:])
+                continue
+            tag = child.tag
+            if not isinstance(tag, str):
+                # comments (their text is not part of any string)
+                self.record(
+                    _collapse_tail(child, preserve=preserve), container, body_child
+                )
+                continue
+            self.visit(child)
+            if child is self.body:
+                # strings of <body> itself (not of a child) are only in its text
+                body_child = child
+            elif parent is self.body:
+                self.child_texts[child] = ChildText(start=self.body_length)
+                if tag in STRING_CONTAINERS:
+                    self.container_strings[child] = []
+                body_child = child
+            preserve = preserve or tag in PRESERVE_WHITESPACE_ELEMENTS
+            if tag in STRING_CONTAINERS:
+                container = tag
+            self.record(_collapse_text(child, preserve=preserve), container, body_child)
+            stack.append((child, iter(child), preserve, container, body_child))
+
+    def record(
+        self,
+        text: str | None,
+        container: str | None,
+        body_child: etree._Element | None,
+    ) -> None:
+        """Account for a string in the text of <body> and of its children"""
+        if not text or body_child is None:
+            return
+        if container is None:
+            self.body_strings.append(text)
+            self.body_length += len(text)
+        elif container == body_child.tag:
+            # a container child only has the strings of its own type in its text
+            self.container_strings[body_child].append(text)
+
+    def close_body_child(self, element: etree._Element) -> None:
+        """Set the text of an element child of <body> once traversed"""
+        if element in self.container_strings:
+            text = "".join(self.container_strings.pop(element))
+            self.child_texts[element] = ChildText(text=text)
+        else:
+            self.child_texts[element] = self.child_texts[element]._replace(
+                end=self.body_length
+            )
+
+    def visit(self, element: etree._Element) -> None:
+        tag = element.tag
+        book_id = self.book.book_id
+        if tag == "img":
+            src = element.get("src")
+            if src is not None:
+                src = transform_image_path(book_id, src)
+                new_src = ImageProcessor.get_output_filename(src, self.image_paths)
+                if new_src != src:
+                    logger.debug(f"Book {book_id}: Rewrote image {src} -> {new_src}")
+                element.set("src", new_src)
+                if dimensions := stored_dimensions(
+                    element.get("width"),
+                    element.get("height"),
+                    ImageProcessor.get_stored_image(src, self.image_paths),
+                ):
+                    element.set("width", dimensions[0])
+                    element.set("height", dimensions[1])
+        elif tag == "a":
+            new_link = replacement_link(item_id=book_id, url=element.get("href", ""))
+            if new_link is not None:
+                element.set("href", new_link)
+        elif tag == "link":
+            if "icon" in element.get("rel", "").split():
+                self.visit_icon(element)
+        elif tag == "meta":
+            attributes = element.attrib
+            if "charset" in attributes:
+                # remove encoding as we're saving to UTF8 anyway
+                del attributes["charset"]
+            elif (
+                "content" in attributes
+                and attributes.get("http-equiv", "").lower() == "content-type"
+            ):
+                attributes["content"] = META_CHARSET_RE.sub(
+                    r"\1utf-8", attributes["content"]
+                )
+        elif tag == "title":
+            if self.title is None:
+                self.title = element
+                self.title_in_body = self.body is not None
+        elif tag == "head":
+            if self.head is None:
+                self.head = element
+        elif tag == "body":
+            if self.body is None:
+                self.body = element
+
+    def visit_icon(self, link: etree._Element) -> None:
+        href = link.get("href")
+        if not self.icon_found:
+            # the first icon link is the cover
+            self.icon_found = True
+            if href:
+                # Store original href for cover detection (only once)
+                if not self.book._cover_href:
+                    self.book._cover_href = href
+                href = transform_image_path(self.book.book_id, href)
+        if href is not None:
+            new_href = ImageProcessor.get_output_filename(href, self.image_paths)
+            if new_href != href:
+                logger.debug(
+                    f"Book {self.book.book_id}: Rewrote icon {href} -> {new_href}"
+                )
+            link.set("href", new_href)
+
+
+def _strip_boilerplate(page: _Page, body: etree._Element) -> None:
+    """Remove the PG boilerplate from the body, as `update_html_for_static`"""
+    elements = [child for child in body if isinstance(child.tag, str)]
+    if len(elements) == 1 and elements[0].tag == "div":
+        return
+
+    # content of the body as BeautifulSoup has it: strings and comments
+    # (None) between the elements
+    nodes: list[etree._Element | None] = [None] if body.text else []
+    for child in body:
+        nodes.append(child if isinstance(child.tag, str) else None)
+        if child.tail:
+            nodes.append(None)
+    contents = [None if node is None else page.child_texts[node] for node in nodes]
+
+    for index in BOILERPLATE.boilerplate("".join(page.body_strings), contents):
+        _remove(nodes[index])
+
+
+@lru_cache(maxsize=64)
+def _infobox_fragment(formats: tuple[str, ...]) -> etree._Element:
+    info_box = next(_parse(infobox_markup(formats)).iter("div"), None)
+    if info_box is None:
+        raise HtmlRewriteError("info_box div should be a Tag class")
+    _collapse_all(info_box)
+    return info_box
+
+
+def _infobox(book, formats: list[str]) -> etree._Element:
+    """Infobox of `book`, a copy of the fragment of its formats"""
+    info_box = copy.deepcopy(_infobox_fragment(tuple(book.requested_formats(formats))))
+    for link in info_box.iter("a"):
+        if href := link.get("href"):
+            link.set("href", infobox_href(book, href))
+    return info_box
+
+
+def rewrite_html_lxml(
+    book,
+    html_content: str,
+    formats: list[str],
+    *,
+    image_paths: Mapping[str, StoredImage] | None = None,
+) -> str:
+    """Static offline version of a book HTML page, as `update_html_for_static`
+
+    Raises `UnsupportedDocument` for documents to rewrite with
+    `update_html_for_static` instead.
+    """
+    root = _parse(html_content)
+    try:
+        return _rewrite(book, root, formats, _Page(book, image_paths))
+    except ValueError as exc:
+        # strings lxml refuses to move around (e.g. with control characters)
+        raise UnsupportedDocument(f"Unsupported string: {exc}") from exc
+
+
+def _rewrite(book, root: etree._Element, formats: list[str], page: _Page) -> str:
+    page.traverse(root)
+
+    body = page.body
+    if body is None:
+        raise UnsupportedDocument("No <body>")
+    if page.title_in_body:
+        raise UnsupportedDocument("<title> within <body>")
+
+    # Add the title
+    if page.title is not None:
+        for child in list(page.title):
+            page.title.remove(child)
+        page.title.text = book.title
+    else:
+        if page.head is None:
+            page.head = etree.Element("head")
+            _insert_first(root, page.head)
+        etree.SubElement(page.head, "title").text = book.title
+
+    _strip_boilerplate(page, body)
+
+    # build infobox
+    _insert_first(body, _infobox(book, formats))
+
+    # Ensure head exists
+    head = page.head
+    if head is None:
+        head = etree.Element("head")
+        _insert_first(root, head)
+
+    # Add CSS link if not already present in head
+    if not any(link.get("href") == INFOBOX_CSS_HREF for link in head.iter("link")):
+        etree.SubElement(
+            head,
+            "link",
+            rel="stylesheet",
+            href=INFOBOX_CSS_HREF,
+            type="text/css",
+        )
+
+    # Add JS script at the end of body if not already present
+    if not any(script.get("src") == INFOBOX_JS_SRC for script in body.iter("script")):
+        etree.SubElement(body, "script", src=INFOBOX_JS_SRC, type="text/javascript")
+
+    # set the charset to utf8
+    meta = etree.Element(
+        "meta", {"http-equiv": "Content-Type", "content": "text/html; charset=utf-8"}
+    )
+    _insert_first(head, meta)
+
+    return serialize(root)
@@ -1,32 +1,151 @@
 """Gutenberg metadata access (moved from `gutenberg2zim.rdf`).
 
 Downloads and parses the per-book RDF dumps and exposes them through the
-source-agnostic `MetadataPort` interface.
+source-agnostic `MetadataPort` interface, either one HTTP request per book
+(`GutenbergRdfMetadata`) or from the bulk `rdf-files.tar.bz2` archive
+streamed once (`GutenbergRdfArchiveMetadata`), which pays off for large
+selections.
+
+Parsed RDFs can be kept across runs in a `RdfMetadataCache`, along with the
+ETag/Last-Modified validators of the RDF: entries younger than the TTL are
+trusted as-is, older ones are revalidated with a conditional request and only
+downloaded and parsed again when the RDF changed.
+
+With a `MirrorPool`, RDFs (and the archive) are requested from the best
+mirror of the pool, failing over to the next ones. RDFs of a local mirror
+(`file://`) are read from disk, their modification time being the validator.
 """
 
+import json
 import re
+import tarfile
+import threading
+import time
 from collections.abc import Iterable
+from dataclasses import dataclass
+from pathlib import Path
+from types import SimpleNamespace
 
+import apsw
 import requests
 from bs4 import BeautifulSoup, Tag
+from lxml import etree
 
 from gutenberg2zim.constants import DEFAULT_HTTP_TIMEOUT, logger
-from gutenberg2zim.core.models import Work
+from gutenberg2zim.core.local_mirror import last_modified, local_file, local_path
+from gutenberg2zim.core.mirror_pool import MirrorPool, MirrorTransfer, call_mirrors
+from gutenberg2zim.core.models import Format, Work, work_from_dict, work_to_dict
 from gutenberg2zim.core.ports import MetadataPort, WorkRef
-from gutenberg2zim.core.utils import normalize
+from gutenberg2zim.core.utils import download_file, normalize
 from gutenberg2zim.sources.gutenberg.adapters import book_to_work
 from gutenberg2zim.sources.gutenberg.catalog import transform_locc_code
 from gutenberg2zim.sources.gutenberg.models import Author, Book
+from gutenberg2zim.sources.gutenberg.resolver import pg_type_for_url
 
 
 class RdfParseError(RuntimeError):
     """Raised when a book RDF file cannot be parsed"""
 
 
+RDF_NAMESPACES = {
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "dcterms": "http://purl.org/dc/terms/",
+    "dcam": "http://purl.org/dc/dcam/",
+    "pgterms": "http://www.gutenberg.org/2009/pgterms/",
+    "marcrel": "http://id.loc.gov/vocabulary/relators/",
+}
+RDF_ABOUT = f"{{{RDF_NAMESPACES['rdf']}}}about"
+RDF_RESOURCE = f"{{{RDF_NAMESPACES['rdf']}}}resource"
+LCC_RESOURCE = "http://purl.org/dc/terms/LCC"
+
+# XPath expressions used by the lxml backend of `RdfParser`; each returns a
+# list of nodes (or strings), mirroring BeautifulSoup's document-order `find`
+_RDF_XPATHS = {
+    "title": "string((//dcterms:title)[1])",
+    "bookshelf_value": "((//pgterms:bookshelf)[1]//rdf:value)[1]",
+    "subjects": "//dcterms:subject",
+    "first_description": "(.//rdf:Description)[1]",
+    "first_member_of": "(.//dcam:memberOf)[1]",
+    "first_value": "(.//rdf:value)[1]",
+    "file_urls": "//pgterms:file/@rdf:about",
+    "files": "//pgterms:file",
+    "first_extent": "(.//dcterms:extent)[1]",
+    "first_modified": "(.//dcterms:modified)[1]",
+    "first_format_value": "(.//dcterms:format//rdf:value)[1]",
+    "marc520": "(//pgterms:marc520)[1]",
+    "creator": "(//dcterms:creator)[1]",
+    "compiler": "(//marcrel:com)[1]",
+    "first_agent": "(.//pgterms:agent)[1]",
+    "first_name": "(.//pgterms:name)[1]",
+    "birthdate": "(//pgterms:birthdate)[1]",
+    "deathdate": "(//pgterms:deathdate)[1]",
+    "languages": "//dcterms:language",
+    "downloads": "(//pgterms:downloads)[1]",
+    "rights": "(//dcterms:rights)[1]",
+}
+
+# compiled XPath objects must not be shared between threads
+_rdf_xpaths_local = threading.local()
+
+
+def _rdf_xpaths() -> SimpleNamespace:
+    """Compiled `_RDF_XPATHS`, once per thread"""
+    xpaths = getattr(_rdf_xpaths_local, "xpaths", None)
+    if xpaths is None:
+        xpaths = SimpleNamespace(
+            **{
+                name: etree.XPath(
+                    expression, namespaces=RDF_NAMESPACES, smart_strings=False
+                )
+                for name, expression in _RDF_XPATHS.items()
+            }
+        )
+        _rdf_xpaths_local.xpaths = xpaths
+    return xpaths
+
+
+def _text(node) -> str:
+    """All text below an lxml node, like BeautifulSoup's `.text`"""
+    return "".join(node.itertext())
+
+
+def _rdf_bytes(rdf_data: str | bytes) -> bytes:
+    # lxml rejects anything before the XML declaration, and str input with an
+    # encoding declaration
+    if isinstance(rdf_data, str):
+        rdf_data = rdf_data.encode("utf-8")
+    return rdf_data.lstrip()
+
+
+@dataclass(frozen=True, slots=True)
+class RdfFile:
+    """One file of a book, as listed in its RDF"""
+
+    url: str
+    media_type: str | None = None
+    size: int | None = None
+    modified: str | None = None
+
+
+def _int_or_none(value: str | None) -> int | None:
+    return int(value) if value and value.strip().isdigit() else None
+
+
 class RdfParser:
-    def __init__(self, rdf_data, gid):
+    """Parse one book RDF.
+
+    The default `lxml` backend evaluates precompiled XPath expressions over an
+    lxml tree; the `soup` backend (BeautifulSoup) is the historical one, kept
+    as a fallback for RDFs that are not well-formed XML. Both produce the same
+    fields.
+    """
+
+    def __init__(self, rdf_data, gid, *, backend: str = "lxml"):
+        if backend not in ("lxml", "soup"):
+            raise ValueError(f"Unsupported RDF parser backend: {backend}")
         self.rdf_data = rdf_data
         self.gid = gid
+        self.backend = backend
 
         self.author_id = None
         self.first_name = None
@@ -36,18 +155,143 @@ class RdfParser:
         self.lcc_shelf = None
         self.has_cover = False
         self.description = None
+        # files of the book listed in the RDF (pgterms:file)
+        self.files: list[RdfFile] = []
 
     def parse(self):
-        soup = BeautifulSoup(self.rdf_data, "lxml-xml")
-
-        # Parse and clean the book title
+        if self.backend == "lxml":
+            try:
+                root = etree.fromstring(
+                    _rdf_bytes(self.rdf_data),
+                    etree.XMLParser(resolve_entities=False, no_network=True),
+                )
+            except etree.XMLSyntaxError as exc:
+                logger.debug(f"Falling back to soup parser for RDF {self.gid}: {exc}")
+            else:
+                return self._parse_lxml(root)
+        return self._parse_soup()
+
+    def _set_title(self, full_title: str):
         # Title may be divided into newline-separated title and subtitle
-        title = soup.find("dcterms:title")
-        full_title = clean_marc_notation(title.text) if title else ""
         title_elements = full_title.split("\n")
         self.title = title_elements[0]
         self.subtitle = " ".join(title_elements[1:])
 
+    def _set_author_name(self, author_name: str):
+        # Because of a rare edge case that the field of the parsed
+        # author's name
+        # has more than one comma we will join the first name in reverse,
+        # starting
+        # with the second item.
+        author_name_elements = author_name.split(",")
+
+        if len(author_name_elements) > 1:
+            self.first_name = " ".join(
+                [element.strip() for element in author_name_elements[:0:-1]]
+            )
+        self.last_name = author_name_elements[0]
+
+    def _is_cover_url(self, url: str | None) -> bool:
+        # Search rdf to see if the image exists at the hard link
+        # /cache/epub/{id}/pg{id}.cover.medium.jpg
+        return url is not None and url.endswith(
+            f"/cache/epub/{self.gid}/pg{self.gid}.cover.medium.jpg"
+        )
+
+    def _parse_lxml(self, root):
+        xpaths = _rdf_xpaths()
+
+        # Parse and clean the book title
+        self._set_title(clean_marc_notation(xpaths.title(root)))
+
+        # Parsing for the bookshelf name (deprecated, kept for compatibility)
+        for bookshelf_value in xpaths.bookshelf_value(root):
+            self.bookshelf = clean_marc_notation(_text(bookshelf_value))
+
+        # Parsing for the LoCC (Library of Congress Classification)
+        # Transform it to a shelf identifier
+        for subject in xpaths.subjects(root):
+            description = xpaths.first_description(subject)
+            if not description:
+                continue
+            member_of = xpaths.first_member_of(description[0])
+            if member_of and member_of[0].get(RDF_RESOURCE, "") == LCC_RESOURCE:
+                value = xpaths.first_value(description[0])
+                if value:
+                    self.lcc_shelf = transform_locc_code(_text(value[0]).strip())
+                    break
+
+        self.has_cover = any(self._is_cover_url(url) for url in xpaths.file_urls(root))
+
+        def first_text(xpath, node) -> str | None:
+            found = xpath(node)
+            return _text(found[0]).strip() if found else None
+
+        self.files = [
+            RdfFile(
+                url=file_node.get(RDF_ABOUT),
+                media_type=first_text(xpaths.first_format_value, file_node),
+                size=_int_or_none(first_text(xpaths.first_extent, file_node)),
+                modified=first_text(xpaths.first_modified, file_node),
+            )
+            for file_node in xpaths.files(root)
+            if file_node.get(RDF_ABOUT)
+        ]
+
+        # Parse book description (MARC 520 = summary)
+        for marc520 in xpaths.marc520(root):
+            self.description = clean_marc_notation(_text(marc520))
+
+        # Parsing the name of the Author (see `_parse_soup` for details)
+        author = xpaths.creator(root) or xpaths.compiler(root)
+        if author:
+            agent = xpaths.first_agent(author[0])
+            about = agent[0].get(RDF_ABOUT) if agent else None
+            self.author_id = about.split("/")[-1] if about is not None else None
+
+            for author_name in xpaths.first_name(author[0]):
+                self._set_author_name(clean_marc_notation(_text(author_name)))
+
+        # Parsing the birth and (death, if the case) year of the author.
+        # These values are likely to be null.
+        birth_date = xpaths.birthdate(root)
+        self.birth_year = (
+            get_formatted_number(_text(birth_date[0])) if birth_date else None
+        )
+        death_date = xpaths.deathdate(root)
+        self.death_year = (
+            get_formatted_number(_text(death_date[0])) if death_date else None
+        )
+
+        # ISO 639-3 language codes that consist of 2 or 3 letters
+        self.languages = [
+            _text(value[0])
+            for language in xpaths.languages(root)
+            if (value := xpaths.first_value(language))
+        ]
+
+        downloads = xpaths.downloads(root)
+        if not downloads:
+            raise RdfParseError(
+                f"Impossible to find download tag in book {self.gid} RDF"
+            )
+        self.downloads = _text(downloads[0])
+
+        rights = xpaths.rights(root)
+        if not rights:
+            raise RdfParseError(
+                f"Impossible to find license tag in book {self.gid} RDF"
+            )
+        self.license = _text(rights[0])
+        return self
+
+    def _parse_soup(self):
+        soup = BeautifulSoup(self.rdf_data, "lxml-xml")
+
+        # Parse and clean the book title
+        title = soup.find("dcterms:title")
+        self._set_title(clean_marc_notation(title.text) if title else "")
+
         # Parsing for the bookshelf name (deprecated, kept for compatibility)
         bookshelf_tag = soup.find("pgterms:bookshelf")
         if bookshelf_tag:
@@ -65,29 +309,48 @@ class RdfParser:
                 member_of = description.find("dcam:memberOf")
                 if member_of:
                     resource = member_of.get("rdf:resource", "")
-                    if resource == "http://purl.org/dc/terms/LCC":
+                    if resource == LCC_RESOURCE:
                         value_tag = description.find("rdf:value")
                         if isinstance(value_tag, Tag):
                             locc_str = value_tag.text.strip()
                             self.lcc_shelf = transform_locc_code(locc_str)
                             break
 
-        # Search rdf to see if the image exists at the hard link
-        # /cache/epub/{id}/pg{id}.cover.medium.jpg
         def is_cover_node(node: Tag):
             if not node:
                 return False
-            for about_value in node.get_attribute_list("rdf:about"):
-                if about_value.endswith(
-                    f"/cache/epub/{self.gid}/pg{self.gid}.cover.medium.jpg"
-                ):
-                    return True
-            return False
+            return any(
+                self._is_cover_url(about_value)
+                for about_value in node.get_attribute_list("rdf:about")
+            )
 
         self.has_cover = any(
             is_cover_node(file_node) for file_node in soup.find_all("pgterms:file")
         )
 
+        def first_text(node: Tag, name: str) -> str | None:
+            found = node.find(name)
+            return found.text.strip() if isinstance(found, Tag) else None
+
+        self.files = []
+        for file_node in soup.find_all("pgterms:file"):
+            url = file_node.get("rdf:about")
+            if not url:
+                continue
+            file_format = file_node.find("dcterms:format")
+            self.files.append(
+                RdfFile(
+                    url=url,
+                    media_type=(
+                        first_text(file_format, "rdf:value")
+                        if isinstance(file_format, Tag)
+                        else None
+                    ),
+                    size=_int_or_none(first_text(file_node, "dcterms:extent")),
+                    modified=first_text(file_node, "dcterms:modified"),
+                )
+            )
+
         # Parse book description (MARC 520 = summary)
         marc520_tag = soup.find("pgterms:marc520")
         if isinstance(marc520_tag, Tag):
@@ -98,11 +361,6 @@ class RdfParser:
         # the <dcterms:creator> or <marcrel:com> node only return
         # "anonymous" or "unknown". For the case that it's only one word
         # `self.last_name` will be null.
-        # Because of a rare edge case that the field of the parsed
-        # author's name
-        # has more than one comma we will join the first name in reverse,
-        # starting
-        # with the second item.
         author_tag = soup.find("dcterms:creator") or soup.find("marcrel:com")
         if author_tag:
             author_about_tag = author_tag.find("pgterms:agent")
@@ -115,14 +373,7 @@ class RdfParser:
 
             author_name_tag = author_tag.find("pgterms:name")
             if isinstance(author_name_tag, Tag):  # pragma: no branch
-                author_name = clean_marc_notation(author_name_tag.text)
-                author_name_elements = author_name.split(",")
-
-                if len(author_name_elements) > 1:
-                    self.first_name = " ".join(
-                        [element.strip() for element in author_name_elements[:0:-1]]
-                    )
-                self.last_name = author_name_elements[0]
+                self._set_author_name(clean_marc_notation(author_name_tag.text))
 
         # Parsing the birth and (death, if the case) year of the author.
         # These values are likely to be null.
@@ -195,7 +446,7 @@ def _work_from_parser(parser: RdfParser) -> Work:
         author = Author(gut_id="216", last_name="Anonymous")
 
     normalized_title = normalize(parser.title.strip()) if parser.title else "Untitled"
-    return book_to_work(
+    work = book_to_work(
         Book(
             book_id=int(parser.gid),
             title=normalized_title if normalized_title else "Untitled",
@@ -211,14 +462,123 @@ def _work_from_parser(parser: RdfParser) -> Work:
             ),
         )
     )
+    # files available for the book, named after their PG type (for the
+    # format resolver); other files (RDF, QR code, ...) are of no use
+    work.formats = [
+        Format(
+            name=pg_type,
+            media_type=rdf_file.media_type or "application/octet-stream",
+            url=rdf_file.url,
+            size=rdf_file.size,
+            modified=rdf_file.modified,
+        )
+        for rdf_file in parser.files
+        if (pg_type := pg_type_for_url(rdf_file.url, parser.gid)) is not None
+    ]
+    return work
+
+
+# bump whenever the parsing changes, so that cached works are parsed again
+RDF_CACHE_VERSION = 2
+
 
+class RdfMetadataCache:
+    """Persistent cache of parsed RDFs, keyed by book id (SQLite).
 
-def fetch_book_metadata(book_id: int, mirror_url: str) -> Work | None:
+    Each entry holds the parsed work (or None for unusable books) and the
+    ETag/Last-Modified validators of the RDF it was parsed from.
+    """
+
+    def __init__(self, db_path: Path, ttl: float = 0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = apsw.Connection(str(db_path))
+        with self._lock:
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != RDF_CACHE_VERSION:
+                if version:
+                    logger.info("Discarding outdated RDF metadata cache")
+                self._conn.execute("DROP TABLE IF EXISTS rdf")
+                self._conn.execute(f"PRAGMA user_version = {RDF_CACHE_VERSION}")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS rdf ("
+                " book_id INTEGER PRIMARY KEY, etag TEXT, last_modified TEXT,"
+                " checked_on REAL NOT NULL, work TEXT)"
+            )
+
+    def get(self, book_id: int) -> tuple[Work | None, dict[str, str], bool] | None:
+        """Cached (work, validators, is_fresh) of a book, None if not cached
+
+        `validators` are the headers to send to revalidate the entry and
+        `is_fresh` tells whether the entry is still within the TTL.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, checked_on, work FROM rdf "
+                "WHERE book_id = ?",
+                (book_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, checked_on, work = row
+        validators = {}
+        if etag:
+            validators["If-None-Match"] = etag
+        if last_modified:
+            validators["If-Modified-Since"] = last_modified
+        return (
+            work_from_dict(json.loads(work)) if work else None,
+            validators,
+            time.time() - checked_on < self.ttl,
+        )
+
+    def put(
+        self,
+        book_id: int,
+        work: Work | None,
+        etag: str | None,
+        last_modified: str | None,
+    ) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO rdf "
+                "(book_id, etag, last_modified, checked_on, work) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    book_id,
+                    etag,
+                    last_modified,
+                    time.time(),
+                    json.dumps(work_to_dict(work)) if work else None,
+                ),
+            )
+
+    def touch(self, book_id: int) -> None:
+        """Mark an entry as just revalidated"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE rdf SET checked_on = ? WHERE book_id = ?",
+                (time.time(), book_id),
+            )
+
+
+def fetch_book_metadata(
+    book_id: int,
+    mirror_url: str,
+    cache: RdfMetadataCache | None = None,
+    mirrors: MirrorPool | None = None,
+) -> Work | None:
     """Download and parse RDF for a single book from the mirror.
 
     Args:
         book_id: The Gutenberg book ID
         mirror_url: The mirror URL (e.g., "https://gutenberg.mirror.driftle.ss")
+        cache: Optional persistent cache of parsed RDFs; cached entries within
+            the TTL are returned without any request, older ones are
+            revalidated with a conditional request
+        mirrors: Optional pool of mirrors to request the RDF from, `mirror_url`
+            being the canonical one
 
     Returns:
         Work if successful, None only for expected unusable books
@@ -228,15 +588,70 @@ def fetch_book_metadata(book_id: int, mirror_url: str) -> Work | None:
         requests.RequestException: If RDF download fails (retries handled by caller)
         RdfParseError: If RDF parsing fails
     """
+    cached = cache.get(book_id) if cache else None
+    if cached and cached[2]:
+        logger.debug(f"Using cached RDF metadata for book {book_id}")
+        return cached[0]
+
     rdf_url = f"{mirror_url}/cache/epub/{book_id}/pg{book_id}.rdf"
 
+    if local_path(rdf_url) is not None:
+        return _read_local_rdf(book_id, rdf_url, cached, cache)
+
     logger.debug(f"Downloading RDF for book {book_id} from {rdf_url}")
 
+    def _get(url: str, transfer: MirrorTransfer) -> requests.Response:
+        response = requests.get(
+            url, headers=cached[1] if cached else None, timeout=DEFAULT_HTTP_TIMEOUT
+        )
+        transfer.responded(response.status_code, response.headers.get("Retry-After"))
+        if response.status_code != requests.codes.not_modified:
+            response.raise_for_status()
+        if delay := transfer.received(len(response.content)):
+            # body already received: keep the mirror bandwidth budget anyway
+            time.sleep(delay)
+        return response
+
     # Download and parse the RDF - any errors will bubble up to the caller
-    response = requests.get(rdf_url, timeout=DEFAULT_HTTP_TIMEOUT)
-    response.raise_for_status()
+    response = call_mirrors(mirrors, rdf_url, _get)
+    if cache and cached and response.status_code == requests.codes.not_modified:
+        logger.debug(f"RDF of book {book_id} not modified, using cached metadata")
+        cache.touch(book_id)
+        return cached[0]
     rdf_data = response.content
 
+    work = _work_from_rdf(rdf_data, book_id)
+    if cache:
+        cache.put(
+            book_id,
+            work,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+    return work
+
+
+def _read_local_rdf(
+    book_id: int,
+    rdf_url: str,
+    cached: tuple[Work | None, dict[str, str], bool] | None,
+    cache: RdfMetadataCache | None,
+) -> Work | None:
+    """`fetch_book_metadata` for an RDF of a local mirror"""
+    rdf_path = local_file(rdf_url)
+    modified = last_modified(rdf_path)
+    if cache and cached and cached[1].get("If-Modified-Since") == modified:
+        logger.debug(f"RDF of book {book_id} not modified, using cached metadata")
+        cache.touch(book_id)
+        return cached[0]
+    work = _work_from_rdf(rdf_path.read_bytes(), book_id)
+    if cache:
+        cache.put(book_id, work, etag=None, last_modified=modified)
+    return work
+
+
+def _work_from_rdf(rdf_data: bytes, book_id: int) -> Work | None:
+    """Parse an RDF into a Work, None for unusable books"""
     parser = RdfParser(rdf_data, str(book_id)).parse()
 
     # Skip books that are missing critical information
@@ -253,13 +668,113 @@ def fetch_book_metadata(book_id: int, mirror_url: str) -> Work | None:
 class GutenbergRdfMetadata(MetadataPort):
     """`MetadataPort` implementation backed by the Gutenberg RDF dumps"""
 
-    def __init__(self, mirror_url: str):
+    def __init__(
+        self,
+        mirror_url: str,
+        cache: RdfMetadataCache | None = None,
+        mirrors: MirrorPool | None = None,
+    ):
+        self._mirror_url = mirror_url
+        self._cache = cache
+        self._mirrors = mirrors
+
+    def fetch(self, refs: Iterable[WorkRef]) -> Iterable[Work]:
+        works = []
+        for ref in refs:
+            work = fetch_book_metadata(
+                int(ref.id), self._mirror_url, self._cache, self._mirrors
+            )
+            if work is not None:
+                works.append(work)
+        return works
+
+
+# members are named `cache/epub/{id}/pg{id}.rdf` (possibly under a prefix)
+RDF_ARCHIVE_MEMBER = re.compile(r"(?:^|/)cache/epub/(\d+)/pg\1\.rdf$")
+
+
+def get_rdf_archive_fpath() -> Path:
+    return Path("rdf-files.tar.bz2").resolve()
+
+
+def download_rdf_archive(
+    archive_path: Path, archive_url: str, mirrors: MirrorPool | None = None
+) -> None:
+    """Download rdf-files.tar.bz2 archive"""
+    if archive_path.exists():
+        logger.info(f"\tRDF archive already exists in {archive_path}")
+        return
+
+    logger.info(f"\tDownloading {archive_url} into {archive_path}")
+    if not download_file(archive_url, archive_path, mirrors):
+        raise RuntimeError(f"Unable to download RDF archive from {archive_url}")
+
+
+class GutenbergRdfArchiveMetadata(MetadataPort):
+    """`MetadataPort` implementation backed by the bulk RDF archive.
+
+    The archive is streamed once, on first `fetch()`; RDFs of the requested
+    books (all books if `book_ids` is None) are parsed into an in-memory
+    index. Books missing from the archive (or whose RDF could not be parsed
+    there) are fetched one by one from the mirror, like `GutenbergRdfMetadata`.
+    """
+
+    def __init__(
+        self,
+        mirror_url: str,
+        archive_path: Path,
+        book_ids: Iterable[str] | None = None,
+        cache: RdfMetadataCache | None = None,
+        mirrors: MirrorPool | None = None,
+    ):
         self._mirror_url = mirror_url
+        self._cache = cache
+        self._mirrors = mirrors
+        self._archive_path = archive_path
+        self._book_ids = set(book_ids) if book_ids is not None else None
+        # book id -> Work, or None for unusable books
+        self._index: dict[str, Work | None] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            logger.info(f"Indexing RDF metadata from {self._archive_path}")
+            # streaming mode: members are read in archive order, no seeking
+            with tarfile.open(self._archive_path, "r|bz2") as archive:
+                for member in archive:
+                    matched = RDF_ARCHIVE_MEMBER.search(member.name)
+                    if not matched or not member.isfile():
+                        continue
+                    book_id = matched.group(1)
+                    if self._book_ids is not None and book_id not in self._book_ids:
+                        continue
+                    fh = archive.extractfile(member)
+                    if fh is None:  # pragma: no cover
+                        continue
+                    try:
+                        self._index[book_id] = _work_from_rdf(fh.read(), int(book_id))
+                    except RdfParseError as exc:
+                        logger.warning(
+                            f"Ignoring archived RDF of book {book_id}: {exc}"
+                        )
+            logger.info(f"Indexed {len(self._index)} RDF from the archive")
+            self._loaded = True
 
     def fetch(self, refs: Iterable[WorkRef]) -> Iterable[Work]:
+        self._load()
         works = []
         for ref in refs:
-            work = fetch_book_metadata(int(ref.id), self._mirror_url)
+            if ref.id in self._index:
+                # each book is fetched once: free memory as we go
+                work = self._index.pop(ref.id)
+            else:
+                logger.debug(f"Book {ref.id} not in RDF archive, fetching it")
+                work = fetch_book_metadata(
+                    int(ref.id), self._mirror_url, self._cache, self._mirrors
+                )
             if work is not None:
                 works.append(work)
         return works
@@ -2,28 +2,102 @@
 
 Supplies the source-specific hooks of `core.pipeline.Pipeline`:
 - `setup()`: export the infobox CSS/JS/icon assets first, to fail fast,
-- `process_ref()`: fetch metadata through the `MetadataPort`, download the
-  book in-memory with `download_book` (not yet migrated to `DownloadEngine`)
-  and export it with `export_book`. HTML rewriting still calls
-  `update_html_for_static` inside `export_book` (see `GutenbergHtmlRewriter`'s
-  docstring for why the port is not used there yet).
+- `fetch_metadata()`: fetch metadata through the `MetadataPort`,
+- `download()`: download the book in-memory with `download_book`, through
+  the shared `DownloadEngine` (`download_async()`/`download_book_async` with
+  an `AsyncDownloadEngine`), probing only the formats not known to be
+  missing (RDF file list, `FormatAvailabilityIndex`), and the cover of the
+  mirror; files above the `PayloadSpiller` threshold are kept on disk rather
+  than in memory,
+- `transform()`: rewrite and optimize the book files into ZIM entries with
+  `build_book_entries`, one file at a time (zipped HTML is extracted member
+  by member, main HTML first); the entries waiting for `write()` (and the
+  HTML pages held back) stay in memory up to the `PayloadSpiller` threshold
+  per book, the following ones in temporary files (HTML rewriting still calls
+  `update_html_for_static`, see `GutenbergHtmlRewriter`'s docstring for why
+  the port is not used there yet); the mirror cover is only used when the
+  HTML has none, which is only known once the HTML has been rewritten (the
+  transform stage never waits on the network); with a `transform_pool`, the
+  files (and that cover) are rather rewritten/optimized by its processes,
+  the transform threads handing them chunks of book files and waiting for
+  the results; images already stored for another book (`ImageRegistry`) are
+  added as aliases instead, and images optimized by a previous run are read
+  from the `ImageCache`, as are EPUBs from the `EpubCache`.
+
+Writing the prepared entries to the ZIM is left to the core `write()`, but
+for the aliases to images stored by other books: they are held back by the
+assembler until their target is added, unless the `ImageRegistry` knows it
+is written already.
 """
 
+from concurrent.futures import Executor
+
 from gutenberg2zim.constants import logger
+from gutenberg2zim.core.async_download_engine import AsyncDownloadEngine
+from gutenberg2zim.core.download_engine import DownloadEngine
+from gutenberg2zim.core.epub_cache import EpubCache
+from gutenberg2zim.core.image_cache import ImageCache
+from gutenberg2zim.core.image_dedup import ImageRegistry
+from gutenberg2zim.core.models import Work
 from gutenberg2zim.core.pipeline import Pipeline
 from gutenberg2zim.core.ports import WorkRef
+from gutenberg2zim.core.rewriters.image_rewriter import (
+    DEFAULT_IMAGE_OPTIONS,
+    ImageOptions,
+)
+from gutenberg2zim.core.spill import PayloadSpiller
+from gutenberg2zim.core.zim_assembler import ZimEntry
 from gutenberg2zim.sources.gutenberg.adapters import work_to_book
-from gutenberg2zim.sources.gutenberg.downloader import download_book
-from gutenberg2zim.sources.gutenberg.plugins import export_book, export_infobox_assets
+from gutenberg2zim.sources.gutenberg.downloader import (
+    BookContent,
+    download_book,
+    download_book_async,
+)
+from gutenberg2zim.sources.gutenberg.plugins import (
+    DEFAULT_CHUNK_SIZE,
+    build_book_entries,
+    export_infobox_assets,
+)
+from gutenberg2zim.sources.gutenberg.resolver import FormatAvailabilityIndex
 
 
 class GutenbergPipeline(Pipeline):
     """Per-book pipeline for the Gutenberg source, wired through ports"""
 
-    def __init__(self, *, mirror_url: str, title_search: bool, **kwargs):
+    def __init__(
+        self,
+        *,
+        mirror_url: str,
+        title_search: bool,
+        availability: FormatAvailabilityIndex | None = None,
+        spiller: PayloadSpiller | None = None,
+        html_rewriter: str = "soup",
+        transform_pool: Executor | None = None,
+        transform_chunk_size: int = DEFAULT_CHUNK_SIZE,
+        image_registry: ImageRegistry | None = None,
+        image_cache: ImageCache | None = None,
+        image_options: ImageOptions = DEFAULT_IMAGE_OPTIONS,
+        epub_cache: EpubCache | None = None,
+        **kwargs,
+    ):
         super().__init__(**kwargs)
         self.mirror_url = mirror_url
         self.title_search = title_search
+        self.availability = availability
+        self.spiller = spiller
+        self.html_rewriter = html_rewriter
+        self.transform_pool = transform_pool
+        self.transform_chunk_size = transform_chunk_size
+        self.image_registry = image_registry
+        self.image_cache = image_cache
+        self.image_options = image_options
+        self.epub_cache = epub_cache
+
+    @property
+    def engine(self) -> DownloadEngine:
+        if self.download_engine is None:
+            raise RuntimeError("Gutenberg pipeline requires a download engine")
+        return self.download_engine
 
     def setup(self) -> None:
         # Export infobox assets (CSS, JS, and icons) first to fail fast if
@@ -31,29 +105,76 @@ class GutenbergPipeline(Pipeline):
         logger.info("Exporting infobox assets")
         export_infobox_assets(self.assembler)
 
-    def process_ref(self, ref: WorkRef) -> None:
-        """Fetch metadata, download book content and export directly to ZIM"""
+    def fetch_metadata(self, ref: WorkRef) -> Work | None:
         works = list(self.metadata.fetch([ref]))
         if not works:
-            return
+            return None
         self.store.add(works[0])
-        book = work_to_book(works[0])
+        return works[0]
+
+    def download(self, work: Work) -> BookContent | None:
+        return download_book(
+            mirror_url=self.mirror_url,
+            book=work_to_book(work),
+            formats=self.formats,
+            work_store=self.store,
+            download_engine=self.engine,
+            work=work,
+            availability=self.availability,
+            spiller=self.spiller,
+        )
 
-        book_content = download_book(
+    async def download_async(self, work: Work) -> BookContent | None:
+        engine = self.engine
+        if not isinstance(engine, AsyncDownloadEngine):
+            return await super().download_async(work)
+        return await download_book_async(
             mirror_url=self.mirror_url,
-            book=book,
+            book=work_to_book(work),
             formats=self.formats,
             work_store=self.store,
+            download_engine=engine,
+            work=work,
+            availability=self.availability,
+            spiller=self.spiller,
         )
 
-        if book_content:
-            export_book(
-                book=book,
-                book_files=book_content.files,
-                formats=self.formats,
-                mirror_url=self.mirror_url,
-                assembler=self.assembler,
-                _zim_name=self.zim_name,
-                _title_search=self.title_search,
-                _add_lcc_shelves=self.add_lcc_shelves,
-            )
+    def replayed(self, entries: list[ZimEntry]) -> None:
+        # images stored by the previous run are not stored again
+        if self.image_registry:
+            for entry in entries:
+                if entry.dedup_key and entry.alias_target is None:
+                    self.image_registry.add(entry.dedup_key, entry.path, entry.size)
+
+    def write(self, entries: list[ZimEntry]) -> None:
+        registry = self.image_registry
+        if registry is None:
+            super().write(entries)
+            return
+        for entry in entries:
+            if not entry.dedup_key:
+                self.assembler.add_entry(entry)
+            elif entry.alias_target is not None:
+                # image stored by another book, possibly not written yet
+                held = not registry.is_written(entry.dedup_key)
+                self.assembler.add_entry(entry, held=held)
+            else:
+                self.assembler.add_entry(entry)
+                registry.written(entry.dedup_key)
+
+    def transform(self, content: BookContent) -> list[ZimEntry]:
+        return build_book_entries(
+            book=content.book,
+            book_files=content.files,
+            formats=self.formats,
+            spiller=self.spiller,
+            html_zip=content.html_zip,
+            cover_image=content.cover_image,
+            html_rewriter=self.html_rewriter,
+            transform_pool=self.transform_pool,
+            chunk_size=self.transform_chunk_size,
+            image_registry=self.image_registry,
+            image_cache=self.image_cache,
+            image_options=self.image_options,
+            epub_cache=self.epub_cache,
+        )
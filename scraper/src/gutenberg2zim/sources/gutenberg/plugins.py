@@ -5,62 +5,141 @@ offline page: charset normalization, image path transformation, internal
 link rewriting, PG boilerplate ("*** START OF THE PROJECT GUTENBERG EBOOK")
 removal, and infobox injection. Exposed through the source-agnostic
 `RewriterPort` via `GutenbergHtmlRewriter`. Also holds the per-book ZIM
-export (`export_book`) and EPUB optimization helpers.
+entries preparation (`build_book_entries`) and EPUB optimization helpers.
 """
 
+import copy
 import io
-import urllib.parse
+import struct
 import warnings
 import zipfile
+from collections import deque
+from collections.abc import Iterable, Iterator, Mapping
+from concurrent.futures import Executor, Future
+from contextlib import closing
+from dataclasses import replace
+from functools import lru_cache, partial
 from pathlib import Path
+from typing import IO, NamedTuple
 
 import bs4
 from bs4 import BeautifulSoup, Tag, XMLParsedAsHTMLWarning
-from jinja2 import Environment, PackageLoader, select_autoescape
 from zimscraperlib.image.optimization import optimize_jpeg, optimize_png
 
 from gutenberg2zim.constants import logger
+from gutenberg2zim.core.epub_cache import EpubCache
+from gutenberg2zim.core.image_cache import ImageCache
+from gutenberg2zim.core.image_dedup import IMAGE_EXTENSIONS, ImageRegistry
 from gutenberg2zim.core.models import Work
 from gutenberg2zim.core.ports import RewriterPort
 from gutenberg2zim.core.rewriters.image_rewriter import (
+    DEFAULT_IMAGE_OPTIONS,
+    ImageOptions,
     ImageProcessor,
+    StoredImage,
     rewrite_html_image_references,
 )
 from gutenberg2zim.core.rewriters.link_rewriter import replacement_link
+from gutenberg2zim.core.spill import (
+    Payload,
+    PayloadSpiller,
+    consume_payload,
+    discard_payload,
+    open_payload,
+    payload_size,
+)
 from gutenberg2zim.core.utils import (
     UTF8,
     archive_name_for,
     article_name_for,
-    book_name_for_fs,
     fname_for,
 )
-from gutenberg2zim.core.zim_assembler import ZimAssembler
+from gutenberg2zim.core.zim_assembler import ZimAssembler, ZimEntry
 from gutenberg2zim.sources.gutenberg.adapters import work_to_book
-from gutenberg2zim.sources.gutenberg.downloader import download_book_cover
+from gutenberg2zim.sources.gutenberg.boilerplate import remove_soup_boilerplate
+from gutenberg2zim.sources.gutenberg.downloader import (
+    iter_book_files,
+)
+from gutenberg2zim.sources.gutenberg.lxml_rewriter import (
+    UnsupportedDocument,
+    rewrite_html_lxml,
+)
 from gutenberg2zim.sources.gutenberg.models import Book
+from gutenberg2zim.sources.gutenberg.rewriting import (
+    INFOBOX_CSS_HREF,
+    INFOBOX_JS_SRC,
+    HtmlRewriteError,
+    infobox_href,
+    infobox_markup,
+    transform_image_path,
+)
 
 warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
 
 
-class HtmlRewriteError(RuntimeError):
-    """Raised when static HTML rewriting encounters an unexpected structure"""
+# book files handed at once to a transform process, and chunks of a book
+# handed to the transform processes at once
+DEFAULT_CHUNK_SIZE = 8
+PENDING_CHUNKS = 2
+# EPUB members optimized at once by the transform processes
+PENDING_EPUB_MEMBERS = 16
+# EPUB members optimized (the others are copied compressed as they are)
+EPUB_OPTIMIZED_SUFFIXES = (".jpg", ".jpeg", ".png", ".htm", ".html", ".xhtml", ".ncx")
+# zip local file header: its signature, its size before the name, and the
+# offset of the lengths of the name and extra field in it
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+LOCAL_HEADER_SIZE = 30
+LOCAL_HEADER_LENGTHS_OFFSET = 26
+# zip general purpose flag of encrypted members (never copied as they are)
+ENCRYPTED_FLAG = 0x1
+# members copied as they are, with no ZIP64 extra field (see `_write_epub_member`)
+RAW_COPY_MAX_SIZE = zipfile.ZIP64_LIMIT // 2
+# EPUB optimization (`optimize_epub`) version, part of the keys of cached
+# EPUBs: to bump whenever it changes the optimized EPUBs
+EPUB_OPTIMIZER = "epub-optimizer-1"
+
+
+# tags added to pages, copied from this document rather than parsed each time
+_PAGE_FRAGMENTS = BeautifulSoup(
+    '<html><head><meta http-equiv="Content-Type" content="text/html; charset=UTF-8"/>'
+    f'<link rel="stylesheet" href="{INFOBOX_CSS_HREF}" type="text/css"/></head>'
+    f'<body><script src="{INFOBOX_JS_SRC}" type="text/javascript"></script></body>'
+    "</html>",
+    "lxml",
+)
+
 
+def _page_fragment(name: str) -> Tag:
+    fragment = _PAGE_FRAGMENTS.find(name)
+    if not isinstance(fragment, Tag):
+        raise HtmlRewriteError(f"{name} fragment should be a Tag class")
+    return copy.copy(fragment)
 
-infobox_jinja_env = Environment(
-    loader=PackageLoader("gutenberg2zim", "templates"),
-    autoescape=select_autoescape(("html", "htm", "xml")),
-)
-infobox_jinja_env.filters["book_name_for_fs"] = book_name_for_fs
-infobox_jinja_env.filters["urlencode"] = urllib.parse.quote
+
+@lru_cache(maxsize=64)
+def _infobox_fragment(formats: tuple[str, ...]) -> Tag:
+    info_box = BeautifulSoup(infobox_markup(formats), "lxml").find("div")
+    if not isinstance(info_box, Tag):
+        raise HtmlRewriteError("info_box div should be a Tag class")
+    return info_box
 
 
-def transform_image_path(book_id: int, path: str) -> str:
-    """Transform image path from images/xxx to {book_id}_xxx"""
-    return path.replace("images/", f"{book_id}_")
+def _infobox(book, formats: list[str]) -> Tag:
+    """Infobox of `book`, a copy of the fragment of its formats"""
+    info_box = copy.copy(_infobox_fragment(tuple(book.requested_formats(formats))))
+    for link in info_box.find_all("a", href=True):
+        link["href"] = infobox_href(book, link["href"])
+    return info_box
 
 
 def update_html_for_static(
-    book, html_content, formats, *, epub: bool = False, is_xml: bool = False
+    book,
+    html_content,
+    formats,
+    *,
+    epub: bool = False,
+    is_xml: bool = False,
+    image_paths: Mapping[str, StoredImage] | None = None,
 ):
     soup = BeautifulSoup(html_content, "lxml-xml" if is_xml else "lxml")
 
@@ -113,7 +192,7 @@ def update_html_for_static(
         # Rewrite image references to use .webp extension for converted images
         # This also handles <link rel="icon"> tags
         # Only for regular HTML, not EPUB (EPUB images are not converted to WebP)
-        rewrite_html_image_references(soup, f"Book {book.book_id}")
+        rewrite_html_image_references(soup, f"Book {book.book_id}", image_paths)
 
     # update all <a> links to internal HTML pages
     # should only apply to relative URLs to HTML files.
@@ -141,51 +220,6 @@ def update_html_for_static(
             title_tag.string = book.title
             head.append(title_tag)
 
-    patterns = [
-        (
-            "*** START OF THE PROJECT GUTENBERG EBOOK",
-            "*** END OF THE PROJECT GUTENBERG EBOOK",
-        ),
-        (
-            "***START OF THE PROJECT GUTENBERG EBOOK",
-            "***END OF THE PROJECT GUTENBERG EBOOK",
-        ),
-        (
-            "<><><><><><><><><><><><><><><><><><><><><><><><><><><><><><><><><><>",
-            "<><><><><><><><><><><><><><><><><><><><><><><><><><><><><><><><><><>",
-        ),
-        # ePub only
-        ("*** START OF THIS PROJECT GUTENBERG EBOOK", "*** START: FULL LICENSE ***"),
-        (
-            "*END THE SMALL PRINT! FOR PUBLIC DOMAIN ETEXT",
-            "——————————————————————————-",
-        ),
-        (
-            "*** START OF THIS PROJECT GUTENBERG EBOOK",
-            "*** END OF THIS PROJECT GUTENBERG EBOOK",
-        ),
-        ("***START OF THE PROJECT GUTENBERG", "***END OF THE PROJECT GUTENBERG EBOOK"),
-        (
-            "COPYRIGHT PROTECTED ETEXTS*END*",
-            "===========================================================",
-        ),
-        (
-            "Nous remercions la Bibliothèque Nationale de France qui a mis à",
-            "The Project Gutenberg Etext of",
-        ),
-        (
-            "Nous remercions la Bibliothèque Nationale de France qui a mis à",
-            "End of The Project Gutenberg EBook",
-        ),
-        (
-            "=========================================================================",
-            "——————————————————————————-",
-        ),
-        ("Project Gutenberg Etext", "End of Project Gutenberg Etext"),
-        ("Text encoding is iso-8859-1", "Fin de Project Gutenberg Etext"),
-        ("—————————————————-", "Encode an ISO 8859/1 Etext into LaTeX or HTML"),
-    ]
-
     body = soup.find("body")
     if not isinstance(body, Tag):
         # No <body> to rewrite; return the original HTML unchanged
@@ -205,55 +239,11 @@ def update_html_for_static(
         has_single_div = False
 
     if not has_single_div:
-        for start_of_text, end_of_text in patterns:
-            if start_of_text not in body.text and end_of_text not in body.text:
-                continue
-
-            if start_of_text in body.text and end_of_text in body.text:
-                remove = True
-                for child in body.children:
-                    if not isinstance(child, bs4.Tag):
-                        continue
-                    if end_of_text in getattr(child, "text", ""):
-                        remove = True
-                    if start_of_text in getattr(child, "text", ""):
-                        child.decompose()
-                        remove = False
-                    if remove:
-                        child.decompose()
-                break
-
-            elif start_of_text in body.text:
-                remove = True
-                for child in body.children:
-                    if not isinstance(child, bs4.Tag):
-                        continue
-                    if start_of_text in getattr(child, "text", ""):
-                        child.decompose()
-                        remove = False
-                    if remove:
-                        child.decompose()
-                break
-            elif end_of_text in body.text:
-                remove = False
-                for child in body.children:
-                    if not isinstance(child, bs4.Tag):
-                        continue
-                    if end_of_text in getattr(child, "text", ""):
-                        remove = True
-                    if remove:
-                        child.decompose()
-                break
+        remove_soup_boilerplate(body)
 
     # build infobox
     if not epub:
-        infobox = infobox_jinja_env.get_template("book_infobox.html")
-        infobox_html = infobox.render({"book": book, "formats": formats})
-        info_soup = BeautifulSoup(infobox_html, "lxml")
-        info_box = info_soup.find("div")
-        if not isinstance(info_box, Tag):
-            raise HtmlRewriteError("info_box div should be a Tag class")
-        body.insert(0, info_box)
+        body.insert(0, _infobox(book, formats))
 
         # Ensure head exists
         head = soup.find("head")
@@ -265,48 +255,60 @@ def update_html_for_static(
             html.insert(0, head)
 
         # Add CSS link if not already present in head
-        if not head.find("link", {"href": "css/gutenberg-infobox.css"}):
-            css_link = soup.new_tag(
-                "link",
-                rel="stylesheet",
-                href="css/gutenberg-infobox.css",
-                type="text/css",
-            )
-            head.append(css_link)
+        if not head.find("link", {"href": INFOBOX_CSS_HREF}):
+            head.append(_page_fragment("link"))
 
         # Add JS script at the end of body if not already present
-        if not body.find("script", {"src": "js/gutenberg-infobox.js"}):
-            js_script = soup.new_tag(
-                "script", src="js/gutenberg-infobox.js", type="text/javascript"
-            )
-            body.append(js_script)
+        if not body.find("script", {"src": INFOBOX_JS_SRC}):
+            body.append(_page_fragment("script"))
 
     # if there is no charset, set it to utf8
     if not epub:
-        meta = BeautifulSoup(
-            '<meta http-equiv="Content-Type" content="text/html; charset=UTF-8" />',
-            "lxml",
-        )
         head = soup.find("head")
         html = soup.find("html")
         if not isinstance(head, Tag):
             raise HtmlRewriteError("head should be a Tag class")
         if not isinstance(html, Tag):
             raise HtmlRewriteError("html should be a Tag class")
-        if not isinstance(meta.head, Tag):
-            raise HtmlRewriteError("meta.head should be a Tag class")
-        if head:
-            head.insert(0, meta.head.contents[0])
-        elif html:
-            html.insert(0, meta.head)
-        else:
-            soup.insert(0, meta.head)
+        head.insert(0, _page_fragment("meta"))
 
         return html
 
     return soup
 
 
+def rewrite_html_page(
+    book: Book,
+    html_content: str,
+    formats: list[str],
+    rewriter: str = "soup",
+    *,
+    image_paths: Mapping[str, StoredImage] | None = None,
+) -> str:
+    """Static offline version of a book HTML page, with the `rewriter` engine
+
+    Both engines produce the same page; documents the lxml one does not
+    support are rewritten with BeautifulSoup. References to images (and
+    the width/height of downscaled ones) follow `image_paths` (see
+    `handle_book_files`).
+    """
+    if rewriter == "lxml":
+        try:
+            return rewrite_html_lxml(
+                book, html_content, formats, image_paths=image_paths
+            )
+        except UnsupportedDocument as exc:
+            logger.debug(f"Book {book.book_id}: rewriting with soup ({exc})")
+    return str(
+        update_html_for_static(
+            book=book,
+            html_content=html_content,
+            formats=formats,
+            image_paths=image_paths,
+        )
+    )
+
+
 def export_infobox_assets(assembler: ZimAssembler) -> None:
     """Export infobox CSS, JS, and icon files to ZIM"""
     templates_dir = Path(__file__).parent.parent.parent / "templates"
@@ -355,23 +357,43 @@ class GutenbergHtmlRewriter(RewriterPort):
         return BeautifulSoup(str(result), "lxml")
 
 
-def export_book(
+def build_book_entries(
     book: Book,
-    book_files: dict[str, bytes],
+    book_files: dict[str, Payload],
     formats: list[str],
-    mirror_url: str,
-    assembler: ZimAssembler,
-    _zim_name: str,
-    *,
-    _title_search: bool,
-    _add_lcc_shelves: bool,
-):
-    """Export book to ZIM using in-memory content"""
-    handle_book_files(
+    spiller: PayloadSpiller | None = None,
+    html_zip: Payload | None = None,
+    cover_image: bytes | None = None,
+    html_rewriter: str = "soup",
+    transform_pool: Executor | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    image_registry: ImageRegistry | None = None,
+    image_cache: ImageCache | None = None,
+    image_options: ImageOptions = DEFAULT_IMAGE_OPTIONS,
+    epub_cache: EpubCache | None = None,
+) -> list[ZimEntry]:
+    """Prepare all ZIM entries of a book (HTML, other formats, images, cover)
+
+    The `cover_image` downloaded from the mirror is only used when the HTML
+    has no cover. With a `transform_pool`, files are rewritten/optimized by
+    its processes (see `handle_book_files`), as is that cover.
+    With an `image_registry`, images already stored for other books are
+    added as aliases of those. Images are optimized through `image_cache`,
+    as set by `image_options`, and the EPUB through `epub_cache`.
+    """
+    entries = handle_book_files(
         book=book,
         book_files=book_files,
         formats=formats,
-        assembler=assembler,
+        spiller=spiller,
+        html_zip=html_zip,
+        html_rewriter=html_rewriter,
+        transform_pool=transform_pool,
+        chunk_size=chunk_size,
+        image_registry=image_registry,
+        image_cache=image_cache,
+        image_options=image_options,
+        epub_cache=epub_cache,
     )
 
     # Handle cover image
@@ -383,148 +405,684 @@ def export_book(
         logger.debug(
             f"Using HTML cover for book #{book.book_id}: {book.html_cover_path}"
         )
-        assembler.add_alias(
-            path=cover_path,
-            title="",
-            target=book.html_cover_path,
+        entries.append(
+            ZimEntry(path=cover_path, title="", alias_target=book.html_cover_path)
         )
-    else:
-        # No HTML cover - download from mirror
-        cover_image = download_book_cover(mirror_url, book)
-
-        if cover_image:
-            logger.debug(f"Using downloaded cover for book #{book.book_id}")
-            # the mirror serves JPEG; convert to WebP to match cover_path/mimetype
-            cover_image = ImageProcessor.optimize_image_content(cover_image)
-            assembler.add_item_for(
+    elif cover_image:
+        logger.debug(f"Using downloaded cover for book #{book.book_id}")
+        # the mirror serves JPEG; convert to WebP to match cover_path/mimetype
+        # (never kept as is by the encoding selection)
+        image_options = replace(image_options, encoder_budget=None)
+        if transform_pool:
+            cover_image = transform_pool.submit(
+                optimize_image, cover_image, image_cache, image_options
+            ).result()
+        else:
+            cover_image = optimize_image(cover_image, image_cache, image_options)
+        entries.append(
+            ZimEntry(
                 path=cover_path,
                 content=cover_image,
                 mimetype="image/webp",
                 is_front=False,
             )
+        )
+
+    return entries
+
+
+def _payload_entry(path: str, payload: Payload, **kwargs) -> ZimEntry:
+    """ZIM entry of a payload; spilled files are removed once added to the ZIM"""
+    if isinstance(payload, Path):
+        return ZimEntry(path=path, fpath=payload, delete_fpath=True, **kwargs)
+    return ZimEntry(path=path, content=payload, **kwargs)
+
+
+class DuplicateImage(NamedTuple):
+    """Book image already stored, at `target`, for another book"""
+
+    target: str
+    # key of the image in the `ImageRegistry`
+    key: bytes
+
+
+class TransformedFile(NamedTuple):
+    """Outcome of the transform of one book file (see `transform_book_files`)"""
+
+    entry: ZimEntry | None
+    # cover href of the book once an HTML page has been rewritten
+    cover_href: str | None = None
+    # an associated file (image...), possibly the cover HTML pages link to
+    may_be_cover: bool = False
+    # output filename of an image stored at another path (its original kept
+    # or a GIF converted, see `ImageProcessor.select_encoding`)
+    output_filename: str | None = None
+    # width/height of the source and of the stored image, when downscaled
+    image_sizes: tuple[tuple[int, int], tuple[int, int]] | None = None
+
+
+class _HeldBytes:
+    """Bytes of a book held in memory until written to the ZIM (its entries,
+    and its HTML pages held back), within the threshold of `spiller`: the
+    payloads beyond it are spilled to files instead (none without spiller)"""
+
+    def __init__(self, spiller: PayloadSpiller | None):
+        self.spiller = spiller
+        self.size = 0
+
+    def hold(self, payload: Payload, suffix: str = "") -> Payload:
+        if self.spiller is None or isinstance(payload, Path):
+            return payload
+        if self.size + len(payload) <= self.spiller.threshold:
+            self.size += len(payload)
+            return payload
+        path = self.spiller.new_path(suffix)
+        path.write_bytes(payload)
+        return path
+
+    def release(self, payload: Payload) -> None:
+        """Forget a payload of `hold`, no longer held"""
+        if self.spiller is not None and not isinstance(payload, Path):
+            self.size -= len(payload)
+
+    def hold_entry(self, entry: ZimEntry) -> ZimEntry:
+        if entry.content is None:
+            return entry
+        content = entry.content
+        if isinstance(content, str):
+            if self.spiller is None or self.size + len(content) <= (
+                self.spiller.threshold
+            ):
+                self.size += len(content)
+                return entry
+            content = content.encode(UTF8)
+        held = self.hold(content, Path(entry.path).suffix)
+        if not isinstance(held, Path):
+            return entry
+        return replace(entry, content=None, fpath=held, delete_fpath=True)
 
 
 def handle_book_files(
     book: Book,
-    book_files: dict[str, bytes],
+    book_files: dict[str, Payload],
     formats: list[str],
-    assembler: ZimAssembler,
-):
-    """Handle book files from in-memory content and add to ZIM"""
+    spiller: PayloadSpiller | None = None,
+    html_zip: Payload | None = None,
+    html_rewriter: str = "soup",
+    transform_pool: Executor | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    image_registry: ImageRegistry | None = None,
+    image_cache: ImageCache | None = None,
+    image_options: ImageOptions = DEFAULT_IMAGE_OPTIONS,
+    epub_cache: EpubCache | None = None,
+) -> list[ZimEntry]:
+    """Turn book files (and `html_zip` members) into ZIM entries (rewritten
+    and optimized)
+
+    Files are handled one at a time: `book_files` is consumed as it goes and
+    zip members are only extracted when reached. HTML pages are held back
+    (not rewritten) until the other files are, so that they reference images
+    where they are stored: with `.webp` extension when converted, as is when
+    their original is kept (see `ImageOptions.encoder_budget`), an alias
+    being added at their output filename (used by other books and the
+    cover). Images are then matched against the cover pages link to. With a
+    `spiller`, sources and results above its threshold are kept in files, as
+    are the entries (and held pages) of the book beyond that much in total:
+    the entries are returned at once, to wait for the writer.
+
+    With a `transform_pool` (processes), files are rather handed to it by
+    chunks of `chunk_size`, a few chunks of the book being transformed at
+    once; the book is updated (cover detection) from the results, in order.
+
+    With an `image_registry`, images are looked up by content before being
+    transformed: those already stored for another book (or this one) are
+    added as aliases of those, the others recorded once stored.
+
+    Spilled files are consumed: either read (HTML, images) and removed, or
+    handed to the ZIM which removes them once added. HTML pages are
+    rewritten with the `html_rewriter` engine (see `rewrite_html_page`), and
+    images optimized through `image_cache` (when set), as set by
+    `image_options`.
+
+    With an `epub_cache`, an EPUB optimized by a previous run (same source,
+    book and optimizer) is not optimized again but added from the cache, as
+    are the ones optimized now once stored in it.
+    """
+    page_entries: list[ZimEntry] = []
+    entries: list[ZimEntry] = []
+    pages: deque[tuple[str, Payload]] = deque()
+    # output filename of the images stored at another path or downscaled
+    image_paths: dict[str, StoredImage] = {}
+    # output filename of the files possibly being the cover
+    cover_candidates: list[str] = []
+    # output path of the images to store (first of their content) -> key
+    claimed: dict[str, bytes] = {}
+    # keys of the images stored, and the orphaned paths added as their aliases
+    stored: list[tuple[bytes, list[str]]] = []
+    # archive name of the EPUB to store in `epub_cache` -> key, source size
+    epub_misses: dict[str, tuple[str, int]] = {}
+    held = _HeldBytes(spiller)
+    transform_args = (formats, spiller, html_rewriter, image_cache, image_options)
+
+    with closing(iter_book_files(book, book_files, html_zip, spiller)) as files:
+        sources = (
+            _cached_epubs(book, formats, files, epub_cache, entries, epub_misses)
+            if epub_cache
+            else files
+        )
+        if image_registry:
+            sources = _dedup_images(sources, image_registry, claimed)
+        try:
+            for result in _transform(
+                book,
+                _hold_pages(sources, pages, held),
+                transform_pool,
+                chunk_size,
+                *transform_args,
+            ):
+                if (entry := result.entry) is None:
+                    continue
+                output_filename = result.output_filename or entry.path
+                if result.may_be_cover:
+                    cover_candidates.append(output_filename)
+                if image_registry and (key := claimed.pop(output_filename, None)):
+                    orphans = image_registry.stored(key, entry.size)
+                    stored.append((key, orphans))
+                    entry = replace(entry, dedup_key=key)
+                    entries.extend(
+                        ZimEntry(path=orphan, title="", alias_target=entry.path)
+                        for orphan in orphans
+                    )
+                if epub_cache and (miss := epub_misses.pop(entry.path, None)):
+                    entry = _cache_epub(book, entry, epub_cache, *miss)
+                entries.append(held.hold_entry(entry))
+                if result.output_filename or result.image_sizes:
+                    image_paths[output_filename] = StoredImage(
+                        entry.path, *(result.image_sizes or ())
+                    )
+                if result.output_filename:
+                    entries.append(
+                        ZimEntry(
+                            path=output_filename, title="", alias_target=entry.path
+                        )
+                    )
 
-    # Find the main HTML file
-    main_html_filename = f"{book.book_id}.html"
-    html_content = None
+            for result in _transform(
+                book,
+                _release_pages(pages, held),
+                transform_pool,
+                chunk_size,
+                *transform_args,
+                image_paths,
+            ):
+                if result.cover_href and not book._cover_href:
+                    book._cover_href = result.cover_href
+                if result.entry is not None:
+                    page_entries.append(held.hold_entry(result.entry))
+        except BaseException:
+            # the book is not written: its images are to store with other books
+            if image_registry:
+                for key, orphans in stored:
+                    image_registry.release(key, orphans)
+            for _, payload in pages:
+                discard_payload(payload)
+            for entry in page_entries + entries:
+                if entry.delete_fpath and entry.fpath:
+                    entry.fpath.unlink(missing_ok=True)
+            raise
+        finally:
+            if image_registry:
+                # not stored after all (failed to optimize...)
+                for key in claimed.values():
+                    image_registry.release(key)
+
+    for output_filename in cover_candidates:
+        _detect_html_cover(book, output_filename)
+    return page_entries + entries
+
+
+def _hold_pages(
+    files: Iterable[tuple[str, Payload | DuplicateImage]],
+    pages: deque[tuple[str, Payload]],
+    held: _HeldBytes,
+) -> Iterator[tuple[str, Payload | DuplicateImage]]:
+    """`files` but for HTML pages, appended to `pages` instead (through
+    `held`)"""
+    for filename, file_content in files:
+        if filename.endswith((".html", ".htm")) and not isinstance(
+            file_content, DuplicateImage
+        ):
+            pages.append((filename, held.hold(file_content, Path(filename).suffix)))
+        else:
+            yield filename, file_content
 
-    if main_html_filename in book_files:
-        html_content = book_files[main_html_filename].decode("utf-8", errors="replace")
 
-    if html_content:
-        article_name = article_name_for(book)
-        new_html = update_html_for_static(
-            book=book, html_content=html_content, formats=formats
-        )
+def _release_pages(
+    pages: deque[tuple[str, Payload]], held: _HeldBytes
+) -> Iterator[tuple[str, Payload]]:
+    """Pages held by `_hold_pages`, removed from `pages` (and `held`) as they
+    are iterated"""
+    while pages:
+        filename, payload = pages.popleft()
+        held.release(payload)
+        yield filename, payload
 
-        # Add the optimized HTML directly to ZIM
-        assembler.add_item_for(
-            path=article_name,
-            content=str(new_html),
-            mimetype="text/html",
-            is_front=False,
-            title=book.title,
-            auto_index=True,
-        )
 
-    # Handle other formats (epub, pdf)
-    other_filenames = []
-    for other_format in [
-        fmt for fmt in book.requested_formats(formats) if fmt != "html"
-    ]:
-        book_filename = fname_for(book, other_format)
-        if book_filename in book_files:
-            other_filenames.append(book_filename)
-            try:
-                archive_name = archive_name_for(book, other_format)
-                content = book_files[book_filename]
-                if other_format == "epub":
-                    content = optimize_epub_bytes(content, book)
-                assembler.add_item_for(
-                    path=archive_name,
-                    content=content,
-                    is_front=False,
-                )
-            except Exception as e:
-                logger.exception(e)
-                logger.error(f"\t\tException while handling {other_format}: {e}")
-                raise
-
-    # Process all associated files (images, companion HTML files, etc)
-    for filename, file_content in book_files.items():
-        # Skip the main HTML file as it's already processed
-        if filename == main_html_filename:
+def _cached_epubs(
+    book: Book,
+    formats: list[str],
+    files: Iterable[tuple[str, Payload]],
+    epub_cache: EpubCache,
+    entries: list[ZimEntry],
+    misses: dict[str, tuple[str, int]],
+) -> Iterator[tuple[str, Payload]]:
+    """`files` but for the EPUB when in `epub_cache`, added to `entries` from
+    the cache instead
+
+    An EPUB not cached is recorded in `misses`, by archive name.
+    """
+    epub_filename = (
+        fname_for(book, "epub") if "epub" in book.requested_formats(formats) else None
+    )
+    for filename, file_content in files:
+        if filename != epub_filename:
+            yield filename, file_content
+            continue
+        key = EpubCache.key(file_content, book.book_id, EPUB_OPTIMIZER)
+        original_size = payload_size(file_content)
+        archive_name = archive_name_for(book, "epub")
+        cached = epub_cache.get(key)
+        if cached is None:
+            misses[archive_name] = (key, original_size)
+            yield filename, file_content
             continue
+        logger.debug(f"Using cached optimized EPUB for book #{book.book_id}")
+        discard_payload(file_content)
+        epub_cache.record(
+            book.languages, original_size, cached.stat().st_size, cached=True
+        )
+        entries.append(ZimEntry(path=archive_name, fpath=cached, is_front=False))
+
+
+def _cache_epub(
+    book: Book, entry: ZimEntry, epub_cache: EpubCache, key: str, original_size: int
+) -> ZimEntry:
+    """Entry of the optimized EPUB of `entry`, once stored in `epub_cache`"""
+    path = epub_cache.put(key, entry.fpath or entry.content)
+    epub_cache.record(book.languages, original_size, path.stat().st_size)
+    return ZimEntry(path=entry.path, fpath=path, is_front=False)
 
-        # Skip files matching a specific format since they have already been processed
-        if filename in other_filenames:
+
+def _transform(
+    book: Book,
+    files: Iterable[tuple[str, Payload | DuplicateImage]],
+    transform_pool: Executor | None,
+    chunk_size: int,
+    *args,
+) -> Iterator[TransformedFile]:
+    """`transform_book_files`, run by `transform_pool` when set"""
+    if transform_pool:
+        return _transform_in_pool(transform_pool, chunk_size, book, files, *args)
+    return transform_book_files(book, files, *args)
+
+
+def _dedup_images(
+    files: Iterable[tuple[str, Payload]],
+    registry: ImageRegistry,
+    claimed: dict[str, bytes],
+) -> Iterator[tuple[str, Payload | DuplicateImage]]:
+    """`files`, images already stored (in `registry`) being `DuplicateImage`s
+
+    Other images are claimed in `registry`, recorded in `claimed`.
+    """
+    for filename, file_content in files:
+        if ImageProcessor.get_extension(filename) not in IMAGE_EXTENSIONS:
+            yield filename, file_content
             continue
+        output_filename = ImageProcessor.get_output_filename(filename)
+        key = ImageRegistry.key(file_content, output_filename)
+        target = registry.claim(key, output_filename, payload_size(file_content))
+        if target is None:
+            claimed[output_filename] = key
+            yield filename, file_content
+        else:
+            discard_payload(file_content)
+            yield filename, DuplicateImage(target, key)
 
-        if filename.endswith((".html", ".htm")):
-            # Process companion HTML files
-            try:
-                html_str = file_content.decode("utf-8", errors="replace")
-                new_html = update_html_for_static(
-                    book=book, html_content=html_str, formats=formats
-                )
-                assembler.add_item_for(
-                    path=filename,
-                    content=str(new_html),
-                    mimetype="text/html",
-                    is_front=False,
+
+def transform_book_files(
+    book: Book,
+    files: Iterable[tuple[str, Payload | DuplicateImage]],
+    formats: list[str],
+    spiller: PayloadSpiller | None = None,
+    html_rewriter: str = "soup",
+    image_cache: ImageCache | None = None,
+    image_options: ImageOptions = DEFAULT_IMAGE_OPTIONS,
+    image_paths: Mapping[str, StoredImage] | None = None,
+) -> Iterator[TransformedFile]:
+    """Rewrite/optimize book files one at a time, as they are iterated
+
+    Only depends on its arguments (the book being a copy in worker
+    processes): changes to the book are reported in the results. HTML pages
+    reference images where `image_paths` has them stored, with their stored
+    size when downscaled.
+    """
+    main_html_filename = f"{book.book_id}.html"
+    # other formats (epub, pdf)
+    other_formats = {
+        fname_for(book, fmt): fmt
+        for fmt in book.requested_formats(formats)
+        if fmt != "html"
+    }
+
+    for filename, file_content in files:
+        if isinstance(file_content, DuplicateImage):
+            entry = ZimEntry(
+                path=ImageProcessor.get_output_filename(filename),
+                title="",
+                alias_target=file_content.target,
+                dedup_key=file_content.key,
+            )
+            yield TransformedFile(entry, may_be_cover=True)
+        elif filename == main_html_filename:
+            entry = _main_html_entry(
+                book, file_content, formats, html_rewriter, image_paths
+            )
+            yield TransformedFile(entry, cover_href=book._cover_href)
+        elif other_format := other_formats.get(filename):
+            yield TransformedFile(
+                _other_format_entry(
+                    book, other_format, file_content, spiller, image_cache
                 )
-            except Exception as e:
-                logger.exception(e)
-                logger.error(f"\t\tException while handling companion HTML: {e}")
+            )
+        elif filename.endswith((".html", ".htm")):
+            entry = _companion_html_entry(
+                book,
+                filename,
+                file_content,
+                formats,
+                html_rewriter,
+                image_paths,
+            )
+            yield TransformedFile(entry, cover_href=book._cover_href)
         else:
-            # Add other files (images, etc) directly
-            try:
-                optimized_file_content = optimize_content(book, filename, file_content)
-                output_filename = ImageProcessor.get_output_filename(filename)
-
-                # Check if this is the cover image by comparing with transformed href
-                # Note: filename is already transformed (e.g., "1_cover.jpg")
-                # by download.py so we transform book._cover_href the same way
-                if book._cover_href:
-                    # Transform cover href same way we transform image paths
-                    expected_cover = transform_image_path(
-                        book.book_id, book._cover_href
-                    )
-                    expected_cover = ImageProcessor.get_output_filename(expected_cover)
+            # sizes only differ when downscaled
+            source_size = (
+                ImageProcessor.image_size(file_content)
+                if image_options.max_dimension is not None
+                and ImageProcessor.should_convert_to_webp(filename)
+                else None
+            )
+            entry = _associated_file_entry(
+                book, filename, file_content, spiller, image_cache, image_options
+            )
+            size = (
+                ImageProcessor.image_size(entry.fpath or entry.content)
+                if source_size and entry
+                else None
+            )
+            output_filename = ImageProcessor.get_output_filename(filename)
+            yield TransformedFile(
+                entry,
+                may_be_cover=True,
+                output_filename=(
+                    output_filename if entry and entry.path != output_filename else None
+                ),
+                image_sizes=(
+                    (source_size, size) if size and size != source_size else None
+                ),
+            )
+
+
+def _transform_chunk(
+    book: Book,
+    files: list[tuple[str, Payload | DuplicateImage]],
+    formats: list[str],
+    spiller: PayloadSpiller | None,
+    html_rewriter: str,
+    image_cache: ImageCache | None,
+    image_options: ImageOptions,
+    image_paths: Mapping[str, StoredImage] | None = None,
+) -> list[TransformedFile]:
+    return list(
+        transform_book_files(
+            book,
+            files,
+            formats,
+            spiller,
+            html_rewriter,
+            image_cache,
+            image_options,
+            image_paths,
+        )
+    )
 
-                    if output_filename == expected_cover:
-                        book.html_cover_path = output_filename
-                        logger.debug(
-                            f"Detected HTML cover for book #{book.book_id}: "
-                            f"{output_filename}"
-                        )
 
-                assembler.add_item_for(
-                    path=output_filename,
-                    content=optimized_file_content,
-                    is_front=False,
+def _transform_in_pool(
+    pool: Executor,
+    chunk_size: int,
+    book: Book,
+    files: Iterable[tuple[str, Payload | DuplicateImage]],
+    formats: list[str],
+    spiller: PayloadSpiller | None,
+    html_rewriter: str,
+    image_cache: ImageCache | None,
+    image_options: ImageOptions,
+    image_paths: Mapping[str, StoredImage] | None = None,
+) -> Iterator[TransformedFile]:
+    """`transform_book_files` over chunks of `files` run by `pool`, in order
+
+    The EPUB is rather optimized by the caller, its members by `pool` (see
+    `optimize_epub`), while the chunks before it are transformed.
+    """
+    args = (formats, spiller, html_rewriter, image_cache, image_options, image_paths)
+    epub_filename = (
+        fname_for(book, "epub") if "epub" in book.requested_formats(formats) else None
+    )
+    pending: deque[Future[list[TransformedFile]]] = deque()
+    try:
+        for chunk in _pool_chunks(files, chunk_size, epub_filename):
+            if isinstance(chunk, tuple):
+                entry = _other_format_entry(
+                    book, "epub", chunk[1], spiller, image_cache, pool
                 )
-            except Exception as e:
-                logger.exception(e)
-                logger.error(f"\t\tException while handling file {filename}: {e}")
+                while pending:
+                    yield from pending.popleft().result()
+                yield TransformedFile(entry)
+                continue
+            if len(pending) >= PENDING_CHUNKS:
+                yield from pending.popleft().result()
+            pending.append(pool.submit(_transform_chunk, book, chunk, *args))
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _pool_chunks(
+    files: Iterable[tuple[str, Payload | DuplicateImage]],
+    chunk_size: int,
+    epub_filename: str | None,
+) -> Iterator[list[tuple[str, Payload | DuplicateImage]] | tuple[str, Payload]]:
+    """Chunks of `files` for `_transform_in_pool`, the EPUB being alone (a
+    file, not a chunk)"""
+    chunk: list[tuple[str, Payload | DuplicateImage]] = []
+    for filename, file_content in files:
+        if filename == epub_filename and not isinstance(file_content, DuplicateImage):
+            if chunk:
+                yield chunk
+                chunk = []
+            yield filename, file_content
+            continue
+        chunk.append((filename, file_content))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _main_html_entry(
+    book: Book,
+    file_content: Payload,
+    formats: list[str],
+    html_rewriter: str,
+    image_paths: Mapping[str, StoredImage] | None,
+) -> ZimEntry | None:
+    html_content = consume_payload(file_content).decode("utf-8", errors="replace")
+    if not html_content:
+        return None
+
+    article_name = article_name_for(book)
+    new_html = rewrite_html_page(
+        book,
+        html_content,
+        formats,
+        html_rewriter,
+        image_paths=image_paths,
+    )
+
+    return ZimEntry(
+        path=article_name,
+        content=new_html,
+        mimetype="text/html",
+        is_front=False,
+        title=book.title,
+        auto_index=True,
+    )
+
+
+def _other_format_entry(
+    book: Book,
+    other_format: str,
+    content: Payload,
+    spiller: PayloadSpiller | None,
+    image_cache: ImageCache | None,
+    pool: Executor | None = None,
+) -> ZimEntry:
+    try:
+        archive_name = archive_name_for(book, other_format)
+        if other_format == "epub":
+            content = optimize_epub(content, book, spiller, image_cache, pool)
+        return _payload_entry(archive_name, content, is_front=False)
+    except Exception as e:
+        logger.exception(e)
+        logger.error(f"\t\tException while handling {other_format}: {e}")
+        raise
+
+
+def _companion_html_entry(
+    book: Book,
+    filename: str,
+    file_content: Payload,
+    formats: list[str],
+    html_rewriter: str,
+    image_paths: Mapping[str, StoredImage] | None,
+) -> ZimEntry | None:
+    """ZIM entry of a companion HTML file (other pages of the book)"""
+    try:
+        html_str = consume_payload(file_content).decode("utf-8", errors="replace")
+        new_html = rewrite_html_page(
+            book,
+            html_str,
+            formats,
+            html_rewriter,
+            image_paths=image_paths,
+        )
+        return ZimEntry(
+            path=filename,
+            content=new_html,
+            mimetype="text/html",
+            is_front=False,
+        )
+    except Exception as e:
+        logger.exception(e)
+        logger.error(f"\t\tException while handling companion HTML: {e}")
+        return None
 
 
-def optimize_content(book: Book, filename: str, file_content: bytes) -> bytes:
+def _associated_file_entry(
+    book: Book,
+    filename: str,
+    file_content: Payload,
+    spiller: PayloadSpiller | None,
+    image_cache: ImageCache | None,
+    image_options: ImageOptions,
+) -> ZimEntry | None:
+    """ZIM entry of an associated file (images, etc), added directly"""
+    try:
+        optimized_file_content = optimize_content(
+            book, filename, file_content, image_cache, image_options
+        )
+        output_filename = ImageProcessor.get_output_filename(filename)
+        if isinstance(optimized_file_content, bytes) and (
+            ImageProcessor.get_extension(filename) in IMAGE_EXTENSIONS
+        ):
+            output_filename = ImageProcessor.get_stored_filename(
+                filename, optimized_file_content
+            )
+        if spiller:
+            optimized_file_content = spiller.spill(
+                optimized_file_content, Path(output_filename).suffix
+            )
+        return _payload_entry(output_filename, optimized_file_content, is_front=False)
+    except Exception as e:
+        logger.exception(e)
+        logger.error(f"\t\tException while handling file {filename}: {e}")
+        return None
+
+
+def _detect_html_cover(book: Book, output_filename: str) -> None:
+    """Record `output_filename` as the book cover if HTML pages link to it"""
+    # Check if this is the cover image by comparing with transformed href
+    # Note: filename is already transformed (e.g., "1_cover.jpg")
+    # by download.py so we transform book._cover_href the same way
+    if book._cover_href:
+        # Transform cover href same way we transform image paths
+        expected_cover = transform_image_path(book.book_id, book._cover_href)
+        expected_cover = ImageProcessor.get_output_filename(expected_cover)
+
+        if output_filename == expected_cover:
+            book.html_cover_path = output_filename
+            logger.debug(
+                f"Detected HTML cover for book #{book.book_id}: {output_filename}"
+            )
+
+
+def optimize_image(
+    data: bytes,
+    image_cache: ImageCache | None = None,
+    options: ImageOptions = DEFAULT_IMAGE_OPTIONS,
+) -> bytes:
+    """Image converted to WebP as set by `options`, through `image_cache`
+    when set"""
+    if image_cache:
+        return image_cache.optimize(
+            data,
+            options.encoder,
+            partial(ImageProcessor.optimize_image_content, options=options),
+        )
+    return ImageProcessor.optimize_image_content(data, options)
+
+
+def optimize_content(
+    book: Book,
+    filename: str,
+    file_content: Payload,
+    image_cache: ImageCache | None = None,
+    image_options: ImageOptions = DEFAULT_IMAGE_OPTIONS,
+) -> Payload:
     """Optimize file content, converting images to WebP when appropriate."""
     # Convert JPG, PNG to WEBP for optimal file size
     if ImageProcessor.should_convert_to_webp(filename):
-        return ImageProcessor.optimize_image_content(file_content)
+        return optimize_image(consume_payload(file_content), image_cache, image_options)
 
-    # Keep WebP and GIF files as-is
+    # Keep WebP and GIF files as-is, but for GIFs smaller in (lossless) WebP
+    # when the encoding is selected
     ext = ImageProcessor.get_extension(filename)
+    if ext == "gif" and image_options.encoder_budget is not None:
+        return optimize_image(consume_payload(file_content), image_cache, image_options)
     if ext in ("webp", "gif"):
         if ext == "gif":
             logger.debug(
@@ -582,15 +1140,64 @@ def _process_epub_ncx(data: bytes, book: Book | None = None) -> bytes:
     return str(soup).encode(UTF8)
 
 
-def optimize_epub_bytes(epub_bytes: bytes, book: Book) -> bytes:
+def optimize_epub_bytes(
+    epub_bytes: bytes,
+    book: Book,
+    image_cache: ImageCache | None = None,
+    pool: Executor | None = None,
+) -> bytes:
     """Optimize EPUB in-memory: process HTML/NCX and optimize images without FS."""
-    src_buf = io.BytesIO(epub_bytes)
     dst_buf = io.BytesIO()
-    original_size = len(epub_bytes)
+    _write_optimized_epub(io.BytesIO(epub_bytes), dst_buf, book, image_cache, pool)
+    optimized_bytes = dst_buf.getvalue()
+    _log_epub_sizes(book, len(epub_bytes), len(optimized_bytes))
+    return optimized_bytes
+
+
+def optimize_epub(
+    epub: Payload,
+    book: Book,
+    spiller: PayloadSpiller | None = None,
+    image_cache: ImageCache | None = None,
+    pool: Executor | None = None,
+) -> Payload:
+    """Optimize an EPUB payload; a spilled one is optimized file to file
 
+    With a `pool`, its members are optimized by the pool, a few at a time.
+    """
+    if not isinstance(epub, Path):
+        return optimize_epub_bytes(epub, book, image_cache, pool)
+    if spiller is None:
+        return optimize_epub_bytes(consume_payload(epub), book, image_cache, pool)
+    dst_path = spiller.new_path(".epub")
+    try:
+        with open_payload(epub) as src:
+            _write_optimized_epub(src, dst_path, book, image_cache, pool)
+    except BaseException:
+        dst_path.unlink(missing_ok=True)
+        raise
+    _log_epub_sizes(book, epub.stat().st_size, dst_path.stat().st_size)
+    epub.unlink(missing_ok=True)
+    return dst_path
+
+
+def _write_optimized_epub(
+    src: IO[bytes],
+    dst: IO[bytes] | Path,
+    book: Book,
+    image_cache: ImageCache | None = None,
+    pool: Executor | None = None,
+) -> None:
+    """Write the optimized version of EPUB `src` to `dst` (images optimized
+    through `image_cache` when set)
+
+    Only images, HTML and NCX members are read and optimized, by `pool` when
+    set; the others (stylesheets, fonts, OPF...) are copied compressed as
+    they are. Members are written in their original order, mimetype first.
+    """
     with (
-        zipfile.ZipFile(src_buf, "r") as src_zf,
-        zipfile.ZipFile(dst_buf, "w", zipfile.ZIP_DEFLATED) as dst_zf,
+        zipfile.ZipFile(src, "r") as src_zf,
+        zipfile.ZipFile(dst, "w", zipfile.ZIP_DEFLATED) as dst_zf,
     ):
         infos = src_zf.infolist()
         mimetype_info = next(
@@ -599,47 +1206,162 @@ def optimize_epub_bytes(epub_bytes: bytes, book: Book) -> bytes:
         if mimetype_info is None:
             raise ValueError("EPUB is missing its mimetype entry")
 
-        # Write mimetype first, uncompressed, per EPUB spec
+        # Write mimetype first, uncompressed, per EPUB spec (with its date,
+        # the same EPUB being optimized the same)
         dst_zf.writestr(
-            "mimetype",
+            zipfile.ZipInfo("mimetype", date_time=mimetype_info.date_time),
             src_zf.read(mimetype_info),
             compress_type=zipfile.ZIP_STORED,
         )
 
-        for info in infos:
-            if info.filename == "mimetype":
-                continue
-
-            name = info.filename
-            data = src_zf.read(name)
-            suffix = Path(name).suffix.lower()
-
-            if suffix in (".jpg", ".jpeg"):
-                optimized_data = _optimize_epub_jpeg(data)
-                if len(optimized_data) < len(data):  # ignore bigger compressed version
-                    data = optimized_data
-            elif suffix == ".png":
-                optimized_data = _optimize_epub_png(data)
-                if len(optimized_data) < len(data):  # ignore bigger compressed version
-                    data = optimized_data
-            elif suffix in (".gif", ".webp"):
-                logger.warning(
-                    f"Unexpected {suffix} image in EPUB for book {book.book_id}: {name}"
-                )
-            elif suffix in (".htm", ".html", ".xhtml"):
-                data = _process_epub_html(data, book, is_xml=(suffix == ".xhtml"))
-            elif suffix == ".ncx":
-                data = _process_epub_ncx(data, book)
-
-            # copy metadata but force deflate: the source ZipInfo's
-            # compress_type would otherwise override the archive default
-            out_info = zipfile.ZipInfo(filename=info.filename, date_time=info.date_time)
-            out_info.external_attr = info.external_attr
-            out_info.compress_type = zipfile.ZIP_DEFLATED
-            dst_zf.writestr(out_info, data)
-
-    optimized_bytes = dst_buf.getvalue()
-    optimized_size = len(optimized_bytes)
+        # members to write, in order: optimized content (or its future), or
+        # None for members to copy
+        pending: deque[tuple[zipfile.ZipInfo, Future[bytes] | bytes | None]] = deque()
+        try:
+            for info in infos:
+                if info.filename == "mimetype":
+                    continue
+                name = info.filename
+                suffix = Path(name).suffix.lower()
+                if suffix in (".gif", ".webp"):
+                    logger.warning(
+                        f"Unexpected {suffix} image in EPUB for book {book.book_id}: "
+                        f"{name}"
+                    )
+                if (
+                    suffix not in EPUB_OPTIMIZED_SUFFIXES
+                    and max(info.file_size, info.compress_size) < RAW_COPY_MAX_SIZE
+                    and not info.flag_bits & ENCRYPTED_FLAG
+                ):
+                    pending.append((info, None))
+                elif pool:
+                    pending.append(
+                        (
+                            info,
+                            pool.submit(
+                                _optimize_epub_member,
+                                name,
+                                src_zf.read(info),
+                                book,
+                                image_cache,
+                            ),
+                        )
+                    )
+                else:
+                    data = _optimize_epub_member(
+                        name, src_zf.read(info), book, image_cache
+                    )
+                    pending.append((info, data))
+                while pending and (
+                    len(pending) > PENDING_EPUB_MEMBERS
+                    or not isinstance(pending[0][1], Future)
+                    or pending[0][1].done()
+                ):
+                    _write_epub_member(src, dst_zf, *pending.popleft())
+            while pending:
+                _write_epub_member(src, dst_zf, *pending.popleft())
+        finally:
+            for _, content in pending:
+                if isinstance(content, Future):
+                    content.cancel()
+
+
+def _optimize_epub_member(
+    name: str, data: bytes, book: Book, image_cache: ImageCache | None
+) -> bytes:
+    """Optimized content of an EPUB member (as is but for images, HTML and
+    NCX members)"""
+    suffix = Path(name).suffix.lower()
+    if suffix in (".jpg", ".jpeg"):
+        optimized_data = (
+            image_cache.optimize(data, "epub-jpeg", _optimize_epub_jpeg)
+            if image_cache
+            else _optimize_epub_jpeg(data)
+        )
+        if len(optimized_data) < len(data):  # ignore bigger compressed version
+            data = optimized_data
+    elif suffix == ".png":
+        optimized_data = (
+            image_cache.optimize(data, "epub-png", _optimize_epub_png)
+            if image_cache
+            else _optimize_epub_png(data)
+        )
+        if len(optimized_data) < len(data):  # ignore bigger compressed version
+            data = optimized_data
+    elif suffix in (".htm", ".html", ".xhtml"):
+        data = _process_epub_html(data, book, is_xml=(suffix == ".xhtml"))
+    elif suffix == ".ncx":
+        data = _process_epub_ncx(data, book)
+    return data
+
+
+def _write_epub_member(
+    src: IO[bytes],
+    dst_zf: zipfile.ZipFile,
+    info: zipfile.ZipInfo,
+    content: Future[bytes] | bytes | None,
+) -> None:
+    """Write a member of the EPUB read from `src`: its optimized `content`, or
+    its compressed data as is when None
+
+    zipfile has no API writing compressed data as is: the data is written as
+    a stored member, then its local header is written again with the
+    compression, CRC and size of the source member. This relies on:
+
+    - `dst_zf` writing to a seekable file (`_write_optimized_epub` only opens
+      paths and in-memory buffers), so that zipfile writes local headers with
+      sizes and CRC rather than data descriptors after the data;
+    - members smaller than `RAW_COPY_MAX_SIZE`, whose local header has no
+      ZIP64 extra field, either as written by zipfile or as written again
+      (checked: the header must end where the data starts);
+    - the central directory being written from `out_info` on closing, so that
+      it gets the compression, CRC and size set here;
+    - `src_zf` reading `src` through its own position, seeking before each
+      read, so that reading `src` here (from the calling thread only) does
+      not move it.
+    """
+    # copy metadata but force deflate: the source ZipInfo's
+    # compress_type would otherwise override the archive default
+    out_info = zipfile.ZipInfo(filename=info.filename, date_time=info.date_time)
+    out_info.external_attr = info.external_attr
+    out_info.compress_type = zipfile.ZIP_DEFLATED
+    if isinstance(content, Future):
+        content = content.result()
+    if content is not None:
+        dst_zf.writestr(out_info, content)
+        return
+
+    # read the compressed data following the local header of the member
+    src.seek(info.header_offset)
+    header = src.read(LOCAL_HEADER_SIZE)
+    if not header.startswith(LOCAL_HEADER_SIGNATURE):
+        raise zipfile.BadZipFile(f"Bad local header of EPUB member {info.filename}")
+    name_length, extra_length = struct.unpack_from(
+        "<HH", header, LOCAL_HEADER_LENGTHS_OFFSET
+    )
+    src.seek(info.header_offset + LOCAL_HEADER_SIZE + name_length + extra_length)
+    raw = src.read(info.compress_size)
+    if len(raw) != info.compress_size:
+        raise zipfile.BadZipFile(f"Truncated EPUB member {info.filename}")
+    # written stored, then its local header (and central directory record,
+    # the same `out_info`) given the compression, CRC and size of the member
+    out_info.compress_type = zipfile.ZIP_STORED
+    out_info.file_size = len(raw)
+    with dst_zf.open(out_info, "w") as member:
+        member.write(raw)
+    out_info.compress_type = info.compress_type
+    out_info.CRC = info.CRC
+    out_info.file_size = info.file_size
+    header = out_info.FileHeader(zip64=False)
+    end = dst_zf.fp.tell()
+    if out_info.header_offset + len(header) != end - len(raw):
+        raise ValueError(f"Cannot copy EPUB member {info.filename} as is")
+    dst_zf.fp.seek(out_info.header_offset)
+    dst_zf.fp.write(header)
+    dst_zf.fp.seek(end)
+
+
+def _log_epub_sizes(book: Book, original_size: int, optimized_size: int) -> None:
     if optimized_size > original_size:
         logger.warning(
             f"Optimized EPUB for book {book.book_id} is larger than original: "
@@ -650,5 +1372,3 @@ def optimize_epub_bytes(epub_bytes: bytes, book: Book) -> bytes:
             f"Optimized EPUB for book {book.book_id}: "
             f"{optimized_size} < {original_size} bytes"
         )
-
-    return optimized_bytes
@@ -15,11 +15,23 @@ exposes format resolution through the source-agnostic `FormatResolverPort`.
 
 Some mirror sites are not affiliated with PG, a list of mirror sites is at
 https://www.gutenberg.org/dirs/MIRRORS.ALL but it may or may not be up to date.
+
+Candidate URLs are narrowed down using what is known about which PG types
+exist for a book: the files listed in its RDF (`Work.formats`) and, with a
+`FormatAvailabilityIndex`, the types which turned out to be missing on the
+mirror in earlier runs, so that doomed requests are not repeated. The types
+downloaded by earlier runs (and not modified since, as listed in the RDF)
+are tried first, so that the ones before them are not probed again.
 """
 
 import re
+import threading
+import time
+from pathlib import Path
 from urllib.parse import urlparse
 
+import apsw
+
 from gutenberg2zim.core.models import Work
 from gutenberg2zim.core.ports import DownloadRequest, FormatResolverPort
 
@@ -82,6 +94,91 @@ def archive_url(pg_url, mirror_url):
     return f"{mirror_url}{path}"
 
 
+def pg_type_for_url(url: str, book_id: str | int) -> str | None:
+    """PG type of a book file URL (canonical or mirror one), if known"""
+    path = urlparse(url).path
+    matched = MATCH_TYPE.search(path)
+    if matched:
+        if matched.group(1) == str(book_id) and matched.group(2) in FILENAMES:
+            return matched.group(2)
+        return None
+    filename = path.rsplit("/", 1)[-1]
+    for pg_type, pattern in FILENAMES.items():
+        if pattern.format(book_id=book_id) == filename:
+            return pg_type
+    return None
+
+
+# types found missing on the mirror are retried after this delay, in case a
+# format has been produced since then
+MISSING_FORMAT_TTL = 180 * 24 * 3600
+
+
+class FormatAvailabilityIndex:
+    """Persistent per-book index of PG types found available/missing (SQLite)"""
+
+    def __init__(self, db_path: Path, missing_ttl: float = MISSING_FORMAT_TTL):
+        self._missing_ttl = missing_ttl
+        self._lock = threading.Lock()
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = apsw.Connection(str(db_path))
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS formats ("
+                " book_id TEXT NOT NULL, pg_type TEXT NOT NULL,"
+                " available INTEGER NOT NULL, size INTEGER, modified TEXT,"
+                " checked_on REAL NOT NULL, PRIMARY KEY (book_id, pg_type))"
+            )
+
+    def _record(
+        self,
+        book_id: str,
+        pg_type: str,
+        *,
+        available: bool,
+        size: int | None = None,
+        modified: str | None = None,
+    ) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO formats "
+                "(book_id, pg_type, available, size, modified, checked_on) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (book_id, pg_type, int(available), size, modified, time.time()),
+            )
+
+    def record_available(
+        self, book_id: str, pg_type: str, size: int, modified: str | None = None
+    ) -> None:
+        """Record a PG type downloaded, with its size and last modification (as
+        listed in the RDF, if known)"""
+        self._record(book_id, pg_type, available=True, size=size, modified=modified)
+
+    def record_missing(self, book_id: str, pg_type: str) -> None:
+        self._record(book_id, pg_type, available=False)
+
+    def available(self, book_id: str) -> dict[str, str | None]:
+        """PG types of a book downloaded by earlier runs, with the last
+        modification they had then"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT pg_type, modified FROM formats "
+                "WHERE book_id = ? AND available = 1",
+                (book_id,),
+            ).fetchall()
+        return dict(rows)
+
+    def missing(self, book_id: str) -> set[str]:
+        """PG types of a book recently found missing on the mirror"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT pg_type FROM formats "
+                "WHERE book_id = ? AND available = 0 AND checked_on > ?",
+                (book_id, time.time() - self._missing_ttl),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+
 def url_for_type(pg_type, book_id, mirror_url):
     if pg_type in FILENAMES:
         fn = FILENAMES[pg_type].format(book_id=book_id)
@@ -94,26 +191,56 @@ class GutenbergFormatResolver(FormatResolverPort):
     Resolution is deterministic: PG publishes every format at a well-known
     mirror URL. Because a given file may be missing on the mirror, all
     candidate URLs (in preference order) are included in
-    `DownloadRequest.extra["candidate_urls"]`; the downloader probes them in
-    order until one succeeds.
+    `DownloadRequest.extra["candidate_urls"]` (with their PG types in
+    `extra["candidate_pg_types"]`); the downloader probes them in order until
+    one succeeds.
+
+    Types found missing in the `availability` index are not candidates. When
+    the RDF lists files of the requested format, only the listed types are
+    candidates; otherwise (nothing listed) all remaining types are probed.
+    The types the index has downloaded already come first, unless the RDF
+    lists them modified since. None is returned when no candidate is left.
     """
 
-    def __init__(self, mirror_url: str):
+    def __init__(
+        self, mirror_url: str, availability: FormatAvailabilityIndex | None = None
+    ):
         self._mirror_url = mirror_url
+        self._availability = availability
 
     def resolve(self, work: Work, format_name: str) -> DownloadRequest | None:
         pg_types = PG_PREFERRED_TYPES.get(format_name)
         if not pg_types:
             return None
-        candidate_urls = [
-            url
+        available = {}
+        if self._availability:
+            missing = self._availability.missing(work.id)
+            pg_types = [pg_type for pg_type in pg_types if pg_type not in missing]
+            available = self._availability.available(work.id)
+        listed = {fmt.name: fmt.modified for fmt in work.formats}
+        if any(pg_type in listed for pg_type in pg_types):
+            pg_types = [pg_type for pg_type in pg_types if pg_type in listed]
+
+        def known(pg_type: str) -> bool:
+            return pg_type in available and (
+                not listed.get(pg_type) or available[pg_type] == listed[pg_type]
+            )
+
+        # stable: in preference order among the known ones and the others
+        pg_types = sorted(pg_types, key=lambda pg_type: not known(pg_type))
+        candidates = [
+            (pg_type, url)
             for pg_type in pg_types
             if (url := url_for_type(pg_type, work.id, self._mirror_url)) is not None
         ]
-        if not candidate_urls:
+        if not candidates:
             return None
         return DownloadRequest(
-            url=candidate_urls[0],
+            url=candidates[0][1],
             format_name=format_name,
-            extra={"pg_type": pg_types[0], "candidate_urls": candidate_urls},
+            extra={
+                "pg_type": candidates[0][0],
+                "candidate_pg_types": [pg_type for pg_type, _ in candidates],
+                "candidate_urls": [url for _, url in candidates],
+            },
         )
@@ -0,0 +1,88 @@
+"""Building blocks shared by the Gutenberg HTML rewriting engines.
+
+Both `plugins.update_html_for_static` (BeautifulSoup) and
+`lxml_rewriter.rewrite_html_lxml` (single-pass lxml) turn a Gutenberg HTML
+page into a static offline page from the same pieces: image path
+transformation and the infobox template (PG boilerplate removal being in
+`boilerplate`).
+
+The infobox only depends on the formats of a book but for its id and name in
+links: it is rendered once per set of formats (`infobox_markup`), with marks
+in place of those, which engines parse once into a fragment and copy into
+each page, filling the links of the copy (`infobox_href`).
+"""
+
+import urllib.parse
+from functools import cache, lru_cache
+from typing import NamedTuple
+
+from jinja2 import Environment, PackageLoader, Template, select_autoescape
+
+from gutenberg2zim.core.utils import book_name_for_fs
+
+
+class HtmlRewriteError(RuntimeError):
+    """Raised when static HTML rewriting encounters an unexpected structure"""
+
+
+infobox_jinja_env = Environment(
+    loader=PackageLoader("gutenberg2zim", "templates"),
+    autoescape=select_autoescape(("html", "htm", "xml")),
+)
+infobox_jinja_env.filters["book_name_for_fs"] = book_name_for_fs
+infobox_jinja_env.filters["urlencode"] = urllib.parse.quote
+
+# engines rewriting book HTML pages (`--html-rewriter`): BeautifulSoup
+# (`plugins.update_html_for_static`) or single-pass lxml (`lxml_rewriter`)
+HTML_REWRITERS = ["soup", "lxml"]
+
+# assets referenced by rewritten pages (see `plugins.export_infobox_assets`)
+INFOBOX_CSS_HREF = "css/gutenberg-infobox.css"
+INFOBOX_JS_SRC = "js/gutenberg-infobox.js"
+
+
+def transform_image_path(book_id: int, path: str) -> str:
+    """Transform image path from images/xxx to {book_id}_xxx"""
+    return path.replace("images/", f"{book_id}_")
+
+
+# stand-ins for the id and name of the book in `infobox_markup`, left as is
+# by filters and escaping
+_BOOK_ID_MARK = "GUTENBERGINFOBOXBOOKID"
+_BOOK_NAME_MARK = "GUTENBERGINFOBOXBOOKNAME"
+
+
+class _InfoboxBook(NamedTuple):
+    """Book the infobox is rendered for by `infobox_markup`"""
+
+    formats: tuple[str, ...]
+    book_id: str = _BOOK_ID_MARK
+    title: str = _BOOK_NAME_MARK
+
+    def requested_formats(self, _all_requested_formats: list[str]) -> list[str]:
+        return list(self.formats)
+
+
+@cache
+def infobox_template() -> Template:
+    """The infobox template, compiled once"""
+    return infobox_jinja_env.get_template("book_infobox.html")
+
+
+def render_infobox(book, formats: list[str]) -> str:
+    """HTML of the infobox (links to the book page and other formats)"""
+    return infobox_template().render({"book": book, "formats": formats})
+
+
+@lru_cache(maxsize=64)
+def infobox_markup(formats: tuple[str, ...]) -> str:
+    """HTML of the infobox of books in `formats` (their requested formats),
+    the links of which are to fill with `infobox_href`"""
+    return render_infobox(_InfoboxBook(formats), list(formats))
+
+
+def infobox_href(book, href: str) -> str:
+    """Link of the infobox of `book`, from the one in `infobox_markup`"""
+    return href.replace(_BOOK_ID_MARK, str(book.book_id)).replace(
+        _BOOK_NAME_MARK, urllib.parse.quote(book_name_for_fs(book))
+    )
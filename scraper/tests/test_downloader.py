@@ -0,0 +1,841 @@
+import asyncio
+import copy
+import io
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+from bs4 import BeautifulSoup
+from PIL import Image
+
+from gutenberg2zim.core import async_download_engine
+from gutenberg2zim.core.async_download_engine import AsyncDownloadEngine
+from gutenberg2zim.core.download_cache import DownloadCache
+from gutenberg2zim.core.download_engine import (
+    DownloadEngine,
+    TargetLocks,
+    pooled_session,
+)
+from gutenberg2zim.core.image_dedup import DedupStats, ImageRegistry
+from gutenberg2zim.core.mirror_pool import (
+    MirrorPool,
+    TokenBucket,
+    retry_after_seconds,
+)
+from gutenberg2zim.core.models import Format, Work
+from gutenberg2zim.core.ports import DownloadRequest
+from gutenberg2zim.core.rewriters.image_rewriter import ImageOptions
+from gutenberg2zim.core.spill import PayloadSpiller
+from gutenberg2zim.core.utils import archive_name_for, article_name_for
+from gutenberg2zim.sources.gutenberg import downloader
+from gutenberg2zim.sources.gutenberg.downloader import (
+    download_book,
+    iter_book_files,
+    iter_zipped_html,
+)
+from gutenberg2zim.sources.gutenberg.plugins import handle_book_files
+from gutenberg2zim.sources.gutenberg.resolver import (
+    FormatAvailabilityIndex,
+    GutenbergFormatResolver,
+    pg_type_for_url,
+)
+
+
+def mock_session(chunks: list[bytes]) -> MagicMock:
+    """Session whose GET requests all return a 200 response with `chunks`"""
+    response = MagicMock(status_code=200, headers={})
+    response.__enter__.return_value = response
+    response.iter_content.side_effect = lambda **_: chunks
+    session = MagicMock()
+    session.get.return_value = response
+    return session
+
+
+def test_pooled_session_sizes_connection_pool():
+    session = pooled_session(pool_size=32)
+    adapter = session.get_adapter("https://gutenberg.mirror.driftle.ss")
+    assert adapter._pool_maxsize == 32
+    assert session.get_adapter("http://mirror") is adapter
+
+
+def test_download_engine_fetch_without_keeping_cache(tmp_path):
+    session = mock_session([b"book ", b"content"])
+
+    engine = DownloadEngine(tmp_path, session=session, keep_cache=False)
+    request = MagicMock(url="https://mirror/pg1.pdf", target=None)
+
+    assert engine.fetch(request) == b"book content"
+    assert not list(tmp_path.iterdir())
+
+
+def test_download_engine_cache_evicts_least_recently_used(tmp_path):
+    session = mock_session([b"x" * 40])
+
+    engine = DownloadEngine(tmp_path, session=session, cache_max_size=100)
+    urls = [f"https://mirror/pg{i}.pdf" for i in range(3)]
+    for url in urls[:2]:
+        engine.fetch(MagicMock(url=url, target=None))
+    # pg0 used again: pg1 is the least recently used one when pg2 comes in
+    engine.fetch(MagicMock(url=urls[0], target=None))
+    engine.fetch(MagicMock(url=urls[2], target=None))
+
+    assert not engine.cache_path_for(urls[1]).exists()
+    assert engine.cache.size == 80
+    assert (engine.cache.stats.hits, engine.cache.stats.misses) == (1, 3)
+    assert engine.cache.stats.bytes_saved == 40
+    assert engine.cache.stats.evictions == 1
+
+    # the LRU order is restored from the folder on the next run
+    cache = DownloadCache(tmp_path, max_size=40)
+    assert [path.stem for path in tmp_path.iterdir()] == [
+        engine.cache_path_for(urls[2]).stem
+    ]
+    assert cache.size == 40
+
+
+def test_download_engine_downloads_again_files_evicted_before_read(tmp_path):
+    session = mock_session([b"x" * 40])
+    engine = DownloadEngine(tmp_path, session=session)
+    request = MagicMock(url="https://mirror/pg1.pdf", target=None)
+    engine.fetch(request)
+    lookup = engine.cache.lookup
+
+    def lookup_then_evict(path):
+        size = lookup(path)
+        if size is not None:
+            # evicted by another worker right after being found
+            path.unlink()
+        return size
+
+    engine.cache.lookup = lookup_then_evict
+
+    assert engine.fetch(request) == b"x" * 40
+    assert session.get.call_count == 2
+    assert (engine.cache.stats.hits, engine.cache.stats.misses) == (0, 3)
+
+
+def test_download_engine_fetch_spills_large_files(tmp_path):
+    session = mock_session([b"x" * 64])
+    spiller = PayloadSpiller(tmp_path / "spill", threshold=32)
+
+    engine = DownloadEngine(tmp_path / "cache", session=session)
+    request = MagicMock(url="https://mirror/pg1.pdf", target=None)
+
+    spilled = engine.fetch(request, spiller)
+    assert spilled.parent == spiller.folder
+    assert spilled.read_bytes() == b"x" * 64
+    # the cached download is left untouched when the spilled file is consumed
+    spilled.unlink()
+    assert engine.fetch(request) == b"x" * 64
+
+
+def test_iter_zipped_html_spills_large_members(mock_book, tmp_path):
+    zip_buf = io.BytesIO()
+    with zipfile.ZipFile(zip_buf, "w") as zf:
+        zf.writestr("22094-h.htm", b"<html></html>")
+        zf.writestr("images/plate.jpg", b"\xff" * 100)
+    zip_path = tmp_path / "pg22094-h.zip"
+    zip_path.write_bytes(zip_buf.getvalue())
+    spiller = PayloadSpiller(tmp_path / "spill", threshold=50)
+
+    files = dict(iter_zipped_html(zip_path, mock_book, spiller))
+
+    assert files["22094.html"] == b"<html></html>"
+    plate = files["22094_plate.jpg"]
+    assert plate.parent == spiller.folder
+    assert plate.read_bytes() == b"\xff" * 100
+    # same result from an in-memory zip
+    assert dict(iter_zipped_html(zip_buf.getvalue(), mock_book))["22094_plate.jpg"] == (
+        b"\xff" * 100
+    )
+
+
+def test_download_book_tries_candidates_through_engine(mock_book):
+    def fetch(request, *_):
+        if request.url.endswith("-images.pdf"):
+            raise requests.HTTPError("404 Client Error: Not Found")
+        if request.url.endswith(".pdf"):
+            return b"%PDF"
+        raise requests.ConnectionError("unreachable")
+
+    engine = MagicMock(spec=DownloadEngine)
+    engine.fetch.side_effect = fetch
+
+    content = download_book(
+        mirror_url="https://mirror",
+        book=mock_book,
+        formats=["pdf"],
+        work_store=MagicMock(),
+        download_engine=engine,
+    )
+
+    assert content is not None
+    assert content.files == {"22094.pdf": b"%PDF"}
+    # html has no candidate reachable: marked as unsupported
+    assert mock_book.unsupported_formats == ["html"]
+    assert [call.args[0].url for call in engine.fetch.call_args_list][:2] == [
+        "https://mirror/cache/epub/22094/pg22094-images.pdf",
+        "https://mirror/cache/epub/22094/pg22094.pdf",
+    ]
+
+
+NOT_FOUND = requests.HTTPError(response=MagicMock(status_code=404))
+
+
+@pytest.mark.parametrize(
+    "cover_error, warned",
+    [
+        (None, False),
+        (NOT_FOUND, False),
+        (requests.ConnectionError("unreachable"), True),
+    ],
+)
+def test_download_book_downloads_cover(mock_book, monkeypatch, cover_error, warned):
+    def fetch(request, *_):
+        if request.format_name != "cover":
+            if request.url.endswith(".zip"):
+                raise NOT_FOUND
+            return b"<html></html>"
+        if cover_error:
+            raise cover_error
+        return b"JPEG"
+
+    engine = MagicMock(spec=DownloadEngine)
+    engine.fetch.side_effect = fetch
+    logger = MagicMock()
+    monkeypatch.setattr(downloader, "logger", logger)
+
+    content = download_book(
+        mirror_url="https://mirror",
+        book=mock_book,
+        formats=["html"],
+        work_store=MagicMock(),
+        download_engine=engine,
+    )
+
+    assert content.cover_image == (None if cover_error else b"JPEG")
+    assert engine.fetch.call_args_list[-1].args[0].url == (
+        "https://mirror/cache/epub/22094/pg22094.cover.medium.jpg"
+    )
+    # covers missing on the mirror are no warnings
+    assert logger.warning.called == warned
+
+
+def test_pg_type_for_url():
+    assert pg_type_for_url("https://www.gutenberg.org/ebooks/84.epub3.images", 84) == (
+        "epub3.images"
+    )
+    assert pg_type_for_url("https://www.gutenberg.org/cache/epub/84/pg84-h.zip", "84")
+    assert pg_type_for_url("https://www.gutenberg.org/ebooks/84.rdf", 84) == "rdf"
+    assert pg_type_for_url("https://www.gutenberg.org/ebooks/85.rdf", 84) is None
+    assert pg_type_for_url("https://www.gutenberg.org/files/84/84-0.txt", 84) is None
+
+
+def test_resolver_skips_formats_known_to_be_missing(tmp_path):
+    availability = FormatAvailabilityIndex(tmp_path / "formats.db")
+    resolver = GutenbergFormatResolver("https://mirror", availability)
+    work = Work(
+        id="84",
+        source="gutenberg",
+        title="Frankenstein",
+        formats=[Format(name="epub.noimages", media_type="application/epub+zip")],
+    )
+
+    # formats listed in the RDF are the only candidates
+    assert resolver.resolve(work, "epub").extra["candidate_pg_types"] == [
+        "epub.noimages"
+    ]
+    # nothing listed for html: all types but those found missing are probed
+    availability.record_missing("84", "zip")
+    request = resolver.resolve(work, "html")
+    assert request.url == "https://mirror/cache/epub/84/pg84-images.html"
+    assert request.extra["candidate_pg_types"] == ["html.images", "html.noimages"]
+    # types downloaded before come first, unless modified since
+    availability.record_available("84", "html.noimages", 10)
+    request = resolver.resolve(work, "html")
+    assert request.extra["candidate_pg_types"] == ["html.noimages", "html.images"]
+    work.formats.append(
+        Format(name="epub.images", media_type="application/epub+zip", modified="2")
+    )
+    availability.record_available("84", "epub.noimages", 10)
+    availability.record_available("84", "epub.images", 10, modified="1")
+    assert resolver.resolve(work, "epub").extra["candidate_pg_types"] == [
+        "epub.noimages",
+        "epub.images",
+    ]
+    availability.record_available("84", "epub.images", 10, modified="2")
+    assert resolver.resolve(work, "epub").extra["candidate_pg_types"] == [
+        "epub.images",
+        "epub.noimages",
+    ]
+    # nothing left to probe
+    availability.record_missing("84", "html.images")
+    availability.record_missing("84", "html.noimages")
+    assert resolver.resolve(work, "html") is None
+
+
+def test_download_book_records_missing_formats(mock_book, tmp_path):
+    def fetch(request, *_):
+        if request.url.endswith(".zip"):
+            response = requests.Response()
+            response.status_code = 404
+            raise requests.HTTPError("404 Client Error", response=response)
+        return b"<html></html>"
+
+    engine = MagicMock(spec=DownloadEngine)
+    engine.fetch.side_effect = fetch
+    availability = FormatAvailabilityIndex(tmp_path / "formats.db")
+
+    for _ in range(2):
+        download_book(
+            mirror_url="https://mirror",
+            book=mock_book,
+            formats=["html"],
+            work_store=MagicMock(),
+            download_engine=engine,
+            availability=availability,
+        )
+
+    # the missing zip is only requested by the first run
+    requests_ = [call.args[0] for call in engine.fetch.call_args_list]
+    assert [request.url for request in requests_ if request.format_name == "html"] == [
+        "https://mirror/cache/epub/22094/pg22094-h.zip",
+        "https://mirror/cache/epub/22094/pg22094-images.html",
+        "https://mirror/cache/epub/22094/pg22094-images.html",
+    ]
+
+
+BIG = bytes(range(256)) * 64
+BIG_ETAG = '"v1"'
+RANGES: list[str | None] = []
+
+
+@pytest.fixture
+def http_server():
+    """Local HTTP server serving `/pg{id}.txt` files, `/big.bin` (supporting
+    Range/If-Range requests, recorded in `RANGES`), 404 for anything else"""
+    RANGES.clear()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/big.bin":
+                self.send_big()
+                return
+            if not self.path.endswith(".txt"):
+                self.send_error(404)
+                return
+            body = f"content of {self.path}".encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_big(self):
+            start = 0
+            RANGES.append(self.headers.get("Range"))
+            if self.headers.get("Range") and self.headers["If-Range"] == BIG_ETAG:
+                start = int(self.headers["Range"][len("bytes=") : -1])
+            self.send_response(206 if start else 200)
+            self.send_header("ETag", BIG_ETAG)
+            if start:
+                self.send_header(
+                    "Content-Range", f"bytes {start}-{len(BIG) - 1}/{len(BIG)}"
+                )
+            self.send_header("Content-Length", str(len(BIG) - start))
+            self.end_headers()
+            self.wfile.write(BIG[start:])
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+@pytest.mark.parametrize("engine_class", [DownloadEngine, AsyncDownloadEngine])
+def test_download_engine_resumes_partial_downloads(http_server, tmp_path, engine_class):
+    engine = engine_class(tmp_path, max_retry_time=1)
+    request = DownloadRequest(f"{http_server}/big.bin", "bin")
+    target = engine.cache_path_for(request.url)
+    part = target.with_name(f"{target.name}.part")
+    etag = target.with_name(f"{target.name}.part.etag")
+    try:
+        # interrupted transfer of the current file: resumed
+        part.write_bytes(BIG[:1000])
+        etag.write_text(BIG_ETAG)
+        assert engine.fetch(request) == BIG
+        assert not part.exists() and not etag.exists()
+
+        # interrupted transfer of a former version: downloaded again
+        target.unlink()
+        part.write_bytes(b"x" * 1000)
+        etag.write_text('"v0"')
+        assert engine.fetch(request) == BIG
+        assert RANGES == ["bytes=1000-", "bytes=1000-"]
+    finally:
+        if isinstance(engine, AsyncDownloadEngine):
+            engine.close()
+
+
+@pytest.mark.parametrize("engine_class", [DownloadEngine, AsyncDownloadEngine])
+def test_download_engine_downloads_targets_once(http_server, tmp_path, engine_class):
+    engine = engine_class(tmp_path, max_retry_time=1)
+    request = DownloadRequest(f"{http_server}/big.bin", "bin")
+    try:
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda _: engine.fetch(request), range(4)))
+        assert results == [BIG] * 4
+        # the callers waiting for the first one take its file from the cache
+        assert len(RANGES) == 1
+        assert (engine.cache.stats.hits, engine.cache.stats.misses) == (3, 1)
+    finally:
+        if isinstance(engine, AsyncDownloadEngine):
+            engine.close()
+
+
+def test_target_locks_are_dropped_once_unused(tmp_path):
+    locks = TargetLocks(threading.Lock)
+    with locks.using(tmp_path) as lock, locks.using(tmp_path) as same:
+        assert same is lock
+    assert not locks._locks
+
+
+def test_async_download_engine(http_server, tmp_path, monkeypatch):
+    # bodies written by several blocks
+    monkeypatch.setattr(async_download_engine, "WRITE_BUFFER_SIZE", 5000)
+    engine = AsyncDownloadEngine(
+        tmp_path,
+        max_retry_time=1,
+        connections_per_host=2,
+        mirrors=MirrorPool([http_server], requests_per_second=100),
+    )
+    try:
+        # blocking contract, as DownloadEngine
+        result = engine.download(DownloadRequest(f"{http_server}/pg1.txt", "txt"))
+        assert result.path.read_bytes() == b"content of /pg1.txt"
+        assert not result.from_cache
+        with pytest.raises(requests.HTTPError) as exc_info:
+            engine.fetch(DownloadRequest(f"{http_server}/pg1.pdf", "pdf"))
+        assert exc_info.value.response.status_code == 404
+
+        # coroutine contract, from another event loop
+        async def fetch_all():
+            return await asyncio.gather(
+                *(
+                    engine.fetch_async(DownloadRequest(f"{http_server}/pg{i}.txt", ""))
+                    for i in range(2, 12)
+                )
+            )
+
+        assets = asyncio.run(fetch_all())
+        assert assets[0] == b"content of /pg2.txt"
+        assert len(assets) == 10
+        big = asyncio.run(
+            engine.fetch_async(DownloadRequest(f"{http_server}/big.bin", ""))
+        )
+        assert big == BIG
+    finally:
+        engine.close()
+
+
+def test_mirror_pool_fails_over_on_mirror_errors():
+    pool = MirrorPool(["https://a", "https://b/"])
+    requested = []
+
+    def send(url, transfer):
+        requested.append(url)
+        transfer.responded(503 if url.startswith("https://a") else 200)
+        if url.startswith("https://a"):
+            raise requests.HTTPError("503 Server Error")
+        return url
+
+    assert pool.call("https://a/cache/pg1.rdf", send) == "https://b/cache/pg1.rdf"
+    # a is failing: b is tried first from now on, until a is left aside
+    assert pool.call("https://a/cache/pg2.rdf", send) == "https://b/cache/pg2.rdf"
+    assert requested == [
+        "https://a/cache/pg1.rdf",
+        "https://b/cache/pg1.rdf",
+        "https://b/cache/pg2.rdf",
+    ]
+    # other URLs are not mirror ones
+    assert pool.candidates("https://other/x")[0][1] == "https://other/x"
+
+    def not_found(url, transfer):
+        requested.append(url)
+        transfer.responded(404)
+        raise requests.HTTPError("404 Client Error")
+
+    # missing files are not the mirror's fault: no failover
+    requested.clear()
+    with pytest.raises(requests.HTTPError):
+        pool.call("https://a/cache/pg3.rdf", not_found)
+    assert requested == ["https://b/cache/pg3.rdf"]
+
+
+def test_token_bucket_delays_beyond_burst():
+    bucket = TokenBucket(rate=10)
+    assert [bucket.reserve() for _ in range(10)] == [0] * 10
+    # one second worth of burst used: next units come at the bucket rate
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve(5) == pytest.approx(0.6, abs=0.01)
+
+
+def test_mirror_pool_schedules_requests():
+    pool = MirrorPool(["https://a", "https://b"], requests_per_second=20)
+
+    def busy(url, transfer):
+        transfer.responded(429 if url.startswith("https://a") else 200, "120")
+        if url.startswith("https://a"):
+            raise requests.HTTPError("429 Client Error")
+        return url
+
+    # a asks to wait two minutes: b is used meanwhile
+    assert pool.call("https://a/pg1.rdf", busy) == "https://b/pg1.rdf"
+    assert [url for _, url in pool.candidates("https://a/pg2.rdf")] == [
+        "https://b/pg2.rdf",
+        "https://a/pg2.rdf",
+    ]
+    # beyond the burst, requests wait for their slot, which is reported
+    for i in range(20):
+        pool.call(f"https://a/pg{i}.rdf", lambda url, _: url)
+    mirror_b = pool.candidates("https://a/x")[0][0]
+    assert mirror_b.url == "https://b"
+    assert mirror_b.waits == 1
+    assert 0 < mirror_b.max_wait <= 0.1
+    assert retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert retry_after_seconds("soon") is None
+
+
+@pytest.mark.parametrize("engine_class", [DownloadEngine, AsyncDownloadEngine])
+def test_download_engine_fails_over_to_next_mirror(http_server, tmp_path, engine_class):
+    # nothing listens on the first mirror
+    pool = MirrorPool(["http://127.0.0.1:9", http_server])
+    engine = engine_class(tmp_path, max_retry_time=1, mirrors=pool)
+    try:
+        content = engine.fetch(DownloadRequest("http://127.0.0.1:9/pg1.txt", "txt"))
+        assert content == b"content of /pg1.txt"
+        # cached under the canonical URL
+        assert engine.cache_path_for("http://127.0.0.1:9/pg1.txt").exists()
+    finally:
+        if isinstance(engine, AsyncDownloadEngine):
+            engine.close()
+
+
+def test_download_engine_reads_local_mirror_in_place(mock_book, tmp_path):
+    mirror = tmp_path / "mirror"
+    book_dir = mirror / "cache" / "epub" / "22094"
+    book_dir.mkdir(parents=True)
+    (book_dir / "pg22094.pdf").write_bytes(b"%PDF" * 100)
+    (book_dir / "pg22094-images.html").write_bytes(b"<html></html>")
+    mirror_url = mirror.as_uri()
+    spiller = PayloadSpiller(tmp_path / "spill", threshold=100)
+    engine = DownloadEngine(tmp_path / "cache", keep_cache=False)
+
+    content = download_book(
+        mirror_url=mirror_url,
+        book=mock_book,
+        formats=["pdf"],
+        work_store=MagicMock(),
+        download_engine=engine,
+        spiller=spiller,
+    )
+
+    assert content.files["22094.html"] == b"<html></html>"
+    # large file handed over as a spilled file, the mirror one is kept
+    assert content.files["22094.pdf"].read_bytes() == b"%PDF" * 100
+    assert (book_dir / "pg22094.pdf").exists()
+    assert not list((tmp_path / "cache").iterdir())
+    with pytest.raises(requests.HTTPError) as exc_info:
+        engine.fetch(DownloadRequest(f"{mirror_url}/cache/epub/1/pg1.pdf", "pdf"))
+    assert exc_info.value.response.status_code == 404
+
+
+def test_zipped_html_is_streamed_main_html_first(mock_book, tmp_path):
+    zip_buf = io.BytesIO()
+    with zipfile.ZipFile(zip_buf, "w") as zf:
+        zf.writestr("images/cover.gif", b"GIF89a" + b"\x00" * 100)
+        zf.writestr(
+            "22094-h.htm",
+            b'<html><head><link rel="icon" href="images/cover.gif"/></head>'
+            b"<body><p>Sahara</p></body></html>",
+        )
+
+    def fetch(request, *_):
+        if request.url.endswith(".zip"):
+            return zip_buf.getvalue()
+        raise requests.HTTPError("404 Client Error: Not Found")
+
+    engine = MagicMock(spec=DownloadEngine)
+    engine.fetch.side_effect = fetch
+    content = download_book(
+        mirror_url="https://mirror",
+        book=mock_book,
+        formats=["html"],
+        work_store=MagicMock(),
+        download_engine=engine,
+    )
+
+    # kept zipped until transformed
+    assert content.files == {}
+    assert content.html_zip == zip_buf.getvalue()
+    assert [name for name, _ in iter_zipped_html(content.html_zip, mock_book)] == [
+        "22094.html",
+        "22094_cover.gif",
+    ]
+
+    spiller = PayloadSpiller(tmp_path / "spill", threshold=50)
+    entries = handle_book_files(
+        mock_book, content.files, ["html"], spiller, html_zip=content.html_zip
+    )
+
+    # the cover linked from the HTML is detected, though listed before it
+    assert [entry.path for entry in entries] == [
+        article_name_for(mock_book),
+        "22094_cover.gif",
+    ]
+    assert mock_book.html_cover_path == "22094_cover.gif"
+    # large optimized files are handed over as files
+    assert entries[1].fpath.parent == spiller.folder
+
+
+def test_handle_book_files_spills_entries_beyond_threshold(mock_book, tmp_path):
+    zip_buf = io.BytesIO()
+    with zipfile.ZipFile(zip_buf, "w") as zf:
+        for index in range(4):
+            zf.writestr(f"images/plate{index}.gif", b"GIF89a" + b"\x00" * 30)
+        zf.writestr("22094-h.htm", b"<html><body><p>Sahara</p></body></html>")
+    spiller = PayloadSpiller(tmp_path / "spill", threshold=100)
+
+    entries = handle_book_files(
+        mock_book, {}, ["html"], spiller, html_zip=zip_buf.getvalue()
+    )
+
+    # each image is below the threshold, but not all of them together
+    plates = [entry for entry in entries if "plate" in entry.path]
+    assert len(plates) == 4
+    assert plates[0].content is not None and plates[0].fpath is None
+    assert plates[-1].content is None
+    assert plates[-1].fpath.parent == spiller.folder
+    assert plates[-1].fpath.read_bytes().startswith(b"GIF89a")
+
+
+def test_handle_book_files_in_process_pool(mock_book, tmp_path):
+    zip_buf = io.BytesIO()
+    with zipfile.ZipFile(zip_buf, "w") as zf:
+        for name in ("images/plate1.gif", "images/cover.gif", "images/plate2.gif"):
+            zf.writestr(name, b"GIF89a" + b"\x00" * 100)
+        zf.writestr("22094-h-notes.htm", b"<html><body><p>Notes</p></body></html>")
+        zf.writestr(
+            "22094-h.htm",
+            b'<html><head><link rel="icon" href="images/cover.gif"/></head>'
+            b"<body><p>Sahara</p></body></html>",
+        )
+    epub = io.BytesIO()
+    with zipfile.ZipFile(epub, "w") as zf:
+        zf.writestr("mimetype", "application/epub+zip")
+        zf.writestr("OEBPS/ch1.xhtml", b"<html><body><p>Sahara</p></body></html>")
+        zf.writestr("OEBPS/style.css", b"p { margin: 0 }")
+    serial_book = copy.deepcopy(mock_book)
+    spiller = PayloadSpiller(tmp_path / "spill", threshold=50)
+
+    expected = handle_book_files(
+        serial_book,
+        {"22094.epub": epub.getvalue()},
+        ["html", "epub"],
+        spiller,
+        html_zip=zip_buf.getvalue(),
+    )
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        # the EPUB members are optimized by the pool too
+        entries = handle_book_files(
+            mock_book,
+            {"22094.epub": epub.getvalue()},
+            ["html", "epub"],
+            spiller,
+            html_zip=zip_buf.getvalue(),
+            transform_pool=pool,
+            chunk_size=2,
+        )
+
+    assert [entry.path for entry in entries] == [entry.path for entry in expected]
+    assert archive_name_for(mock_book, "epub") in [entry.path for entry in entries]
+    assert [entry.content for entry in entries] == [entry.content for entry in expected]
+    assert [entry.fpath.read_bytes() for entry in entries if entry.fpath] == [
+        entry.fpath.read_bytes() for entry in expected if entry.fpath
+    ]
+    # the book is updated from the results of the processes
+    assert mock_book._cover_href == serial_book._cover_href == "images/cover.gif"
+    assert (
+        mock_book.html_cover_path == serial_book.html_cover_path == ("22094_cover.gif")
+    )
+
+
+def test_handle_book_files_dedups_images_across_books(mock_book, tmp_path):
+    png = io.BytesIO()
+    Image.new("RGB", (8, 8), "red").save(png, format="PNG")
+    other_book = copy.deepcopy(mock_book)
+    other_book.book_id = 1
+    registry = ImageRegistry()
+
+    first = handle_book_files(
+        mock_book, {"22094_logo.png": png.getvalue()}, ["html"], image_registry=registry
+    )
+    spiller = PayloadSpiller(tmp_path / "spill", threshold=10)
+    duplicate = spiller.spill(png.getvalue(), ".png")
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        second = handle_book_files(
+            other_book,
+            {"1_logo.png": duplicate, "1_cover.png": png.getvalue(), "1.html": b"<p/>"},
+            ["html"],
+            image_registry=registry,
+            transform_pool=pool,
+        )
+
+    assert [entry.path for entry in first] == ["22094_logo.webp"]
+    assert first[0].content.startswith(b"RIFF")
+    assert [(entry.path, entry.alias_target) for entry in second[1:]] == [
+        ("1_logo.webp", "22094_logo.webp"),
+        ("1_cover.webp", "22094_logo.webp"),
+    ]
+    assert not duplicate.exists()
+    assert registry.stats == DedupStats(
+        images=1,
+        duplicates=2,
+        source_bytes=2 * len(png.getvalue()),
+        bytes_saved=2 * len(first[0].content),
+    )
+
+
+def test_images_of_failed_books_are_stored_by_the_next_ones(mock_book):
+    png = io.BytesIO()
+    Image.new("RGB", (8, 8), "red").save(png, format="PNG")
+    key = ImageRegistry.key(png.getvalue(), "1_logo.webp")
+    registry = ImageRegistry()
+    # book 1 claimed the image, book 2 aliased it, then book 1 failed
+    assert registry.claim(key, "1_logo.webp", 10) is None
+    assert registry.claim(key, "2_logo.webp", 10) == "1_logo.webp"
+    registry.release(key)
+
+    entries = handle_book_files(
+        mock_book, {"22094_logo.png": png.getvalue()}, ["html"], image_registry=registry
+    )
+
+    # the alias of book 2 resolves to the image of this book
+    assert [(entry.path, entry.alias_target) for entry in entries] == [
+        ("1_logo.webp", "22094_logo.webp"),
+        ("22094_logo.webp", None),
+    ]
+    # once stored, released again: the orphaned path is handed to the next one
+    registry.release(key, ["1_logo.webp"])
+    assert registry.claim(key, "3_logo.webp", 10) is None
+    assert registry.stored(key, 10) == ["1_logo.webp"]
+
+
+def test_handle_book_files_references_images_where_stored(mock_book):
+    jpeg = io.BytesIO()
+    Image.effect_noise((64, 64), 80).convert("RGB").save(
+        jpeg, format="JPEG", quality=10
+    )
+    html = (
+        b'<html><head><link rel="icon" href="images/noise.jpg"/></head>'
+        b'<body><img src="images/noise.jpg"/><img src="images/red.png"/></body></html>'
+    )
+    png = io.BytesIO()
+    Image.new("RGB", (64, 64), "red").save(png, format="PNG")
+
+    entries = handle_book_files(
+        mock_book,
+        {
+            "22094.html": html,
+            "22094_noise.jpg": jpeg.getvalue(),
+            "22094_red.png": png.getvalue(),
+        },
+        ["html"],
+        image_options=ImageOptions(encoder_budget=1000),
+    )
+
+    # the original JPEG is smaller than in WebP: kept, with an alias at the
+    # path it is converted to by default
+    assert [(entry.path, entry.alias_target) for entry in entries] == [
+        (article_name_for(mock_book), None),
+        ("22094_noise.jpg", None),
+        ("22094_noise.webp", "22094_noise.jpg"),
+        ("22094_red.webp", None),
+    ]
+    assert entries[1].content == jpeg.getvalue()
+    page = BeautifulSoup(entries[0].content, "lxml")
+    assert page.find("link", rel="icon")["href"] == "22094_noise.jpg"
+    assert [img["src"] for img in page.body.find_all("img")][-2:] == [
+        "22094_noise.jpg",
+        "22094_red.webp",
+    ]
+    assert mock_book.html_cover_path == "22094_noise.webp"
+
+
+def test_handle_book_files_sizes_images_as_stored(mock_book):
+    png = io.BytesIO()
+    Image.new("RGB", (300, 200), "red").save(png, format="PNG")
+    html = (
+        b'<html><body><img src="images/plate.png" width="300" height="200"/>'
+        b'<img src="images/plate.png" width="150" height="100"/></body></html>'
+    )
+
+    entries = handle_book_files(
+        mock_book,
+        {"22094.html": html, "22094_plate.png": png.getvalue()},
+        ["html"],
+        image_options=ImageOptions(max_dimension=120),
+    )
+
+    with Image.open(io.BytesIO(entries[1].content)) as image:
+        assert image.size == (120, 80)
+    # the source size is replaced by the stored one, other display sizes kept
+    images = BeautifulSoup(entries[0].content, "lxml").body.find_all("img")
+    assert [(img["width"], img["height"]) for img in images][-2:] == [
+        ("120", "80"),
+        ("150", "100"),
+    ]
+
+
+def test_download_book_rejects_truncated_zip(mock_book):
+    zip_buf = io.BytesIO()
+    with zipfile.ZipFile(zip_buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("22094-h.htm", b"<html></html>" * 100)
+    truncated = zip_buf.getvalue()[:-30]
+
+    def fetch(request, *_):
+        return truncated if request.url.endswith(".zip") else b"<html></html>"
+
+    engine = MagicMock(spec=DownloadEngine)
+    engine.fetch.side_effect = fetch
+    content = download_book(
+        mirror_url="https://mirror",
+        book=mock_book,
+        formats=["html"],
+        work_store=MagicMock(),
+        download_engine=engine,
+    )
+
+    # next type tried
+    assert content.html_zip is None
+    assert content.files == {"22094.html": b"<html></html>"}
+
+
+def test_corrupt_zip_members_end_extraction(mock_book):
+    zip_buf = io.BytesIO()
+    with zipfile.ZipFile(zip_buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("22094-h.htm", b"<html></html>" * 100)
+        zf.writestr("images/plate.png", b"PNG" * 100)
+    corrupt = bytearray(zip_buf.getvalue())
+    corrupt[40:50] = b"\x00" * 10
+
+    # only found corrupt once extracted, the other files still yielded
+    files = iter_book_files(mock_book, {"22094.pdf": b"%PDF"}, bytes(corrupt))
+    assert [name for name, _ in files] == ["22094.pdf"]
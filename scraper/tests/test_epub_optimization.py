@@ -1,13 +1,28 @@
 """Tests for EPUB optimization functions in sources/gutenberg/plugins.py."""
 
+import io
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from types import SimpleNamespace
 
 import pytest
 from bs4 import BeautifulSoup
+from PIL import Image, ImageDraw
 
+from gutenberg2zim.core.epub_cache import EpubCache
+from gutenberg2zim.core.image_cache import ImageCache
+from gutenberg2zim.core.rewriters.image_rewriter import ImageOptions, ImageProcessor
+from gutenberg2zim.core.spill import PayloadSpiller
+from gutenberg2zim.core.utils import archive_name_for, fname_for
+from gutenberg2zim.sources.gutenberg import plugins
 from gutenberg2zim.sources.gutenberg.plugins import (
     _process_epub_html,
     _process_epub_ncx,
+    handle_book_files,
+    optimize_epub,
+    optimize_epub_bytes,
+    optimize_image,
 )
 
 # Test data for NCX processing
@@ -138,3 +153,268 @@ class TestProcessEpubHtml:
         """Verify that result is bytes."""
         result = _process_epub_html(HTML_WITH_LICENSE, book_stub)
         assert isinstance(result, bytes)
+
+
+class TestOptimizeEpub:
+    """Test EPUB members optimization (optimize_epub_bytes)."""
+
+    @pytest.fixture
+    def epub(self):
+        jpeg = io.BytesIO()
+        Image.effect_noise((64, 64), 50).convert("RGB").save(
+            jpeg, format="JPEG", quality=100
+        )
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("META-INF/container.xml", b"<container/>" * 20)
+            zf.writestr("mimetype", "application/epub+zip")
+            zf.writestr("OEBPS/style.css", b"p { margin: 0 }\n" * 50)
+            zf.writestr("OEBPS/ch1.xhtml", HTML_WITH_LICENSE)
+            zf.writestr("OEBPS/a.jpg", jpeg.getvalue())
+            zf.writestr(
+                "OEBPS/font.otf", os.urandom(100), compress_type=zipfile.ZIP_STORED
+            )
+            zf.writestr("OEBPS/ch2.xhtml", HTML_WITHOUT_MARKERS)
+        return buf.getvalue()
+
+    def test_untouched_members_are_copied_as_is(self, mock_book, epub):
+        optimized = optimize_epub_bytes(epub, mock_book)
+
+        with (
+            zipfile.ZipFile(io.BytesIO(epub)) as src,
+            zipfile.ZipFile(io.BytesIO(optimized)) as zf,
+        ):
+            assert zf.testzip() is None
+            assert zf.namelist() == [
+                "mimetype",
+                *(name for name in src.namelist() if name != "mimetype"),
+            ]
+            assert zf.getinfo("mimetype").compress_type == zipfile.ZIP_STORED
+            for name in ("META-INF/container.xml", "OEBPS/style.css", "OEBPS/font.otf"):
+                src_info, info = src.getinfo(name), zf.getinfo(name)
+                assert (info.compress_type, info.compress_size, info.CRC) == (
+                    src_info.compress_type,
+                    src_info.compress_size,
+                    src_info.CRC,
+                )
+                assert zf.read(name) == src.read(name)
+            assert b"Gutenberg preamble" not in zf.read("OEBPS/ch1.xhtml")
+            assert len(zf.read("OEBPS/a.jpg")) < len(src.read("OEBPS/a.jpg"))
+
+    @pytest.mark.parametrize("spilled", [False, True])
+    def test_members_copied_as_is_round_trip(self, mock_book, tmp_path, spilled):
+        members = {
+            "OEBPS/deflated.css": zipfile.ZIP_DEFLATED,
+            "OEBPS/stored.otf": zipfile.ZIP_STORED,
+            "OEBPS/bzip2.opf": zipfile.ZIP_BZIP2,
+            "OEBPS/lzma.ttf": zipfile.ZIP_LZMA,
+            "OEBPS/ünicode.css": zipfile.ZIP_DEFLATED,
+        }
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as zf:
+            zf.writestr("mimetype", "application/epub+zip")
+            for name, compress_type in members.items():
+                zf.writestr(name, name.encode() * 200, compress_type=compress_type)
+        epub = buf.getvalue()
+
+        if spilled:
+            source = tmp_path / "source.epub"
+            source.write_bytes(epub)
+            spiller = PayloadSpiller(tmp_path, threshold=0)
+            optimized = optimize_epub(source, mock_book, spiller).read_bytes()
+        else:
+            optimized = optimize_epub_bytes(epub, mock_book)
+
+        with (
+            zipfile.ZipFile(io.BytesIO(epub)) as src,
+            zipfile.ZipFile(io.BytesIO(optimized)) as zf,
+        ):
+            assert zf.testzip() is None
+            for name, compress_type in members.items():
+                src_info, info = src.getinfo(name), zf.getinfo(name)
+                assert (info.compress_type, info.compress_size, info.CRC) == (
+                    compress_type,
+                    src_info.compress_size,
+                    src_info.CRC,
+                )
+                assert zf.read(name) == name.encode() * 200
+
+    def test_members_are_optimized_by_pool(self, mock_book, epub, monkeypatch):
+        monkeypatch.setattr(plugins, "PENDING_EPUB_MEMBERS", 1)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            assert optimize_epub_bytes(epub, mock_book, pool=pool) == (
+                optimize_epub_bytes(epub, mock_book)
+            )
+
+
+class TestImageCache:
+    """Test optimized images cache (ImageCache) on EPUB and WebP paths."""
+
+    @pytest.fixture
+    def jpeg(self):
+        buf = io.BytesIO()
+        Image.effect_noise((64, 64), 50).convert("RGB").save(
+            buf, format="JPEG", quality=100
+        )
+        return buf.getvalue()
+
+    @staticmethod
+    def fail(_data):
+        raise AssertionError("image optimized again")
+
+    def test_epub_images_are_optimized_once(
+        self, tmp_path, mock_book, jpeg, monkeypatch
+    ):
+        epub = io.BytesIO()
+        with zipfile.ZipFile(epub, "w") as zf:
+            zf.writestr("mimetype", "application/epub+zip")
+            zf.writestr("OEBPS/a.jpg", jpeg)
+            zf.writestr("OEBPS/b.jpg", jpeg)
+        cache = ImageCache(tmp_path / "images")
+
+        optimized = optimize_epub_bytes(epub.getvalue(), mock_book, cache)
+        monkeypatch.setattr(plugins, "_optimize_epub_jpeg", self.fail)
+
+        assert optimize_epub_bytes(epub.getvalue(), mock_book, cache) == optimized
+        with zipfile.ZipFile(io.BytesIO(optimized)) as zf:
+            assert len(zf.read("OEBPS/a.jpg")) < len(jpeg)
+        assert len(list(cache.folder.iterdir())) == 1
+
+    def test_webp_conversion_is_keyed_by_encoder(self, tmp_path, jpeg, monkeypatch):
+        cache = ImageCache(tmp_path / "images")
+
+        webp = optimize_image(jpeg, cache)
+        monkeypatch.setattr(plugins.ImageProcessor, "optimize_image_content", self.fail)
+
+        assert optimize_image(jpeg, cache) == webp
+        assert webp.startswith(b"RIFF")
+        assert cache.key(jpeg, "webp") != cache.key(jpeg, "epub-jpeg")
+
+    def test_trim_evicts_least_recently_used_images(self, tmp_path):
+        cache = ImageCache(tmp_path / "images", max_size=10)
+        for index, key in enumerate(("old", "used", "new")):
+            cache.put(key, b"x" * 4)
+            os.utime(cache.folder / key, (index, index))
+        assert cache.get("old") == b"x" * 4  # now the most recently used
+
+        cache.trim()
+
+        assert sorted(path.name for path in cache.folder.iterdir()) == ["new", "old"]
+
+
+class TestEpubCache:
+    """Test optimized EPUBs cache (EpubCache) in handle_book_files."""
+
+    @pytest.fixture
+    def epub(self):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("mimetype", "application/epub+zip")
+            zf.writestr("OEBPS/ch1.xhtml", HTML_WITH_LICENSE)
+        return buf.getvalue()
+
+    def epub_entry(self, book, epub, cache):
+        files = {fname_for(book, "epub"): epub}
+        (entry,) = handle_book_files(book, files, ["epub"], epub_cache=cache)
+        return entry
+
+    def test_unchanged_epub_is_optimized_once(
+        self, tmp_path, mock_book, epub, monkeypatch
+    ):
+        cache = EpubCache(tmp_path / "epubs")
+
+        optimized = self.epub_entry(mock_book, epub, cache)
+        monkeypatch.setattr(plugins, "optimize_epub_bytes", TestImageCache.fail)
+        cached = self.epub_entry(mock_book, epub, cache)
+
+        assert optimized.path == cached.path == archive_name_for(mock_book, "epub")
+        assert optimized.fpath == cached.fpath
+        assert cached.fpath.parent == cache.folder
+        assert not cached.delete_fpath
+        with zipfile.ZipFile(cached.fpath) as zf:
+            assert b"Gutenberg preamble" not in zf.read("OEBPS/ch1.xhtml")
+        sizes = cache.sizes["en"]
+        assert (sizes.books, sizes.cached) == (2, 1)
+        assert sizes.original_size == 2 * len(epub)
+        assert sizes.optimized_size == 2 * cached.fpath.stat().st_size
+
+    def test_key_depends_on_source_book_and_optimizer(self, epub):
+        key = EpubCache.key(epub, 1, "v1")
+
+        assert EpubCache.key(epub + b"\0", 1, "v1") != key
+        assert EpubCache.key(epub, 2, "v1") != key
+        assert EpubCache.key(epub, 1, "v2") != key
+
+
+def test_optimize_image_downscales_to_max_dimension(tmp_path):
+    jpeg = io.BytesIO()
+    Image.new("RGB", (400, 200), "red").save(jpeg, format="JPEG")
+    cache = ImageCache(tmp_path / "images")
+
+    full = optimize_image(jpeg.getvalue(), cache)
+    scaled = optimize_image(jpeg.getvalue(), cache, ImageOptions(max_dimension=100))
+    small = optimize_image(jpeg.getvalue(), None, ImageOptions(max_dimension=400))
+
+    with Image.open(io.BytesIO(full)) as image:
+        assert image.size == (400, 200)
+    with Image.open(io.BytesIO(scaled)) as image:
+        assert (image.format, image.size) == ("WEBP", (100, 50))
+    assert small == full
+    assert len(list(cache.folder.iterdir())) == 2
+
+
+class TestImageEncoderSelection:
+    """Test adaptive image encoder selection (ImageProcessor.select_encoding)."""
+
+    options = ImageOptions(encoder_budget=1000)
+
+    @staticmethod
+    def encode(image, image_format, **kwargs):
+        buf = io.BytesIO()
+        image.save(buf, format=image_format, **kwargs)
+        return buf.getvalue()
+
+    def test_line_art_is_stored_lossless(self):
+        art = Image.new("L", (200, 200), 255)
+        draw = ImageDraw.Draw(art)
+        for x in range(0, 200, 7):
+            draw.line((x, 0, 200 - x, 200), fill=0)
+        png = self.encode(art, "PNG")
+
+        selected = ImageProcessor.optimize_image_content(png, self.options)
+
+        assert len(selected) < len(png) < len(optimize_image(png))
+        with Image.open(io.BytesIO(selected)) as image:
+            assert image.format == "WEBP"
+            assert image.convert("L").tobytes() == art.tobytes()
+
+    def test_original_is_kept_when_smaller(self):
+        noise = Image.effect_noise((64, 64), 80).convert("RGB")
+        jpeg = self.encode(noise, "JPEG", quality=10)
+
+        assert ImageProcessor.optimize_image_content(jpeg, self.options) == jpeg
+        assert ImageProcessor.get_stored_filename("1_noise.jpg", jpeg) == (
+            "1_noise.jpg"
+        )
+        # but downscaled images are always converted
+        downscaled = ImageProcessor.optimize_image_content(
+            jpeg, ImageOptions(max_dimension=32, encoder_budget=1000)
+        )
+        assert ImageProcessor.get_stored_filename("1_noise.jpg", downscaled) == (
+            "1_noise.webp"
+        )
+
+    def test_only_static_gifs_are_converted(self):
+        frames = [Image.new("RGB", (32, 32), color) for color in ("red", "blue")]
+        static = self.encode(frames[0], "GIF")
+        animated = self.encode(
+            frames[0], "GIF", save_all=True, append_images=frames[1:]
+        )
+
+        converted = ImageProcessor.optimize_image_content(static, self.options)
+
+        assert converted.startswith(b"RIFF")
+        assert len(converted) < len(static)
+        assert ImageProcessor.optimize_image_content(animated, self.options) == (
+            animated
+        )
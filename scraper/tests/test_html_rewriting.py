@@ -0,0 +1,194 @@
+"""Tests for the HTML rewriting engines in sources/gutenberg (soup and lxml)."""
+
+import copy
+
+import pytest
+from bs4 import BeautifulSoup
+
+from gutenberg2zim.core.rewriters.image_rewriter import StoredImage
+from gutenberg2zim.sources.gutenberg.boilerplate import (
+    BOILERPLATE,
+    ChildText,
+    remove_soup_boilerplate,
+    soup_body_text,
+)
+from gutenberg2zim.sources.gutenberg.lxml_rewriter import (
+    UnsupportedDocument,
+    rewrite_html_lxml,
+)
+from gutenberg2zim.sources.gutenberg.plugins import (
+    _infobox,
+    rewrite_html_page,
+    update_html_for_static,
+)
+from gutenberg2zim.sources.gutenberg.rewriting import render_infobox
+
+PAGES = {
+    "boilerplate": """<!DOCTYPE html>
+<html><head>
+<meta http-equiv="Content-Type" content="text/html;charset=iso-8859-1">
+<title>The Project Gutenberg eBook</title>
+<link rel="icon" href="images/cover.jpg" type="image/x-cover">
+<style>p > a { color: red; }</style>
+</head>
+<body>
+<p>Gutenberg preamble</p>
+<p>*** START OF THE PROJECT GUTENBERG EBOOK SAHARA ***</p>
+<!-- chapter 1 -->
+<h1 class="  chapter  title ">Chapter  I</h1>
+<p>Fish &amp; chips &lt;here&gt; <img src="images/map.png" alt='a "map"'></p>
+<p><a href="22094-h.htm#note1">note</a> <a>no href</a> <a href="">empty</a></p>
+<pre>
+  indented    text
+</pre>
+<script>if (a < b && c > d) {}</script>
+<p>*** END OF THE PROJECT GUTENBERG EBOOK SAHARA ***</p>
+<p>License</p>
+<p>More license</p>
+</body></html>""",
+    "end_marker_only": """<html><body>
+<p>Content</p><p>End of Project Gutenberg Etext</p><p>a</p><p>b</p><p>c</p>
+</body></html>""",
+    "single_div": """<html><head><meta charset="latin1"></head><body>
+<div>*** START OF THE PROJECT GUTENBERG EBOOK X<p>Content</p></div>
+</body></html>""",
+    "no_head": "<html><body><ruby>漢<rt>kan</rt></ruby><br><hr/></body></html>",
+    "fragment": "<p>A page without <b>html</b> element, head nor title</p>",
+}
+
+
+@pytest.mark.parametrize("name", PAGES)
+def test_lxml_rewriter_matches_soup(mock_book, name):
+    soup_book, lxml_book = mock_book, copy.deepcopy(mock_book)
+    expected = str(
+        update_html_for_static(soup_book, PAGES[name], ["html", "epub", "pdf"])
+    )
+
+    assert rewrite_html_lxml(lxml_book, PAGES[name], ["html", "epub", "pdf"]) == (
+        expected
+    )
+    assert lxml_book._cover_href == soup_book._cover_href
+
+
+def test_image_dimensions_follow_stored_images(mock_book):
+    html = """<html><head><title>t</title></head><body>
+<img src="images/plate.jpg" width="1600" height="1200">
+<img src="images/bare.jpg">
+<img src="images/shown.jpg" width="600" height="450">
+<img src="images/small.png" width="400" height="300">
+<img src="images/pct.jpg" width="100%" height="1200">
+</body></html>"""
+    downscaled = StoredImage("22094_x.webp", (1600, 1200), (800, 600))
+    image_paths = {
+        "22094_plate.webp": downscaled._replace(path="22094_plate.webp"),
+        "22094_bare.webp": downscaled._replace(path="22094_bare.webp"),
+        "22094_shown.webp": downscaled._replace(path="22094_shown.webp"),
+        "22094_small.webp": StoredImage("22094_small.webp"),
+        "22094_pct.webp": downscaled._replace(path="22094_pct.webp"),
+    }
+
+    expected = str(
+        update_html_for_static(mock_book, html, ["html"], image_paths=image_paths)
+    )
+
+    assert rewrite_html_lxml(mock_book, html, ["html"], image_paths=image_paths) == (
+        expected
+    )
+    images = [
+        (img["src"], img.get("width"), img.get("height"))
+        for img in BeautifulSoup(expected, "lxml").find_all("img")[-5:]
+    ]
+    # pages showing images at another size than the source keep it
+    assert images == [
+        ("22094_plate.webp", "800", "600"),
+        ("22094_bare.webp", "800", "600"),
+        ("22094_shown.webp", "600", "450"),
+        ("22094_small.webp", "400", "300"),
+        ("22094_pct.webp", "100%", "1200"),
+    ]
+
+
+def test_image_references_follow_stored_paths(mock_book):
+    html = """<html><head><link rel="icon" href="images/small.png"></head><body>
+<img src="images/small.png"><img src="images/anim.gif"><img src="images/pct.jpg">
+</body></html>"""
+    image_paths = {
+        "22094_small.webp": StoredImage("22094_small.png"),
+        "22094_anim.gif": StoredImage("a.webp"),
+    }
+
+    expected = str(update_html_for_static(mock_book, html, [], image_paths=image_paths))
+
+    assert rewrite_html_lxml(mock_book, html, [], image_paths=image_paths) == expected
+    page = BeautifulSoup(expected, "lxml")
+    assert page.find("link", rel="icon")["href"] == "22094_small.png"
+    assert [img["src"] for img in page.find_all("img")[-3:]] == [
+        "22094_small.png",
+        "a.webp",
+        "22094_pct.webp",
+    ]
+
+
+def test_lxml_rewriter_falls_back_to_soup(mock_book):
+    # libxml2 gives boolean attributes their name as value, BeautifulSoup none
+    html = "<html><head><title>t</title></head><body><input disabled></body></html>"
+    with pytest.raises(UnsupportedDocument):
+        rewrite_html_lxml(mock_book, html, ["html"])
+
+    assert rewrite_html_page(mock_book, html, ["html"], rewriter="lxml") == str(
+        update_html_for_static(mock_book, html, ["html"])
+    )
+
+
+def test_infobox_is_copied_from_fragment_of_formats(mock_book):
+    other_book = copy.deepcopy(mock_book)
+    other_book.book_id, other_book.title = 1, "Black & White / 50% off"
+    other_book.unsupported_formats = ["pdf"]
+
+    # the fragment of the formats is filled for each book, not changed
+    for book in (mock_book, other_book, mock_book):
+        expected = BeautifulSoup(
+            render_infobox(book, ["html", "epub", "pdf"]), "lxml"
+        ).find("div")
+        assert str(_infobox(book, ["html", "epub", "pdf"])) == str(expected)
+    assert "Black%20%26%20White%20-%2050%25%20off.1.epub" in str(
+        _infobox(other_book, ["html", "epub", "pdf"])
+    )
+
+
+def test_boilerplate_scan_finds_overlapping_markers():
+    short_line, long_line = "—" * 17 + "-", "—" * 26 + "-"
+    text = f"x ***START OF THE PROJECT GUTENBERG EBOOK y {long_line} <><><>"
+
+    found = BOILERPLATE.scan(text)
+
+    assert found["***START OF THE PROJECT GUTENBERG EBOOK"] == [2]
+    assert found["***START OF THE PROJECT GUTENBERG"] == [2]
+    assert found[long_line] == [44]
+    assert found[short_line] == [44 + 9]
+    assert "<><>" * 17 not in found
+
+
+def test_soup_boilerplate_matches_markers_within_children():
+    soup = BeautifulSoup(
+        "<html><body>\n<p>Preamble</p>\n"
+        "<p>*** START OF THE PROJECT GUTENBERG EBOOK</p>\n"
+        "<p>Content *** START OF THE PROJECT</p>\n<p> GUTENBERG EBOOK</p>\n"
+        "<script>*** END OF THE PROJECT GUTENBERG EBOOK</script>\n"
+        "<p>License</p>\n</body></html>",
+        "lxml",
+    )
+    text, contents = soup_body_text(soup.body)
+    assert text == soup.body.text
+    assert contents[-4] == ChildText(text="*** END OF THE PROJECT GUTENBERG EBOOK")
+
+    remove_soup_boilerplate(soup.body)
+
+    # neither markers split across children nor markers out of the text of
+    # the body (in <script>) count
+    assert [child.text for child in soup.body.find_all(recursive=False)] == [
+        "Content *** START OF THE PROJECT",
+        " GUTENBERG EBOOK",
+        "*** END OF THE PROJECT GUTENBERG EBOOK",
+        "License",
+    ]
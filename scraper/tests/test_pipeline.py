@@ -1,13 +1,23 @@
 """Wiring smoke tests for core.pipeline.Pipeline with mocked ports (no network)"""
 
+import asyncio
+import threading
+from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
+from zimscraperlib.zim import Archive
+
+from gutenberg2zim.core.concurrency import Stage, run_stages
+from gutenberg2zim.core.image_dedup import ImageRegistry
+from gutenberg2zim.core.journal import ScrapeJournal
 from gutenberg2zim.core.models import Work
 from gutenberg2zim.core.pipeline import Pipeline, compute_popularity
 from gutenberg2zim.core.ports import WorkRef
 from gutenberg2zim.core.progress import ScraperProgress
 from gutenberg2zim.core.work_store import WorkStore
+from gutenberg2zim.core.zim_assembler import ZimAssembler, ZimEntry
 from gutenberg2zim.sources.gutenberg.adapters import GUTENBERG_SOURCE
+from gutenberg2zim.sources.gutenberg.pipeline import GutenbergPipeline
 
 
 def make_work(work_id: str, downloads: int) -> Work:
@@ -29,14 +39,27 @@ class DummyPipeline(Pipeline):
     def setup(self) -> None:
         self.calls.append("setup")
 
-    def process_ref(self, ref: WorkRef) -> None:
+    def fetch_metadata(self, ref: WorkRef) -> Work | None:
         works = list(self.metadata.fetch([ref]))
-        if works:
-            self.store.add(works[0])
-        self.calls.append(f"process:{ref.id}")
+        if not works:
+            return None
+        self.store.add(works[0])
+        return works[0]
+
+    def download(self, work: Work) -> Work:
+        return work
+
+    def transform(self, content: Work) -> list[ZimEntry]:
+        return [ZimEntry(path=f"book_{content.id}.html", content=content.title)]
 
+    def write(self, entries: list[ZimEntry]) -> None:
+        super().write(entries)
+        self.calls.extend(f"process:{entry.path}" for entry in entries)
 
-def build_pipeline(calls: list[str], store: WorkStore) -> DummyPipeline:
+
+def build_pipeline(
+    calls: list[str], store: WorkStore, journal: ScrapeJournal | None = None
+) -> DummyPipeline:
     metadata = MagicMock(name="metadata")
     metadata.fetch.side_effect = lambda refs: [
         make_work(ref.id, downloads=100) for ref in refs
@@ -51,6 +74,7 @@ def build_pipeline(calls: list[str], store: WorkStore) -> DummyPipeline:
         formats=["html"],
         zim_name="test",
         add_lcc_shelves=False,
+        journal=journal,
     )
 
 
@@ -68,7 +92,11 @@ def test_run_calls_hooks_in_order_and_stores_works():
 
     # setup hook ran first, then every ref was processed
     assert calls[0] == "setup"
-    assert sorted(calls[1:]) == ["process:1", "process:2", "process:3"]
+    assert sorted(calls[1:]) == [
+        "process:book_1.html",
+        "process:book_2.html",
+        "process:book_3.html",
+    ]
 
     # works were stored and popularity was computed on them
     assert len(store.works) == 3
@@ -94,3 +122,182 @@ def test_compute_popularity_assigns_stars_by_downloads():
     assert popularity["1"] >= popularity["2"]
     assert popularity["2"] > popularity["3"]
     assert popularity["3"] > popularity["4"]
+
+
+def test_run_stages_chains_stages_and_reports_each_item_once():
+    done: list[int] = []
+    errors: list[tuple[str, int]] = []
+    written: list[int] = []
+    lock = threading.Lock()
+
+    def fail_on_three(item: int) -> int:
+        if item == 3:
+            raise ValueError("boom")
+        return item
+
+    def write(item: int) -> None:
+        with lock:
+            written.append(item)
+
+    stages = [
+        Stage(name="double", func=lambda item: item * 2, workers=3),
+        Stage(name="drop", func=lambda item: None if item == 4 else item, workers=2),
+        Stage(name="fail", func=lambda item: fail_on_three(item // 2), workers=2),
+        Stage(name="write", func=write, workers=1, queue_size=1),
+    ]
+
+    def on_done(item: int) -> None:
+        with lock:
+            done.append(item)
+
+    run_stages(
+        stages,
+        range(1, 11),
+        on_done=on_done,
+        on_error=lambda stage, item, _exc: errors.append((stage.name, item)),
+    )
+
+    # every input item leaves the engine exactly once, whatever happened to it
+    assert sorted(done) == list(range(1, 11))
+    assert errors == [("fail", 3)]
+    assert sorted(written) == [1, 4, 5, 6, 7, 8, 9, 10]
+
+
+def test_run_stages_runs_coroutine_stage_concurrently_in_one_thread():
+    in_flight = 0
+    max_in_flight = 0
+    threads: set[str] = set()
+
+    async def slow_double(item: int) -> int:
+        nonlocal in_flight, max_in_flight
+        threads.add(threading.current_thread().name)
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        if item == 3:
+            raise ValueError("boom")
+        return item * 2
+
+    written: list[int] = []
+    errors: list[tuple[str, int]] = []
+    run_stages(
+        [
+            Stage(name="download", func=slow_double, workers=5),
+            Stage(name="write", func=written.append, workers=1),
+        ],
+        range(1, 21),
+        on_error=lambda stage, item, _exc: errors.append((stage.name, item)),
+    )
+
+    assert threads == {"download-0"}
+    assert 1 < max_in_flight <= 5
+    assert errors == [("download", 3)]
+    assert sorted(written) == [item * 2 for item in range(1, 21) if item != 3]
+
+
+def test_resume_replays_completed_works_from_journal(tmp_path):
+    refs = [WorkRef(id=str(i), source=GUTENBERG_SOURCE) for i in (1, 2, 3)]
+    journal = ScrapeJournal(tmp_path / "test.journal", resume=False)
+    first_run = build_pipeline([], WorkStore(), journal)
+    # simulate an interrupted run: book 1 done, book 2 only fetched
+    first_run.process_ref(refs[0])
+    journal.record_metadata(refs[1], make_work("2", downloads=7))
+
+    calls: list[str] = []
+    store = WorkStore()
+    journal = ScrapeJournal(tmp_path / "test.journal", resume=True)
+    pipeline = build_pipeline(calls, store, journal)
+    with (
+        patch("gutenberg2zim.core.pipeline.generate_json_files"),
+        patch("gutenberg2zim.core.pipeline.generate_noscript_pages"),
+    ):
+        pipeline.run(refs)
+
+    # book 1 replayed from its artifact, books 2 and 3 processed
+    replayed = pipeline.assembler.add_entry.call_args_list[0].args[0]
+    assert replayed.path == "book_1.html"
+    assert replayed.fpath.read_text() == "Book 1"
+    # book 2 metadata came from the journal, not from the metadata port
+    fetched_ids = [
+        ref.id for call in pipeline.metadata.fetch.call_args_list for ref in call[0][0]
+    ]
+    assert fetched_ids == ["3"]
+    assert {work.id for work in store.works} == {"1", "2", "3"}
+    assert sorted(calls[1:]) == [
+        "process:book_1.html",
+        "process:book_2.html",
+        "process:book_3.html",
+    ]
+
+
+def test_journal_links_files_and_reseeds_image_registry(tmp_path):
+    ref = WorkRef(id="1", source=GUTENBERG_SOURCE)
+    spilled = tmp_path / "plate.webp"
+    spilled.write_bytes(b"RIFF")
+    key = b"k" * 16 + b".webp"
+    journal = ScrapeJournal(tmp_path / "test.journal", resume=False)
+
+    journal.save_entries(
+        ref,
+        [
+            ZimEntry(
+                path="1_plate.webp", fpath=spilled, delete_fpath=True, dedup_key=key
+            )
+        ],
+    )
+    journal.record_written(ref)
+
+    # hard-linked, not copied: still there once consumed by the assembler
+    assert spilled.stat().st_nlink == 2
+    spilled.unlink()
+    _, (entry,) = journal.replay(ref)
+    assert entry.fpath.read_bytes() == b"RIFF"
+    assert entry.dedup_key == key
+    registry = ImageRegistry()
+    GutenbergPipeline.replayed(SimpleNamespace(image_registry=registry), [entry])
+    assert registry.claim(key, "2_plate.webp", 4) == "1_plate.webp"
+
+
+def test_zim_assembler_holds_aliases_until_their_target_is_added(tmp_path):
+    assembler = ZimAssembler(
+        filename=tmp_path / "test.zim",
+        language="eng",
+        title="Test",
+        description="Test",
+        name="test",
+        publisher="openZIM",
+        source_creator="test",
+        tags="test",
+        with_fulltext_index=False,
+    )
+    assembler.start()
+    registry = ImageRegistry()
+    pipeline = SimpleNamespace(image_registry=registry, assembler=assembler)
+    logo, rule = ImageRegistry.key(b"logo", "a.webp"), ImageRegistry.key(b"-", "a.webp")
+    registry.claim(logo, "1_logo.webp", 4)
+    registry.claim(rule, "1_rule.webp", 1)
+
+    def write(*entries):
+        GutenbergPipeline.write(pipeline, list(entries))
+
+    # the target of an alias of an alias, stored with another book written later
+    write(
+        ZimEntry(path="2_logo.webp", alias_target="1_logo.webp", dedup_key=logo),
+        ZimEntry(path="cover.webp", alias_target="2_logo.webp"),
+        ZimEntry(path="3_logo.webp", alias_target="missing.webp", dedup_key=rule),
+    )
+    write(
+        ZimEntry(
+            path="1_logo.webp", content=b"RIFF", mimetype="image/webp", dedup_key=logo
+        )
+    )
+    # written already: added at once
+    write(ZimEntry(path="4_logo.webp", alias_target="1_logo.webp", dedup_key=logo))
+    assert registry.is_written(logo) and not registry.is_written(rule)
+    assembler.finish()
+
+    archive = Archive(tmp_path / "test.zim")
+    for path in ("1_logo.webp", "2_logo.webp", "cover.webp", "4_logo.webp"):
+        assert bytes(archive.get_item(path).content) == b"RIFF"
+    assert not archive.has_entry_by_path("3_logo.webp")
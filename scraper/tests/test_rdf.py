@@ -1,9 +1,20 @@
+import io
+import tarfile
+from unittest.mock import MagicMock, patch
+
 import pytest
+from lxml import etree
 
+from gutenberg2zim.core.ports import WorkRef
 from gutenberg2zim.sources.gutenberg.metadata import (
+    GutenbergRdfArchiveMetadata,
+    RdfFile,
+    RdfMetadataCache,
     RdfParseError,
     RdfParser,
+    _work_from_rdf,
     clean_marc_notation,
+    fetch_book_metadata,
 )
 
 RDF_HEADER = """
@@ -111,6 +122,25 @@ HTML revised by David Widger</pgterms:marc508>
 """  # noqa: E501
 
 
+@pytest.fixture(params=["lxml", "soup"])
+def backend(request, monkeypatch):
+    """Run parser tests against both backends, which must give the same results"""
+    if request.param == "lxml":
+        parse_soup = RdfParser._parse_soup
+
+        # the lxml fast path may only fall back to the soup parser for RDFs
+        # which are not well-formed XML
+        def checked_parse_soup(self):
+            try:
+                etree.fromstring(self.rdf_data.strip().encode("utf-8"))
+            except etree.XMLSyntaxError:
+                return parse_soup(self)
+            raise AssertionError("lxml backend fell back to soup parser")
+
+        monkeypatch.setattr(RdfParser, "_parse_soup", checked_parse_soup)
+    return request.param
+
+
 @pytest.mark.parametrize(
     "input_text, expected_output",
     [
@@ -129,8 +159,8 @@ def test_clean_marc_notation(input_text, expected_output):
     assert clean_marc_notation(input_text) == expected_output
 
 
-def test_rdf_parser():
-    rdf = RdfParser(BOOK_22094, 22094)
+def test_rdf_parser(backend):
+    rdf = RdfParser(BOOK_22094, 22094, backend=backend)
     parsed = rdf.parse()
     assert parsed.gid == 22094
     assert parsed.birth_year == "1806"
@@ -150,7 +180,22 @@ def test_rdf_parser():
     )
 
 
-def test_rdf_parser_minimal():
+def test_rdf_parser_files(backend):
+    parsed = RdfParser(BOOK_22094, 22094, backend=backend).parse()
+    assert parsed.files == [
+        RdfFile(
+            url="https://www.gutenberg.org/cache/epub/22094/pg22094.cover.medium.jpg",
+            media_type="image/jpeg",
+            size=24150,
+            modified="2025-08-09T08:52:44.806859",
+        )
+    ]
+    work = _work_from_rdf(BOOK_22094.strip().encode("utf-8"), 22094)
+    assert work is not None
+    assert [(fmt.name, fmt.size) for fmt in work.formats] == [("cover.medium", 24150)]
+
+
+def test_rdf_parser_minimal(backend):
     rdf = RdfParser(
         f"""
   {RDF_HEADER}
@@ -161,6 +206,7 @@ def test_rdf_parser_minimal():
 </rdf:RDF>
 """,
         1234,
+        backend=backend,
     )
     parsed = rdf.parse()
     assert parsed.gid == 1234
@@ -176,7 +222,7 @@ def test_rdf_parser_minimal():
     assert parsed.languages == []
 
 
-def test_rdf_parser_multi_languages():
+def test_rdf_parser_multi_languages(backend):
     rdf = RdfParser(
         f"""
   {RDF_HEADER}
@@ -197,6 +243,7 @@ def test_rdf_parser_multi_languages():
 </rdf:RDF>
 """,
         1234,
+        backend=backend,
     )
     parsed = rdf.parse()
     assert parsed.languages == ["ko", "fr"]
@@ -232,7 +279,7 @@ def test_rdf_parser_multi_languages():
         ),
     ],
 )
-def test_rdf_parser_cover(cover_url: str, *, expected_cover: bool):
+def test_rdf_parser_cover(cover_url: str, *, expected_cover: bool, backend):
     rdf = RdfParser(
         f"""
   {RDF_HEADER}
@@ -256,12 +303,13 @@ def test_rdf_parser_cover(cover_url: str, *, expected_cover: bool):
 </rdf:RDF>
 """,
         22094,
+        backend=backend,
     )
     parsed = rdf.parse()
     assert parsed.has_cover == expected_cover
 
 
-def test_rdf_parser_title_subtitle():
+def test_rdf_parser_title_subtitle(backend):
     rdf = RdfParser(
         f"""
   {RDF_HEADER}
@@ -273,6 +321,7 @@ def test_rdf_parser_title_subtitle():
 </rdf:RDF>
 """,  # noqa: E501
         123,
+        backend=backend,
     )
     parsed = rdf.parse()
     assert parsed.gid == 123
@@ -309,7 +358,9 @@ def test_rdf_parser_title_subtitle():
         ),
     ],
 )
-def test_rdf_parser_author(name, author_id, expected_first_name, expected_last_name):
+def test_rdf_parser_author(
+    name, author_id, expected_first_name, expected_last_name, backend
+):
     rdf = RdfParser(
         f"""
     {RDF_HEADER}
@@ -328,6 +379,7 @@ def test_rdf_parser_author(name, author_id, expected_first_name, expected_last_n
 </rdf:RDF>
 """,
         123,
+        backend=backend,
     )
     parsed = rdf.parse()
     assert parsed.gid == 123
@@ -336,7 +388,7 @@ def test_rdf_parser_author(name, author_id, expected_first_name, expected_last_n
     assert parsed.author_id == author_id
 
 
-def test_rdf_parser_title_missing_license():
+def test_rdf_parser_title_missing_license(backend):
     rdf = RdfParser(
         f"""
   {RDF_HEADER}
@@ -347,6 +399,7 @@ def test_rdf_parser_title_missing_license():
 </rdf:RDF>
 """,  # noqa: E501
         123,
+        backend=backend,
     )
     with pytest.raises(
         RdfParseError, match="Impossible to find license tag in book 123 RD"
@@ -354,7 +407,7 @@ def test_rdf_parser_title_missing_license():
         rdf.parse()
 
 
-def test_rdf_parser_title_missing_downloads():
+def test_rdf_parser_title_missing_downloads(backend):
     rdf = RdfParser(
         f"""
   {RDF_HEADER}
@@ -365,6 +418,7 @@ def test_rdf_parser_title_missing_downloads():
 </rdf:RDF>
 """,  # noqa: E501
         123,
+        backend=backend,
     )
     with pytest.raises(
         RdfParseError, match="Impossible to find download tag in book 123 RD"
@@ -407,7 +461,7 @@ def test_rdf_parser_title_missing_downloads():
         ),
     ],
 )
-def test_rdf_parser_lcc_values(input_lcc, expected_lcc):
+def test_rdf_parser_lcc_values(input_lcc, expected_lcc, backend):
     rdf = RdfParser(
         f"""
   {RDF_HEADER}
@@ -424,6 +478,81 @@ def test_rdf_parser_lcc_values(input_lcc, expected_lcc):
 </rdf:RDF>
 """,
         1234,
+        backend=backend,
     )
     parsed = rdf.parse()
     assert parsed.lcc_shelf == expected_lcc
+
+
+def test_rdf_archive_metadata(tmp_path):
+    archive_path = tmp_path / "rdf-files.tar.bz2"
+    with tarfile.open(archive_path, "w:bz2") as archive:
+        for book_id in ("22094", "99"):
+            data = BOOK_22094.replace("22094", book_id).strip().encode("utf-8")
+            info = tarfile.TarInfo(f"cache/epub/{book_id}/pg{book_id}.rdf")
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+
+    metadata = GutenbergRdfArchiveMetadata(
+        "https://mirror", archive_path, book_ids=["22094", "1234"]
+    )
+    with patch(
+        "gutenberg2zim.sources.gutenberg.metadata.fetch_book_metadata",
+        return_value=None,
+    ) as mock_fetch:
+        works = list(
+            metadata.fetch(
+                [WorkRef(id="22094", source="gutenberg"), WorkRef("1234", "gutenberg")]
+            )
+        )
+
+    # 22094 answered from the archive, 1234 (not in archive) fetched from mirror
+    assert [work.id for work in works] == ["22094"]
+    assert works[0].title.startswith("Travels in the Great Desert of Sahara")
+    mock_fetch.assert_called_once_with(1234, "https://mirror", None, None)
+
+
+def test_fetch_book_metadata_from_local_mirror(tmp_path):
+    rdf_path = tmp_path / "cache" / "epub" / "22094" / "pg22094.rdf"
+    rdf_path.parent.mkdir(parents=True)
+    rdf_path.write_text(BOOK_22094, encoding="utf-8")
+    cache = RdfMetadataCache(tmp_path / "rdf.db")
+
+    work = fetch_book_metadata(22094, tmp_path.as_uri(), cache)
+    with patch("gutenberg2zim.sources.gutenberg.metadata._work_from_rdf") as parse:
+        # unchanged RDF: not parsed again
+        assert fetch_book_metadata(22094, tmp_path.as_uri(), cache) == work
+    parse.assert_not_called()
+    assert work is not None
+    assert work.title.startswith("Travels in the Great Desert of Sahara")
+
+
+def test_rdf_metadata_cache(tmp_path):
+    def response(status_code, content=b""):
+        return MagicMock(
+            status_code=status_code,
+            content=content,
+            headers={"ETag": '"abc"', "Last-Modified": "Mon, 01 Sep 2025 00:00:00"},
+        )
+
+    cache = RdfMetadataCache(tmp_path / "rdf.db")
+    with patch(
+        "gutenberg2zim.sources.gutenberg.metadata.requests.get",
+        side_effect=[response(200, BOOK_22094.encode("utf-8")), response(304)],
+    ) as mock_get:
+        work = fetch_book_metadata(22094, "https://mirror", cache)
+        # cache reopened, as in a later run
+        cache = RdfMetadataCache(tmp_path / "rdf.db")
+        revalidated = fetch_book_metadata(22094, "https://mirror", cache)
+        # within the TTL, the cache is trusted without any request
+        cache.ttl = 3600
+        cached = fetch_book_metadata(22094, "https://mirror", cache)
+
+    assert mock_get.call_count == 2
+    assert mock_get.call_args.kwargs["headers"] == {
+        "If-None-Match": '"abc"',
+        "If-Modified-Since": "Mon, 01 Sep 2025 00:00:00",
+    }
+    assert work is not None
+    assert revalidated == work
+    assert cached == work